@@ -63,7 +63,111 @@ DBSCAN_NOISE_LABEL = -1
 EMBEDDING_CLIP_PERCENTILE = 99
 DBSCAN_MIN_SAMPLES_MIN = 2
 DBSCAN_MAX_CLUSTER_RATIO = 0.5
+# from this many embeddings clustering switches to MiniBatchKMeans, fits reused across k selection, no DBSCAN
+SCALABLE_CLUSTERING_MIN_SAMPLES = 5000
+# silhouette is O(n^2): above this many points it is computed on a label-stratified sample of this size
+SILHOUETTE_SAMPLE_SIZE = 2000
+MINIBATCH_BATCH_SIZE = 2048
+MINIBATCH_N_INIT = 3
+MINIBATCH_MAX_NO_IMPROVEMENT = 10
+# categories are clustered in parallel processes (0 = one per core) once there are this many images in total
+CLUSTERING_PROCESSES = 0
+CLUSTERING_PARALLEL_MIN_IMAGES = 2000
+# where the shared embedding matrix of a parallel run is memmapped (None = system temp dir)
+CLUSTERING_TEMP_DIR = None
+# the KMeans fits of the random states run in parallel (0 = one process per core) from this many rows
+KMEANS_SWEEP_JOBS = 0
+KMEANS_SWEEP_MIN_SAMPLES = 2000
+# /coco/clustering is served from the last materialized run; the data fingerprint is rechecked at most this often
+CLUSTER_FINGERPRINT_TTL_SECONDS = 10.0
+# bump when the clustering code changes in a way that should invalidate stored results
+CLUSTER_RESULT_VERSION = 1
+# clustering jobs run on this many threads; finished jobs (and their results) kept for retrieval
+CLUSTERING_JOB_WORKERS = 2
+CLUSTERING_JOB_HISTORY = 20
+# new images are assigned to the nearest stored centroid; a category is refit (warm-started from its centroids)
+# once its assigned images sit this much farther from their centroids than the members did at fit time
+CLUSTER_DRIFT_INERTIA_GROWTH = 1.5
+CLUSTER_DRIFT_P95_GROWTH = 1.3
+CLUSTER_DRIFT_MIN_ASSIGNED = 20
+CLUSTER_DRIFT_DISTANCES_KEPT = 1000
 TEST_SIZE = 0.2
+CAPTION_BATCH_SIZE = 8
+ENCODE_BATCH_SIZE = 64
+ENCODE_PARALLEL_MIN_TEXTS = 20000
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+QUERY_WARMUP_COUNT = 500
+INGEST_QUEUE_SIZE = 64
+INGEST_DECODE_WORKERS = 4
+INGEST_WRITE_BATCH_SIZE = 32
+INGEST_BATCH_WAIT_SECONDS = 0.5
+INGEST_STATS_LOG_INTERVAL = 30
+SCAN_WORKER_MODE = "process"
+SCAN_PROGRESS_INTERVAL = 0.5
+LATENCY_WINDOW_SIZE = 1000
+LATENCY_TRACKED_PATHS = ["/search_coco", "/search/search_coco", "/custom/search_folder", "/ask"]
+VECTOR_INDEX_METHOD = "hnsw"
+VECTOR_INDEXED_TABLES = ["images", "user_images", "coco_images"]
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 40
+IVFFLAT_LISTS = 100
+IVFFLAT_PROBES = 10
+VECTOR_FILTER_OVERFETCH = 10
+# folders with at most this many images are searched exactly (path index + sort) instead of through HNSW
+FOLDER_EXACT_SCAN_MAX_ROWS = 20000
+# "vector" ranks by embedding distance only; "hybrid" fuses full-text and ANN rankings (RRF)
+SEARCH_MODE = "vector"
+# text search configuration of the generated caption_tsv columns (changing it needs the columns rebuilt)
+FTS_LANGUAGE = "english"
+HYBRID_CANDIDATES = 50
+HYBRID_RRF_K = 60
+SUGGEST_LIMIT = 10
+# new captions/queries are pulled at most this often (and right after an ingestion)
+SUGGEST_REFRESH_SECONDS = 5.0
+# captions added since the last snapshot are scanned directly; past this many the snapshot is rebuilt
+SUGGEST_DELTA_MAX = 2000
+# one past search counts like this many captions when ranking suggestions
+SUGGEST_HISTORY_WEIGHT = 3
+SUGGEST_PREFIX_CACHE_SIZE = 4096
+# COCO search: "coco_images" = one fused (mean) vector per image, "images" = one vector per caption
+# with per-image max-sim; the fused table is used once scripts/compact_coco_images.py has filled it
+COCO_SEARCH_TABLE = "coco_images"
+# caption rows fetched per wanted image when several captions of one image compete (COCO has ~5)
+MULTI_VECTOR_OVERFETCH = 5
+# longest side in pixels; the result grid asks for "medium", history previews for "small"
+THUMBNAIL_SIZES = {"small": 192, "medium": 480, "large": 960}
+THUMBNAIL_CACHE_DIR = "cache/thumbnails"
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+THUMBNAIL_WORKERS = 4
+THUMBNAIL_QUALITY = 80
+# thumbnails are content addressed, so browsers may keep them for a long time
+THUMBNAIL_MAX_AGE = 30 * 24 * 3600
+# generate small/medium thumbnails right after ingestion instead of on the first request
+THUMBNAIL_AT_INGEST = True
+# originals: user photos may be edited in place, so they are revalidated (ETag/304) after an hour
+USER_IMAGE_CACHE_CONTROL = "private, max-age=3600"
+COCO_IMAGE_CACHE_CONTROL = "public, max-age=604800"
+# how long an existence/stat check of a served image is reused
+IMAGE_STAT_TTL_SECONDS = 5.0
+SEARCH_BACKEND = "postgres"
+VECTOR_MIRROR_DIR = "vector_mirror"
+VECTOR_MIRROR_COMPACT_EVERY = 5000
+WORD_VOCABULARY_FILE = "vector_mirror/word_vocabulary.npz"
+QUERY_WORD_CACHE_SIZE = 2048
+HISTORY_FLUSH_BATCH_SIZE = 50
+HISTORY_FLUSH_INTERVAL = 2.0
+HISTORY_BUFFER_MAX_PENDING = 10000
+RESULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESULT_CACHE_FILE = "cache/result_cache.json"
+RESULT_CACHE_VERSION_DIR = "cache"
+WATCHER_ENABLED = False
+WATCHER_DEBOUNCE_SECONDS = 2.0
+WATCHER_MAX_BATCH_SIZE = 64
+WATCHER_MAX_WAIT_SECONDS = 10.0
+# directory mtimes miss in-place edits, so every file is re-stat'ed this often
+MANIFEST_FULL_SCAN_INTERVAL_SECONDS = 24 * 3600
+WATCHER_RECONCILE_SECONDS = 3600
 
 CLUSTER_CATEGORIES = [
     "animals", "people", "buildings", "nature", "food",
@@ -1,4 +1,3 @@
-import os
 import sys
 import json
 import logging
@@ -134,41 +133,26 @@ def save_last_scan_time():
         logger.error(f"❌ שגיאה בשמירת זמן סריקה: {e}")
 
 
-def find_new_images(folder_path, last_scan_time):
-    """מציאת תמונות שנוספו מהסריקה האחרונה"""
-
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
-    new_images = []
-
+def find_new_images(folder_path):
+    """מציאת תמונות חדשות או שהשתנו מאז הסריקה האחרונה, לפי מניפסט הקבצים"""
     try:
-        logger.info(f"🔍 סורק תיקייה: {folder_path}")
-
-        for root, dirs, files in os.walk(folder_path):
-            # דילוג על תיקיות מערכת
-            dirs[:] = [d for d in dirs if not d.startswith('.') and not d.startswith('$')]
-
-            for file in files:
-                try:
-                    file_path = Path(root) / file
-
-                    # בדיקת הרחבה
-                    if file_path.suffix.lower() not in image_extensions:
-                        continue
+        from db.setup import SessionLocal
+        from db.schema import ensure_schema
+        from services.file_manifest import refresh_manifest
 
-                    # בדיקת תאריך שינוי
-                    file_modified = datetime.fromtimestamp(file_path.stat().st_mtime)
-
-                    if file_modified > last_scan_time:
-                        # בדיקת גודל קובץ (לא ריק)
-                        if file_path.stat().st_size > 0:
-                            new_images.append(str(file_path))
+        logger.info(f"🔍 סורק תיקייה: {folder_path}")
 
-                except Exception as e:
-                    logger.warning(f"⚠️ שגיאה בבדיקת קובץ {file}: {e}")
-                    continue
+        ensure_schema()
+        db = SessionLocal()
+        try:
+            # סריקה מלאה: עריכה של קובץ במקום לא משנה את ה-mtime של התיקייה
+            diff = refresh_manifest(db, folder_path, full=True)
+        finally:
+            db.close()
 
-        logger.info(f"📸 נמצאו {len(new_images)} תמונות חדשות")
-        return new_images
+        logger.info(f"📸 נמצאו {len(diff.added)} חדשות, {len(diff.modified)} שהשתנו, "
+                    f"{len(diff.moved)} שהועברו, {len(diff.deleted)} שנמחקו")
+        return diff.pending
 
     except Exception as e:
         logger.error(f"❌ שגיאה בסריקת תיקייה: {e}")
@@ -186,114 +170,64 @@ def process_images_with_smart_strategy(image_paths):
     batch_size = strategy.calculate_optimal_batch_size(total_images)
     logger.info(f"📊 גודל batch מומלץ: {batch_size} תמונות")
 
-    processed_count = 0
     start_time = time.time()
-    avg_time_per_image = None
+    pipeline = None
 
     try:
         # ייבוא הכלים
         from services.blip_captioner import Blip2Captioner
-        from services.text_encoder import encode_text
-        from db.setup import get_db
-        from db.user_image_access import add_user_image, image_exists
-
-        captioner = Blip2Captioner.get_instance()
-        db = next(get_db())
-
+        from services.ingestion_pipeline import IngestionPipeline
+        from services.file_manifest import mark_indexed
+        from db.setup import SessionLocal
+        from db.schema import ensure_schema
+
+        ensure_schema()
+
+        # הצינור בודק את מגבלות הזמן והעומס לפני כל תמונה שנכנסת אליו
+        pipeline = IngestionPipeline(
+            Blip2Captioner.get_instance(),
+            should_continue=lambda: strategy.should_continue_processing(start_time, pipeline.written, total_images)
+        )
+        summary = pipeline.run(image_paths)
+
+        # מה שנכנס למסד מסומן במניפסט; השאר יחזור בסריקה הבאה
+        db = SessionLocal()
         try:
-            while processed_count < total_images:
-                # בדיקה האם להמשיך
-                if not strategy.should_continue_processing(start_time, processed_count, total_images):
-                    logger.info(f"⏸️ עצירה זמנית. עובדו {processed_count}/{total_images} תמונות")
-                    break
-
-                # חישוב batch נוכחי
-                remaining_images = total_images - processed_count
-                current_batch_size = min(batch_size, remaining_images)
-
-                current_batch = image_paths[processed_count:processed_count + current_batch_size]
-
-                logger.info(f"🔄 מעבד batch {processed_count + 1}-{processed_count + current_batch_size}")
-
-                batch_start_time = time.time()
-                batch_processed = 0
-
-                # עיבוד הbatch הנוכחי
-                for image_path in current_batch:
-                    try:
-                        # בדיקה שהתמונה לא קיימת כבר
-                        normalized_path = image_path.replace("\\", "/")
-                        if image_exists(db, normalized_path):
-                            continue
-
-                        # עיבוד התמונה
-                        image_start_time = time.time()
-
-                        caption = captioner.generate_caption(image_path)
-                        embedding = encode_text(caption)
-                        add_user_image(db, caption, embedding.tolist(), normalized_path)
-
-                        # עדכון זמן ממוצע
-                        image_time = time.time() - image_start_time
-                        if avg_time_per_image is None:
-                            avg_time_per_image = image_time
-                        else:
-                            avg_time_per_image = (avg_time_per_image * 0.9) + (image_time * 0.1)
-
-                        batch_processed += 1
-                        processed_count += 1
-
-                        # שמירה תקופתית
-                        if batch_processed % 10 == 0:
-                            db.commit()
-                            logger.info(f"💾 נשמרו {processed_count} תמונות (זמן ממוצע: {avg_time_per_image:.1f}s)")
-
-                    except Exception as e:
-                        logger.error(f"❌ שגיאה בעיבוד {image_path}: {e}")
-                        continue
-
-                # סיום batch
-                db.commit()
-                batch_time = time.time() - batch_start_time
-
-                logger.info(f"✅ batch הושלם: {batch_processed} תמונות ב-{batch_time / 60:.1f} דקות")
-
-                # עדכון אסטרטגיה לbatch הבא
-                if avg_time_per_image:
-                    remaining = total_images - processed_count
-                    if remaining > 0:
-                        new_batch_size = strategy.calculate_optimal_batch_size(remaining, avg_time_per_image)
-                        if new_batch_size != batch_size:
-                            batch_size = new_batch_size
-                            logger.info(f"🔧 עדכון גודל batch ל-{batch_size}")
-
-            # סיכום
-            total_time = time.time() - start_time
-            remaining_images = total_images - processed_count
-
-            result = {
-                'processed': processed_count,
-                'total': total_images,
-                'remaining': remaining_images,
-                'time_taken': total_time,
-                'avg_time_per_image': avg_time_per_image,
-                'completed': remaining_images == 0
-            }
-
-            if remaining_images > 0:
-                estimated_sessions = (remaining_images / batch_size) + 1
-                logger.info(f"📈 נותרו {remaining_images} תמונות, הערכה: {estimated_sessions:.0f} סשנים נוספים")
-
-            return result
-
+            mark_indexed(db, image_paths)
         finally:
             db.close()
 
+        if summary['stopped_early']:
+            logger.info(f"⏸️ עצירה זמנית. עובדו {summary['processed']}/{total_images} תמונות")
+
+        # סיכום
+        total_time = time.time() - start_time
+        processed_count = summary['processed']
+        remaining_images = total_images - summary['consumed']
+
+        result = {
+            'processed': processed_count,
+            'total': total_images,
+            'remaining': remaining_images,
+            'time_taken': total_time,
+            'avg_time_per_image': total_time / processed_count if processed_count else None,
+            'cache_hits': summary['cache_hits'],
+            'cache_misses': summary['cache_misses'],
+            'stages': summary['stages'],
+            'completed': remaining_images == 0
+        }
+
+        if remaining_images > 0:
+            estimated_sessions = (remaining_images / batch_size) + 1
+            logger.info(f"📈 נותרו {remaining_images} תמונות, הערכה: {estimated_sessions:.0f} סשנים נוספים")
+
+        return result
+
     except Exception as e:
         logger.error(f"❌ שגיאה כללית בעיבוד חכם: {e}")
         return {
             'error': str(e),
-            'processed': processed_count,
+            'processed': pipeline.written if pipeline else 0,
             'total': total_images
         }
 
@@ -335,8 +269,7 @@ def main():
             logger.warning("⚠️ לא נמצאה תיקיית משתמש - מסיים")
             return
 
-        last_scan = get_last_scan_time()
-        new_images = find_new_images(folder_path, last_scan)
+        new_images = find_new_images(folder_path)
 
         if not new_images:
             logger.info("✅ אין תמונות חדשות לעיבוד")
@@ -353,7 +286,8 @@ def main():
             logger.info(f"🎉 עיבוד הושלם:")
             logger.info(f"   📸 עובדו: {result['processed']}/{result['total']} תמונות")
             logger.info(f"   ⏱️ זמן כולל: {result['time_taken'] / 60:.1f} דקות")
-            logger.info(f"   ⚡ זמן ממוצע לתמונה: {result.get('avg_time_per_image', 0):.1f} שניות")
+            logger.info(f"   ⚡ זמן ממוצע לתמונה: {result.get('avg_time_per_image') or 0:.1f} שניות")
+            logger.info(f"   🗃️ מטמון תיאורים: {result['cache_hits']} פגיעות, {result['cache_misses']} החטאות")
 
             if result['remaining'] > 0:
                 logger.info(f"   📋 נותרו: {result['remaining']} תמונות לסשן הבא")
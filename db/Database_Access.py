@@ -1,8 +1,11 @@
 from sqlalchemy.orm import Session
 from db.models import ImageModel
 from db.user_models import UserImageModel
+from db.coco_image_access import compact_coco_images
 def add_images(db: Session, images_data):
+    """Insert COCO caption rows; returns the (id, path, caption, embedding) of the new rows, or None on failure"""
     try:
+        images = []
         for caption, embedding, path in images_data:
             image = ImageModel(
                 caption=caption,
@@ -10,13 +13,23 @@ def add_images(db: Session, images_data):
                 image_path=path
             )
             db.add(image)
+            images.append(image)
+        # flush to get the ids before commit expires the objects
+        db.flush()
+        added = [(image.id, image.image_path, image.caption, image.embedding) for image in images]
         db.commit()
-        print("✅")
-        return True
     except Exception as e:
         db.rollback()
         print(f"❌{e}")
-        return False
+        return None
+    try:
+        # keep the one-row-per-image table in step with the caption rows
+        compact_coco_images(db, [path for _, path, _, _ in added])
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ coco_images: {e}")
+    print("✅")
+    return added
 
 def get_all_images(db: Session):
     try:
@@ -0,0 +1,66 @@
+import os
+import hashlib
+from functools import lru_cache
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from db.models import CaptionCacheModel
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _content_hash(path: str, file_size: int, mtime_ns: int) -> str:
+    # size and mtime are part of the key so an edited file is hashed again
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def compute_content_hash(path: str) -> str:
+    file_size, mtime_ns = file_signature(path)
+    return _content_hash(path, file_size, mtime_ns)
+
+
+def get_cached_result(db: Session, path: str) -> Optional[Tuple[str, list]]:
+    """Return (caption, embedding) for a file whose content was already captioned, or None."""
+    clean_path = path.replace("\\", "/")
+    file_size, mtime_ns = file_signature(path)
+    # fast pre-check: same path, same size and mtime - no need to read the file
+    entry = db.query(CaptionCacheModel).filter_by(
+        image_path=clean_path, file_size=file_size, mtime_ns=mtime_ns
+    ).first()
+    if entry is None:
+        content_hash = _content_hash(path, file_size, mtime_ns)
+        entry = db.query(CaptionCacheModel).filter_by(content_hash=content_hash).first()
+        if entry is None:
+            return None
+        # the file was moved or copied - remember where we saw it last
+        entry.image_path = clean_path
+        entry.file_size = file_size
+        entry.mtime_ns = mtime_ns
+    return entry.caption, entry.embedding
+
+
+def store_cached_result(db: Session, path: str, caption: str, embedding) -> None:
+    """Remember the caption and embedding of a file by its content hash. The caller commits."""
+    clean_path = path.replace("\\", "/")
+    file_size, mtime_ns = file_signature(path)
+    content_hash = _content_hash(path, file_size, mtime_ns)
+    entry = db.query(CaptionCacheModel).filter_by(content_hash=content_hash).first()
+    if entry is None:
+        entry = CaptionCacheModel(content_hash=content_hash)
+        db.add(entry)
+    entry.image_path = clean_path
+    entry.file_size = file_size
+    entry.mtime_ns = mtime_ns
+    entry.caption = caption
+    entry.embedding = embedding
+    # the session does not autoflush - flush so a copy later in the same batch finds this row
+    db.flush()
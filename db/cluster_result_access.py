@@ -0,0 +1,179 @@
+import json
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+from db.models import ClusterRunModel, ClusterModel, ClusterImageLink, ClusterCategoryModel, ExtraTrainingImage
+
+
+def dataset_fingerprint(db: Session, *extra) -> str:
+    """
+    Cheap digest of extra_training_images (row count, newest id and a hash of every row's path,
+    captions and category), salted with extra values such as the classifier version. Embeddings
+    are derived from the image at the path, so they are left out to keep this a fast scan.
+    """
+    row = db.execute(text("""
+        SELECT COUNT(*) AS images, COALESCE(MAX(id), 0) AS last_id,
+               COALESCE(SUM(hashtext(image_path || '|' || caption || '|' || COALESCE(blip_caption, '')
+                                     || '|' || COALESCE(category, ''))::bigint), 0) AS content
+        FROM extra_training_images
+    """)).one()
+    raw = ":".join(str(value) for value in (row.images, row.last_id, row.content, *extra))
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def save_cluster_run(db: Session, fingerprint: str, result: List[Dict], image_count: int,
+                     seconds: Optional[float] = None, models: Optional[Dict] = None,
+                     settings: Optional[str] = None) -> int:
+    """
+    Store result as the current run and drop the previous ones, in one transaction. models maps a
+    category to its fitted state (services/cluster_assignment.CategoryModel), whose centroids are
+    in the order of the category's clusters in result.
+    """
+    models = models or {}
+    run = ClusterRunModel(fingerprint=fingerprint, settings=settings, image_count=image_count, seconds=seconds)
+    db.add(run)
+    db.flush()
+    clusters = []
+    for category_position, category_data in enumerate(result):
+        for position, cluster in enumerate(category_data["clusters"]):
+            quality = cluster.get("quality") or {}
+            model = models.get(category_data["category"])
+            clusters.append((cluster, ClusterModel(
+                run_id=run.id,
+                category=category_data["category"],
+                category_position=category_position,
+                position=position,
+                name=cluster["name"],
+                confidence=int(round(quality.get("coherence", 0) * 100)),
+                keywords=[quality["dominant_theme"]] if quality.get("dominant_theme") else [],
+                quality=quality,
+                centroid=model.centroids[position].tolist() if model is not None else None,
+            )))
+    db.add_all([model for _, model in clusters])
+    db.add_all([ClusterCategoryModel(
+        run_id=run.id, category=category, clip=float(model.clip), scaler_mean=model.mean.tolist(),
+        scaler_scale=model.scale.tolist(), fit_inertia=model.fit_inertia, fit_p95=model.fit_p95,
+        assigned_count=model.assigned_count, assigned_sq_sum=model.assigned_sq_sum,
+        assigned_distances=list(model.assigned_distances),
+    ) for category, model in models.items()])
+    db.flush()
+    links = [{"cluster_id": model.id, "image_path": image["path"], "caption": image["caption"] or ""}
+             for cluster, model in clusters for image in cluster["images"]]
+    if links:
+        db.execute(insert(ClusterImageLink), links)
+    db.execute(text("""
+        DELETE FROM cluster_images WHERE cluster_id IN (
+            SELECT id FROM clusters WHERE run_id IS DISTINCT FROM :run_id
+        )
+    """), {"run_id": run.id})
+    db.execute(text("DELETE FROM clusters WHERE run_id IS DISTINCT FROM :run_id"), {"run_id": run.id})
+    db.execute(text("DELETE FROM cluster_category_models WHERE run_id <> :run_id"), {"run_id": run.id})
+    db.execute(text("DELETE FROM cluster_runs WHERE id <> :run_id"), {"run_id": run.id})
+    db.commit()
+    return run.id
+
+
+def latest_cluster_run(db: Session) -> Optional[ClusterRunModel]:
+    return db.query(ClusterRunModel).order_by(ClusterRunModel.id.desc()).first()
+
+
+def load_cluster_run(db: Session, run_id: int) -> List[Dict]:
+    """The stored result in the shape process_enhanced_clusters returns it"""
+    rows = db.execute(text("""
+        SELECT c.id, c.category, c.name, c.quality, l.image_path, l.caption
+        FROM clusters c LEFT JOIN cluster_images l ON l.cluster_id = c.id
+        WHERE c.run_id = :run_id
+        ORDER BY c.category_position, c.position, l.id
+    """), {"run_id": run_id})
+    result: List[Dict] = []
+    clusters: Dict[int, Dict] = {}
+    for row in rows:
+        cluster = clusters.get(row.id)
+        if cluster is None:
+            if not result or result[-1]["category"] != row.category:
+                result.append({"category": row.category, "clusters": []})
+            cluster = clusters[row.id] = {"name": row.name, "quality": row.quality or {}, "images": []}
+            result[-1]["clusters"].append(cluster)
+        if row.image_path is not None:
+            cluster["images"].append({"caption": row.caption, "path": row.image_path})
+    return result
+
+
+def cluster_run_info(run: Optional[ClusterRunModel]) -> Optional[Dict]:
+    if run is None:
+        return None
+    return {"id": run.id, "fingerprint": run.fingerprint, "settings": run.settings, "images": run.image_count,
+            "seconds": run.seconds, "created_at": run.created_at.isoformat() if run.created_at else None}
+
+
+def load_category_models(db: Session, run_id: int) -> List[Tuple[ClusterCategoryModel, List]]:
+    """Every category model of the run with its clusters (id, position, centroid, members) in position order"""
+    models = db.query(ClusterCategoryModel).filter(ClusterCategoryModel.run_id == run_id).all()
+    rows = db.execute(text("""
+        SELECT c.id, c.category, c.position, c.centroid, COUNT(l.id) AS members
+        FROM clusters c LEFT JOIN cluster_images l ON l.cluster_id = c.id
+        WHERE c.run_id = :run_id AND c.centroid IS NOT NULL
+        GROUP BY c.id ORDER BY c.category, c.position
+    """), {"run_id": run_id}).fetchall()
+    by_category: Dict[str, List] = {}
+    for row in rows:
+        by_category.setdefault(row.category, []).append(row)
+    return [(model, by_category.get(model.category, [])) for model in models]
+
+
+def record_assignments(db: Session, run_id: int, category: str, count: int, sq_sum: float,
+                       distances: List[float]) -> None:
+    db.execute(text("""
+        UPDATE cluster_category_models
+        SET assigned_count = :count, assigned_sq_sum = :sq_sum, assigned_distances = CAST(:distances AS JSON)
+        WHERE run_id = :run_id AND category = :category
+    """), {"count": count, "sq_sum": sq_sum, "distances": json.dumps(distances), "run_id": run_id,
+           "category": category})
+
+
+def add_cluster_links(db: Session, links: List[Dict]) -> None:
+    if links:
+        db.execute(insert(ClusterImageLink), links)
+
+
+def unassigned_images(db: Session, run_id: int) -> List[ExtraTrainingImage]:
+    """extra_training_images rows that are not in any cluster of the run"""
+    return db.query(ExtraTrainingImage).filter(text("""
+        NOT EXISTS (
+            SELECT 1 FROM cluster_images l JOIN clusters c ON c.id = l.cluster_id
+            WHERE c.run_id = :run_id AND l.image_path = extra_training_images.image_path
+        )
+    """)).params(run_id=run_id).all()
+
+
+def sync_cluster_links(db: Session, run_id: int) -> int:
+    """Drop members whose image is gone and refresh the captions of the rest; returns the rows removed"""
+    removed = db.execute(text("""
+        DELETE FROM cluster_images l USING clusters c
+        WHERE c.id = l.cluster_id AND c.run_id = :run_id
+          AND NOT EXISTS (SELECT 1 FROM extra_training_images e WHERE e.image_path = l.image_path)
+    """), {"run_id": run_id}).rowcount
+    db.execute(text("""
+        UPDATE cluster_images l SET caption = COALESCE(NULLIF(e.blip_caption, ''), e.caption)
+        FROM clusters c, extra_training_images e
+        WHERE c.id = l.cluster_id AND c.run_id = :run_id AND e.image_path = l.image_path
+          AND l.caption IS DISTINCT FROM COALESCE(NULLIF(e.blip_caption, ''), e.caption)
+    """), {"run_id": run_id})
+    return removed
+
+
+def set_run_fingerprint(db: Session, run_id: int, fingerprint: str) -> None:
+    """The run now reflects the dataset with this fingerprint (after incremental assignment)"""
+    db.execute(text("""
+        UPDATE cluster_runs
+        SET fingerprint = :fingerprint,
+            image_count = (SELECT COUNT(DISTINCT l.image_path) FROM cluster_images l
+                           JOIN clusters c ON c.id = l.cluster_id WHERE c.run_id = :run_id)
+        WHERE id = :run_id
+    """), {"fingerprint": fingerprint, "run_id": run_id})
+
+
+def images_by_path(db: Session, paths: List[str]) -> Dict[str, ExtraTrainingImage]:
+    images = db.query(ExtraTrainingImage).filter(ExtraTrainingImage.image_path.in_(paths)).all() if paths else []
+    return {image.image_path: image for image in images}
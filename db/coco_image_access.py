@@ -0,0 +1,62 @@
+import json
+from typing import Iterable, List, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+def compact_coco_images(db: Session, paths: Optional[Iterable[str]] = None) -> int:
+    """
+    Fold the caption rows of images into one coco_images row per image: the mean of the
+    caption embeddings (cosine ignores the length, so no normalization is needed) and the
+    caption closest to that mean. paths=None converts the whole table and drops images that
+    are gone; otherwise only the given images are refreshed (used after every COCO insert).
+    Returns the number of image rows written.
+    """
+    paths = None if paths is None else sorted(set(paths))
+    if paths is not None and not paths:
+        return 0
+    scope = "" if paths is None else "WHERE image_path = ANY(:paths)"
+    params = {} if paths is None else {"paths": paths}
+    written = db.execute(text(f"""
+        INSERT INTO coco_images (image_path, caption, captions, caption_count, embedding)
+        SELECT image_path, MIN(caption), STRING_AGG(caption, E'\\n' ORDER BY id), COUNT(*), AVG(embedding)
+        FROM images
+        {scope}
+        GROUP BY image_path
+        ON CONFLICT (image_path) DO UPDATE SET
+            captions = EXCLUDED.captions,
+            caption_count = EXCLUDED.caption_count,
+            embedding = EXCLUDED.embedding
+    """), params).rowcount
+    db.execute(text(f"""
+        UPDATE coco_images c SET caption = (
+            SELECT i.caption FROM images i
+            WHERE i.image_path = c.image_path
+            ORDER BY i.embedding <=> c.embedding
+            LIMIT 1
+        )
+        {scope.replace("image_path", "c.image_path")}
+    """), params)
+    if paths is None:
+        db.execute(text("""
+            DELETE FROM coco_images c
+            WHERE NOT EXISTS (SELECT 1 FROM images i WHERE i.image_path = c.image_path)
+        """))
+    db.commit()
+    return written
+
+
+def get_coco_image_rows(db: Session, paths: Iterable[str]) -> List[tuple]:
+    """(id, image_path, caption, embedding) of the coco_images rows of the given images"""
+    rows = db.execute(text("""
+        SELECT id, image_path, caption, embedding FROM coco_images WHERE image_path = ANY(:paths)
+    """), {"paths": sorted(set(paths))}).fetchall()
+    return [(row.id, row.image_path, row.caption, _parse(row.embedding)) for row in rows]
+
+
+def coco_images_ready(db: Session) -> bool:
+    return bool(db.execute(text("SELECT EXISTS (SELECT 1 FROM coco_images)")).scalar())
+
+
+def _parse(embedding):
+    return json.loads(embedding) if isinstance(embedding, str) else embedding
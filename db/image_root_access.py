@@ -0,0 +1,117 @@
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from db.user_models import ImageRootModel
+from db.vector_index import ensure_root_vector_index, drop_root_vector_index
+from config import FOLDER_EXACT_SCAN_MAX_ROWS
+
+
+class FolderScope(NamedTuple):
+    """Predicate of a folder-scoped user image search, and whether it should skip the vector index"""
+    where: str
+    params: Dict
+    exact: bool
+    root_id: Optional[int]
+    rows: Optional[int]
+
+
+def path_key(path: str) -> str:
+    """Same normalization as the generated user_images.path_key column, without a trailing slash"""
+    return path.replace("\\", "/").lower().strip().rstrip("/")
+
+
+def _like_prefix(key: str) -> str:
+    escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}/%"
+
+
+def register_root(db: Session, folder_path: str) -> int:
+    """
+    Make folder_path an image root: existing rows under it are assigned to it, new rows are
+    assigned by the insert trigger, and it gets its own partial vector index.
+    """
+    key = path_key(folder_path)
+    db.execute(insert(ImageRootModel).values(path_key=key).on_conflict_do_nothing(index_elements=["path_key"]))
+    root_id = db.execute(text("SELECT id FROM image_roots WHERE path_key = :key"), {"key": key}).scalar()
+    # a nested root takes over its rows from the shorter root that contained them
+    db.execute(text("""
+        UPDATE user_images SET root_id = :root_id
+        WHERE path_key LIKE :pattern ESCAPE '\\'
+          AND (root_id IS NULL OR root_id IN (SELECT id FROM image_roots WHERE LENGTH(path_key) < :length))
+    """), {"root_id": root_id, "pattern": _like_prefix(key), "length": len(key)})
+    ensure_root_vector_index(db.connection(), root_id)
+    db.execute(text("ANALYZE user_images"))
+    db.commit()
+    return root_id
+
+
+def retire_other_roots(db: Session, folder_path: str) -> List[int]:
+    """
+    Unregister every root except folder_path: drop its partial vector index and give its rows to
+    the longest root that still contains them, as the insert trigger would. Returns the retired ids.
+    """
+    key = path_key(folder_path)
+    retired = [row[0] for row in db.execute(
+        text("DELETE FROM image_roots WHERE path_key <> :key RETURNING id"), {"key": key})]
+    if retired:
+        db.execute(text("""
+            UPDATE user_images u SET root_id = (
+                SELECT r.id FROM image_roots r
+                WHERE STARTS_WITH(u.path_key || '/', r.path_key || '/')
+                ORDER BY LENGTH(r.path_key) DESC
+                LIMIT 1
+            )
+            WHERE u.root_id = ANY(:retired)
+        """), {"retired": retired})
+        for root_id in retired:
+            drop_root_vector_index(db.connection(), root_id)
+    db.commit()
+    return retired
+
+
+def list_roots(db: Session) -> List[Dict]:
+    rows = db.execute(text("""
+        SELECT r.id, r.path_key, COUNT(u.id) AS images
+        FROM image_roots r LEFT JOIN user_images u ON u.root_id = r.id
+        GROUP BY r.id, r.path_key ORDER BY r.path_key
+    """))
+    return [{"id": row.id, "path": row.path_key, "images": row.images} for row in rows]
+
+
+def find_root(db: Session, key: str) -> Optional[ImageRootModel]:
+    """The longest registered root that is key itself or one of its parent folders"""
+    return db.query(ImageRootModel).filter(
+        text("STARTS_WITH(:key || '/', image_roots.path_key || '/')")
+    ).params(key=key).order_by(text("LENGTH(image_roots.path_key) DESC")).first()
+
+
+def _nested_root_ids(db: Session, key: str) -> List[int]:
+    """Roots registered below key; the trigger gives their rows to them, not to the root above"""
+    return [row[0] for row in db.execute(text(
+        "SELECT id FROM image_roots WHERE path_key LIKE :pattern ESCAPE '\\'"), {"pattern": _like_prefix(key)})]
+
+
+def folder_scope(db: Session, folder_path: str) -> FolderScope:
+    """
+    Build the filter of a search in folder_path so that its cost follows the size of the folder:
+    a registered root is served by its partial vector index; a subfolder, an unregistered folder
+    or a root with other roots nested in it is counted through the path_key btree, and when
+    small enough searched exactly without ANN.
+    """
+    key = path_key(folder_path)
+    root = find_root(db, key)
+    nested = _nested_root_ids(db, key) if root is not None else []
+    # root ids are interpolated so the planner can match the predicate of the partial index
+    if root is not None and root.path_key == key and not nested:
+        return FolderScope(f"root_id = {int(root.id)}", {}, False, root.id, None)
+    conditions = ["path_key LIKE :folder_pattern ESCAPE '\\'"]
+    params = {"folder_pattern": _like_prefix(key)}
+    if root is not None:
+        root_ids = ", ".join(str(int(root_id)) for root_id in [root.id, *nested])
+        conditions.insert(0, f"root_id IN ({root_ids})")
+    rows = db.execute(text(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM user_images WHERE {' AND '.join(conditions)} LIMIT :cap) folder"
+    ), {**params, "cap": FOLDER_EXACT_SCAN_MAX_ROWS + 1}).scalar()
+    return FolderScope(" AND ".join(conditions), params, rows <= FOLDER_EXACT_SCAN_MAX_ROWS,
+                       root.id if root is not None else None, rows)
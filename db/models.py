@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, JSON, Float, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from datetime import datetime
 from pgvector.sqlalchemy import Vector
 from db.setup import Base
+from config import FTS_LANGUAGE
 
 class ImageModel(Base):
     __tablename__ = "images"
@@ -10,6 +12,18 @@ class ImageModel(Base):
     blip_caption = Column(String, nullable=True)
     embedding = Column(Vector(384), nullable=False)
     image_path = Column(String, nullable=False)
+    caption_tsv = Column(TSVECTOR, Computed(f"to_tsvector('{FTS_LANGUAGE}', COALESCE(caption, ''))", persisted=True))
+class CocoImageModel(Base):
+    """One row per COCO image: the mean of its caption embeddings, built from images by compaction"""
+    __tablename__ = "coco_images"
+    id = Column(Integer, primary_key=True, index=True)
+    image_path = Column(String, nullable=False, unique=True)
+    # the caption closest to the fused embedding, shown as the result caption
+    caption = Column(String, nullable=False)
+    captions = Column(Text, nullable=False)
+    caption_count = Column(Integer, nullable=False)
+    embedding = Column(Vector(384), nullable=False)
+    caption_tsv = Column(TSVECTOR, Computed(f"to_tsvector('{FTS_LANGUAGE}', COALESCE(captions, ''))", persisted=True))
 class SearchHistory(Base):
     __tablename__ = "search_history"
     id = Column(Integer, primary_key=True, index=True)
@@ -25,6 +39,16 @@ class ExtraTrainingImage(Base):
     embedding = Column(Vector(384), nullable=False)
     category = Column(String, nullable=True)
 
+class ClusterRunModel(Base):
+    """One materialized /coco/clustering result and the fingerprint of the data it was computed from"""
+    __tablename__ = "cluster_runs"
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String(32), nullable=False, index=True)
+    # digest of the classifier and clustering settings alone: while it matches, new images are assigned incrementally
+    settings = Column(String(32), nullable=True)
+    image_count = Column(Integer, nullable=False)
+    seconds = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
 class ClusterModel(Base):
     __tablename__ = "clusters"
     id = Column(Integer, primary_key=True, index=True)
@@ -32,10 +56,43 @@ class ClusterModel(Base):
     confidence = Column(Integer, nullable=False)
     keywords = Column(JSON, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    run_id = Column(Integer, nullable=True, index=True)
+    category = Column(String, nullable=True)
+    # order of the category in the result, then of the cluster inside it
+    category_position = Column(Integer, nullable=True)
+    position = Column(Integer, nullable=True)
+    quality = Column(JSON, nullable=True)
+    # mean of the members in the standardized space of the category (see ClusterCategoryModel)
+    centroid = Column(Vector(384), nullable=True)
+class ClusterCategoryModel(Base):
+    """Fitted state of one category of a cluster run: clipping and scaler, fit and assignment distances"""
+    __tablename__ = "cluster_category_models"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, nullable=False, index=True)
+    category = Column(String, nullable=False)
+    clip = Column(Float, nullable=False)
+    scaler_mean = Column(Vector(384), nullable=False)
+    scaler_scale = Column(Vector(384), nullable=False)
+    # mean squared / 95th percentile member-to-centroid distance at fit time
+    fit_inertia = Column(Float, nullable=False)
+    fit_p95 = Column(Float, nullable=False)
+    assigned_count = Column(Integer, nullable=False, default=0)
+    assigned_sq_sum = Column(Float, nullable=False, default=0.0)
+    # the most recent assignment distances, for the percentile drift check
+    assigned_distances = Column(JSON, nullable=False, default=list)
 class ClusterImageLink(Base):
     __tablename__ = "cluster_images"
     id = Column(Integer, primary_key=True, index=True)
-    cluster_id = Column(Integer, nullable=False)
+    cluster_id = Column(Integer, nullable=False, index=True)
     image_path = Column(String, nullable=False)
     caption = Column(String, nullable=False)
-
+class CaptionCacheModel(Base):
+    __tablename__ = "caption_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False, unique=True, index=True)
+    image_path = Column(String, nullable=False, index=True)
+    file_size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    caption = Column(String, nullable=False)
+    embedding = Column(Vector(384), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
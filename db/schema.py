@@ -0,0 +1,108 @@
+from sqlalchemy import text
+from db.setup import Base, engine
+from db.models import (CaptionCacheModel, CocoImageModel, ClusterRunModel, ClusterModel, ClusterImageLink,
+                       ClusterCategoryModel)
+from db.user_models import FileManifestModel, ScanDirectoryModel, ImageRootModel
+from db.vector_index import ensure_vector_indexes
+from config import FTS_LANGUAGE
+
+# tables that the application creates on its own; the original tables are managed by hand
+MANAGED_TABLES = [
+    CaptionCacheModel.__table__,
+    CocoImageModel.__table__,
+    FileManifestModel.__table__,
+    ScanDirectoryModel.__table__,
+    ImageRootModel.__table__,
+    ClusterRunModel.__table__,
+    ClusterModel.__table__,
+    ClusterImageLink.__table__,
+    ClusterCategoryModel.__table__,
+]
+
+# idempotent DDL for the hand-managed tables, applied in order
+SCHEMA_STATEMENTS = [
+    # paths are stored normalized, so one row per path; drop old duplicates before enforcing it
+    """
+    DELETE FROM user_images a
+    USING user_images b
+    WHERE a.image_path = b.image_path AND a.id > b.id
+      AND NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'ux_user_images_image_path')
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_user_images_image_path ON user_images (image_path)",
+    # COCO compaction and multi-vector search group the caption rows of one image
+    "CREATE INDEX IF NOT EXISTS ix_images_image_path ON images (image_path)",
+    # folder scoping: normalized path computed by Postgres on every insert/update, prefix-searchable
+    """
+    ALTER TABLE user_images ADD COLUMN IF NOT EXISTS path_key TEXT
+        GENERATED ALWAYS AS (LOWER(REPLACE(image_path, CHR(92), '/'))) STORED
+    """,
+    "ALTER TABLE user_images ADD COLUMN IF NOT EXISTS root_id INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_user_images_path_key ON user_images (path_key text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_user_images_root_id ON user_images (root_id)",
+    # generated columns are not computed yet in BEFORE triggers, so the key is derived here as well
+    """
+    CREATE OR REPLACE FUNCTION user_images_assign_root() RETURNS trigger AS $$
+    BEGIN
+        NEW.root_id := (
+            SELECT r.id FROM image_roots r
+            WHERE STARTS_WITH(LOWER(REPLACE(NEW.image_path, CHR(92), '/')) || '/', r.path_key || '/')
+            ORDER BY LENGTH(r.path_key) DESC
+            LIMIT 1
+        );
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_user_images_assign_root ON user_images",
+    """
+    CREATE TRIGGER trg_user_images_assign_root
+    BEFORE INSERT OR UPDATE OF image_path ON user_images
+    FOR EACH ROW EXECUTE FUNCTION user_images_assign_root()
+    """,
+    # materialized clustering results; the cluster tables predate the run columns
+    *(f"ALTER TABLE clusters ADD COLUMN IF NOT EXISTS {column}" for column in (
+        "run_id INTEGER", "category VARCHAR", "category_position INTEGER", "position INTEGER", "quality JSON",
+        "centroid vector(384)",
+    )),
+    "ALTER TABLE cluster_runs ADD COLUMN IF NOT EXISTS settings VARCHAR(32)",
+    "ALTER TABLE scan_directories ADD COLUMN IF NOT EXISTS full_scan_at BIGINT",
+    "CREATE INDEX IF NOT EXISTS ix_clusters_run_id ON clusters (run_id)",
+    "CREATE INDEX IF NOT EXISTS ix_cluster_images_cluster_id ON cluster_images (cluster_id)",
+    # hybrid search: caption words kept as a generated tsvector, matched through a GIN index
+    *(statement for table in ("images", "user_images") for statement in (
+        f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS caption_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('{FTS_LANGUAGE}', COALESCE(caption, ''))) STORED
+        """,
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_caption_tsv ON {table} USING gin (caption_tsv)",
+    )),
+    # caption suggestions fall back to ILIKE '%...%', which a trigram GIN index can answer; creating
+    # the extension needs privileges the app user may lack, so that only skips the indexes
+    """
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN insufficient_privilege THEN
+        RAISE NOTICE 'pg_trgm is not available, caption suggestions will not use trigram indexes';
+    END
+    $$
+    """,
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+            CREATE INDEX IF NOT EXISTS ix_images_caption_trgm ON images USING gin (caption gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS ix_user_images_caption_trgm ON user_images USING gin (caption gin_trgm_ops);
+        END IF;
+    END
+    $$
+    """,
+]
+
+
+def ensure_schema():
+    Base.metadata.create_all(bind=engine, tables=MANAGED_TABLES, checkfirst=True)
+    with engine.begin() as conn:
+        for statement in SCHEMA_STATEMENTS:
+            conn.execute(text(statement))
+        ensure_vector_indexes(conn)
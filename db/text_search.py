@@ -0,0 +1,31 @@
+import logging
+from typing import Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from db.vector_index import DEFAULT_WHERE, _check_table
+from config import FTS_LANGUAGE
+logger = logging.getLogger(__name__)
+
+
+def fulltext_search(db: Session, table: str, query: str, query_vec: str, limit: int,
+                    columns: str = "image_path, caption", where: str = DEFAULT_WHERE,
+                    params: Optional[Dict] = None):
+    """
+    Captions matching the words of query (websearch syntax: quotes, OR, -word), best ts_rank_cd
+    first, found through the GIN index on caption_tsv. The cosine distance to query_vec is
+    computed for the returned rows only, so they can be shown like vector hits.
+    """
+    _check_table(table)
+    sql = f"""
+        SELECT matched.*, embedding <=> CAST(:query_vec AS vector) AS distance FROM (
+            SELECT id, {columns}, embedding, ts_rank_cd(caption_tsv, tsq) AS text_rank
+            FROM {table}, websearch_to_tsquery(:language, :query) AS tsq
+            WHERE caption_tsv @@ tsq AND {where}
+            ORDER BY text_rank DESC
+            LIMIT :limit
+        ) matched
+        ORDER BY text_rank DESC
+    """
+    values = {"query": query, "query_vec": query_vec, "limit": int(limit), "language": FTS_LANGUAGE}
+    values.update(params or {})
+    return db.execute(text(sql), values)
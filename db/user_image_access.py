@@ -1,14 +1,34 @@
+from typing import Optional, Set
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from db.user_models import UserImageModel
-def add_user_image(db: Session, caption: str, embedding, path: str):
+from db.caption_cache_access import store_cached_result
+EXISTING_PATHS_FETCH_SIZE = 10000
+def add_user_image(db: Session, caption: str, embedding, path: str, commit: bool = True) -> Optional[int]:
+    """Insert a user image unless its path is already indexed. Returns the new row id, or None if it was."""
     clean_path = path.replace("\\", "/")
-    image = UserImageModel(
+    statement = insert(UserImageModel).values(
         caption=caption,
         embedding=embedding,
         image_path=clean_path
+    ).on_conflict_do_nothing(index_elements=[UserImageModel.image_path]).returning(UserImageModel.id)
+    row_id = db.execute(statement).scalar()
+    try:
+        # write-through, so a copy or a move of this file is never captioned again
+        store_cached_result(db, path, caption, embedding)
+    except OSError:
+        pass
+    if commit:
+        db.commit()
+    return row_id
+
+def get_existing_image_paths(db: Session) -> Set[str]:
+    """All indexed user image paths, streamed in one query instead of one SELECT per file"""
+    result = db.execute(
+        select(UserImageModel.image_path).execution_options(yield_per=EXISTING_PATHS_FETCH_SIZE)
     )
-    db.add(image)
-    db.commit()
+    return {row[0] for row in result}
 
 def image_exists(db: Session, path: str) -> bool:
     clean_path = path.replace("\\", "/")
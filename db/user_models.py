@@ -1,11 +1,55 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, BigInteger, String, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from pgvector.sqlalchemy import Vector
 from db.setup import Base
+from config import FTS_LANGUAGE
 
 class UserImageModel(Base):
     __tablename__ = "user_images"
+    __table_args__ = (
+        Index("ux_user_images_image_path", "image_path", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     caption = Column(String, nullable=False)
     embedding = Column(Vector(384), nullable=False)
-    image_path = Column(String, nullable=False)
\ No newline at end of file
+    image_path = Column(String, nullable=False)
+    # lower-cased, forward-slash form of image_path for indexed folder filters
+    path_key = Column(String, Computed("LOWER(REPLACE(image_path, CHR(92), '/'))", persisted=True))
+    # the registered image root (user folder) the file lives under, set by a trigger on insert
+    root_id = Column(Integer, nullable=True)
+    # caption words for the full-text leg of hybrid search
+    caption_tsv = Column(TSVECTOR, Computed(f"to_tsvector('{FTS_LANGUAGE}', COALESCE(caption, ''))", persisted=True))
+
+
+class ImageRootModel(Base):
+    """A user folder that searches are scoped to; each root gets its own partial vector index"""
+    __tablename__ = "image_roots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    path_key = Column(String, nullable=False, unique=True)
+
+
+class FileManifestModel(Base):
+    """Last known on-disk state of every image file under a scanned folder"""
+    __tablename__ = "file_manifest"
+
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String, nullable=False, unique=True, index=True)
+    dir_path = Column(String, nullable=False, index=True)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    inode = Column(BigInteger, nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)
+    status = Column(String, nullable=False, default="pending")
+
+
+class ScanDirectoryModel(Base):
+    """Directory mtimes from the last scan, used to skip directories whose listing did not change"""
+    __tablename__ = "scan_directories"
+
+    id = Column(Integer, primary_key=True, index=True)
+    path = Column(String, nullable=False, unique=True, index=True)
+    parent_path = Column(String, nullable=True, index=True)
+    mtime_ns = Column(BigInteger, nullable=False)
+    full_scan_at = Column(BigInteger, nullable=True)  # epoch seconds of the last full reconcile (root rows only)
@@ -0,0 +1,181 @@
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from config import (VECTOR_INDEX_METHOD, VECTOR_INDEXED_TABLES, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+                    IVFFLAT_LISTS, IVFFLAT_PROBES, VECTOR_FILTER_OVERFETCH, MULTI_VECTOR_OVERFETCH)
+# tables whose rows carry a root_id and get one partial index per registered image root
+ROOT_INDEXED_TABLES = ("user_images",)
+logger = logging.getLogger(__name__)
+INDEX_METHODS = ("hnsw", "ivfflat")
+DEFAULT_WHERE = "embedding IS NOT NULL"
+
+
+def index_name(table: str, method: str) -> str:
+    return f"ix_{table}_embedding_{method}"
+
+
+def root_index_name(table: str, root_id: int, method: str) -> str:
+    return f"ix_{table}_embedding_root{int(root_id)}_{method}"
+
+
+def _check_table(table: str) -> None:
+    # table names are interpolated into SQL, so only the managed ones are accepted
+    if table not in VECTOR_INDEXED_TABLES:
+        raise ValueError(f"{table} has no managed vector index")
+
+
+def _create_statement(table: str, method: str, m: int, ef_construction: int, lists: int,
+                      root_id: Optional[int] = None) -> str:
+    if method == "hnsw":
+        options = f"(m = {int(m)}, ef_construction = {int(ef_construction)})"
+    elif method == "ivfflat":
+        options = f"(lists = {int(lists)})"
+    else:
+        raise ValueError(f"Unknown vector index method: {method}")
+    if root_id is None:
+        return (f"CREATE INDEX IF NOT EXISTS {index_name(table, method)} "
+                f"ON {table} USING {method} (embedding vector_cosine_ops) WITH {options}")
+    # partial index: a search scoped to the root walks a graph of that root's rows only
+    return (f"CREATE INDEX IF NOT EXISTS {root_index_name(table, root_id, method)} "
+            f"ON {table} USING {method} (embedding vector_cosine_ops) WITH {options} "
+            f"WHERE root_id = {int(root_id)}")
+
+
+def _root_ids(conn) -> List[int]:
+    return [row[0] for row in conn.execute(text("SELECT id FROM image_roots ORDER BY id"))]
+
+
+def ensure_root_vector_index(conn, root_id: int, method: str = VECTOR_INDEX_METHOD, m: int = HNSW_M,
+                             ef_construction: int = HNSW_EF_CONSTRUCTION, lists: int = IVFFLAT_LISTS) -> None:
+    """Create the partial index of one image root (and drop the one of the other method)"""
+    for table in ROOT_INDEXED_TABLES:
+        for other in INDEX_METHODS:
+            if other != method:
+                conn.execute(text(f"DROP INDEX IF EXISTS {root_index_name(table, root_id, other)}"))
+        conn.execute(text(_create_statement(table, method, m, ef_construction, lists, root_id)))
+
+
+def drop_root_vector_index(conn, root_id: int) -> None:
+    for table in ROOT_INDEXED_TABLES:
+        for method in INDEX_METHODS:
+            conn.execute(text(f"DROP INDEX IF EXISTS {root_index_name(table, root_id, method)}"))
+
+
+def ensure_vector_indexes(conn, method: str = VECTOR_INDEX_METHOD, m: int = HNSW_M,
+                          ef_construction: int = HNSW_EF_CONSTRUCTION, lists: int = IVFFLAT_LISTS) -> None:
+    """Create the configured cosine index on every managed table and drop the index of the other method"""
+    for table in VECTOR_INDEXED_TABLES:
+        for other in INDEX_METHODS:
+            if other != method:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index_name(table, other)}"))
+        conn.execute(text(_create_statement(table, method, m, ef_construction, lists)))
+    for root_id in _root_ids(conn):
+        ensure_root_vector_index(conn, root_id, method, m, ef_construction, lists)
+
+
+def rebuild_vector_index(conn, table: str, method: str = VECTOR_INDEX_METHOD, m: int = HNSW_M,
+                         ef_construction: int = HNSW_EF_CONSTRUCTION, lists: int = IVFFLAT_LISTS) -> None:
+    """
+    Drop and build the index of one table again, e.g. after changing m/ef_construction, or for
+    IVFFlat once the table has grown well past the size it was trained on.
+    """
+    _check_table(table)
+    for existing in INDEX_METHODS:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name(table, existing)}"))
+    conn.execute(text(_create_statement(table, method, m, ef_construction, lists)))
+    if table in ROOT_INDEXED_TABLES:
+        for root_id in _root_ids(conn):
+            drop_root_vector_index(conn, root_id)
+            conn.execute(text(_create_statement(table, method, m, ef_construction, lists, root_id)))
+    conn.execute(text(f"ANALYZE {table}"))
+
+
+def describe_vector_indexes(db: Session) -> List[Dict]:
+    rows = db.execute(text("""
+        SELECT tablename, indexname, indexdef, pg_relation_size(indexname::regclass) AS size_bytes
+        FROM pg_indexes
+        WHERE tablename = ANY(:tables) AND indexname LIKE 'ix_%_embedding_%'
+    """), {"tables": list(VECTOR_INDEXED_TABLES)})
+    return [{"table": row.tablename, "index": row.indexname, "definition": row.indexdef,
+             "size_bytes": row.size_bytes} for row in rows]
+
+
+def apply_search_params(db: Session, ef_search: Optional[int] = None, probes: Optional[int] = None,
+                        candidates: int = 0, exact: bool = False) -> None:
+    """
+    Set the recall/speed knobs for the current transaction only. ef_search is raised to the
+    number of candidates requested, otherwise HNSW cannot return that many rows. exact=True
+    keeps the planner off the vector index, so a small filtered set (e.g. a folder found
+    through the path index) is scanned and sorted completely.
+    """
+    if exact:
+        # bitmap scans stay allowed, which is how the btree filter on the folder is still used
+        db.execute(text("SET LOCAL enable_indexscan = off"))
+    ef_search = max(int(ef_search or HNSW_EF_SEARCH), candidates)
+    db.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+    db.execute(text(f"SET LOCAL ivfflat.probes = {max(1, int(probes or IVFFLAT_PROBES))}"))
+
+
+def _search_sql(table: str, columns: str, where: str, per_path: bool = False) -> str:
+    # the inner ORDER BY + LIMIT is what lets the planner walk the index; the threshold is
+    # applied to the few candidates afterwards, and the distance is computed once per row
+    nearest = f"""
+            SELECT {columns}, embedding <=> CAST(:query_vec AS vector) AS distance
+            FROM {table}
+            WHERE {where}
+            ORDER BY embedding <=> CAST(:query_vec AS vector)
+            LIMIT :candidates
+    """
+    if per_path:
+        # multi-vector rows (several captions per image): an image scores as its best caption (max-sim)
+        nearest = f"""
+            SELECT DISTINCT ON (image_path) * FROM ({nearest}) candidates
+            ORDER BY image_path, distance
+        """
+    return f"""
+        SELECT * FROM ({nearest}) nearest
+        WHERE distance <= :threshold
+        ORDER BY distance
+        LIMIT :limit
+    """
+
+
+def _prepare(db: Session, table: str, query_vec: str, limit: int, threshold: float, columns: str, where: str,
+             params: Optional[Dict], ef_search: Optional[int], probes: Optional[int], exact: bool = False,
+             per_path: bool = False):
+    _check_table(table)
+    # extra filters are evaluated on index candidates, so a filtered search over-fetches
+    filtered = where.strip() != DEFAULT_WHERE and not exact
+    candidates = int(limit) * (VECTOR_FILTER_OVERFETCH if filtered else 1) * (MULTI_VECTOR_OVERFETCH if per_path else 1)
+    apply_search_params(db, ef_search, probes, candidates, exact)
+    values = {"query_vec": query_vec, "threshold": float(threshold), "limit": int(limit), "candidates": candidates}
+    values.update(params or {})
+    return _search_sql(table, columns, where, per_path), values
+
+
+def vector_search(db: Session, table: str, query_vec: str, limit: int, threshold: float,
+                  columns: str = "image_path, caption", where: str = DEFAULT_WHERE,
+                  params: Optional[Dict] = None, ef_search: Optional[int] = None,
+                  probes: Optional[int] = None, exact: bool = False, per_path: bool = False):
+    """
+    Nearest neighbours of query_vec (a pgvector literal) by cosine distance, closest first, within
+    threshold. per_path=True returns one row per image_path, the closest of its rows.
+    """
+    sql, values = _prepare(db, table, query_vec, limit, threshold, columns, where, params, ef_search, probes,
+                           exact, per_path)
+    return db.execute(text(sql), values)
+
+
+def explain_vector_search(db: Session, table: str, query_vec: str, limit: int, threshold: float,
+                          columns: str = "image_path, caption", where: str = DEFAULT_WHERE,
+                          params: Optional[Dict] = None, ef_search: Optional[int] = None,
+                          probes: Optional[int] = None, analyze: bool = True, exact: bool = False,
+                          per_path: bool = False) -> List[str]:
+    """EXPLAIN output of the exact query vector_search runs, to verify that the index is used"""
+    sql, values = _prepare(db, table, query_vec, limit, threshold, columns, where, params, ef_search, probes,
+                           exact, per_path)
+    options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+    plan = [row[0] for row in db.execute(text(f"EXPLAIN ({options}) {sql}"), values)]
+    db.rollback()
+    return plan
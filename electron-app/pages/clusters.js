@@ -19,7 +19,10 @@ async function fetchClusters() {
       throw new Error(`❌ API Error ${response.status}: ${text}`);
     }
 
-    const data = await response.json();
+    // 202: no stored clustering yet, the server started a job - follow it instead of waiting on one request
+    const data = response.status === 202
+      ? await waitForClusteringJob((await response.json()).job_id)
+      : await response.json();
     console.log("📊 Clusters data received:", data);
 
     if (!data || data.length === 0) {
@@ -49,6 +52,31 @@ async function fetchClusters() {
   }
 }
 
+async function waitForClusteringJob(jobId) {
+  const jobUrl = `http://localhost:8001/coco/clustering/jobs/${jobId}`;
+  const progressElement = document.getElementById('loadingProgress');
+  while (true) {
+    const response = await fetch(jobUrl);
+    if (!response.ok) {
+      throw new Error(`❌ API Error ${response.status}: ${await response.text()}`);
+    }
+    const job = await response.json();
+    if (job.status === 'done') {
+      const result = await fetch(`${jobUrl}/result`);
+      return result.json();
+    }
+    if (job.status === 'failed' || job.status === 'cancelled') {
+      throw new Error(`❌ Clustering ${job.status}: ${job.error || ''}`);
+    }
+    const progress = job.progress;
+    if (progressElement && progress.categories_total > 0) {
+      const current = progress.current_category ? ` (${progress.current_category})` : '';
+      progressElement.textContent = `Clustering categories: ${progress.categories_done}/${progress.categories_total}${current}`;
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+}
+
 function showState(activeState) {
   const states = ['loadingState', 'categoryContent', 'errorState', 'emptyState'];
   states.forEach(state => {
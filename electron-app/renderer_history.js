@@ -96,11 +96,11 @@ function createEnhancedPreviewImage(query, results) {
 
     if (firstResult.path && firstResult.path.startsWith("http")) {
       // COCO images - נתיב מלא
-      imageSrc = firstResult.path;
+      imageSrc = `${firstResult.path}?size=small`;
       console.log("🌐 COCO image URL:", imageSrc);
     } else if (firstResult.filename && firstResult.path) {
       // Personal images - צריך לבנות נתיב
-      imageSrc = `http://localhost:8001/image/?filename=${encodeURIComponent(firstResult.filename)}&folder_path=${encodeURIComponent(firstResult.path)}`;
+      imageSrc = `http://localhost:8001/image/?filename=${encodeURIComponent(firstResult.filename)}&folder_path=${encodeURIComponent(firstResult.path)}&size=small`;
       console.log("💻 Personal image URL:", imageSrc);
     } else {
       console.log("❌ No valid path found in result:", firstResult);
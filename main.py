@@ -1,4 +1,6 @@
-from fastapi import FastAPI
+import time
+import threading
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from routes.image_routes import router as image_router
 from routes.custom_search_routes import router as custom_search_router
@@ -10,6 +12,19 @@ from routes import caption_suggestions
 from routes.history_routes import router as history_router
 from routes.chatbot_routes import router as chatbot_router
 from routes import user_folder_routes
+from db.schema import ensure_schema
+from services.folder_watcher import FolderWatcher
+from services.scan_worker import ScanWorker
+from services.latency_stats import latency_recorder
+from services.vector_mirror import load_mirrors
+from services.word_vocabulary import get_vocabulary
+from services.result_cache import get_result_cache
+from services.text_encoder import query_embedding_cache
+from services.search_history_buffer import SearchHistoryBuffer
+from services.suggestion_index import get_suggestion_index
+from services.cluster_results import get_cluster_result_store
+from db.setup import SessionLocal
+from config import WATCHER_ENABLED, LATENCY_TRACKED_PATHS, SEARCH_BACKEND
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -24,6 +39,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_search_latency(request: Request, call_next):
+    if request.url.path not in LATENCY_TRACKED_PATHS:
+        return await call_next(request)
+    during_scan = ScanWorker.get_instance().busy
+    started = time.perf_counter()
+    response = await call_next(request)
+    latency_recorder.record(request.url.path, (time.perf_counter() - started) * 1000, during_scan)
+    return response
+
+
 app.include_router(search_router, prefix="/search", tags=["search"])
 app.include_router(image_router)
 app.include_router(custom_search_router, prefix="/custom", tags=["Custom Search"])
@@ -36,6 +63,87 @@ app.include_router(daily_routes.router)
 app.include_router(history_router)
 app.include_router(chatbot_router)
 
+
+def _load_vector_mirrors():
+    db = SessionLocal()
+    try:
+        load_mirrors(db)
+    finally:
+        db.close()
+
+
+def _warm_query_embeddings():
+    db = SessionLocal()
+    try:
+        warmed = query_embedding_cache.warm(db)
+        print(f"🔥 {warmed} popular queries pre-encoded")
+    except Exception as e:
+        print(f"❌ query embedding warmup: {e}")
+    finally:
+        db.close()
+
+
+def _build_word_vocabulary():
+    db = SessionLocal()
+    try:
+        get_vocabulary().build(db)
+    except Exception as e:
+        print(f"❌ word vocabulary: {e}")
+    finally:
+        db.close()
+
+
+def _build_suggestion_index():
+    db = SessionLocal()
+    try:
+        get_suggestion_index().build(db)
+    except Exception as e:
+        print(f"❌ suggestion index: {e}")
+    finally:
+        db.close()
+
+
+def _warm_cluster_results():
+    db = SessionLocal()
+    try:
+        get_cluster_result_store().warm(db)
+    except Exception as e:
+        print(f"❌ clustering results: {e}")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def on_startup():
+    ensure_schema()
+    get_result_cache().load()
+    threading.Thread(target=_warm_query_embeddings, name="query-embedding-warmup", daemon=True).start()
+    # only caption words that are not in the saved vocabulary get encoded
+    threading.Thread(target=_build_word_vocabulary, name="word-vocabulary-build", daemon=True).start()
+    # /suggest_captions answers from Postgres (trigram index) until this is done
+    threading.Thread(target=_build_suggestion_index, name="suggestion-index-build", daemon=True).start()
+    # /coco/clustering is served from the stored run, recomputed here if the images changed meanwhile
+    threading.Thread(target=_warm_cluster_results, name="cluster-results-warmup", daemon=True).start()
+    if SEARCH_BACKEND == "memory":
+        # searches use Postgres until the mirrors are loaded
+        threading.Thread(target=_load_vector_mirrors, name="vector-mirror-load", daemon=True).start()
+    folder_path = daily_routes.get_user_folder_path()
+    if folder_path:
+        # the user folder gets its own partial vector index (a no-op when it already has one); older roots are retired
+        threading.Thread(target=user_folder_routes.register_image_root, args=(folder_path,),
+                         name="image-root-register", daemon=True).start()
+    if WATCHER_ENABLED and folder_path:
+        FolderWatcher.get_instance().start(folder_path)
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    FolderWatcher.get_instance().stop()
+    ScanWorker.get_instance().shutdown()
+    get_vocabulary().save()
+    get_result_cache().save()
+    SearchHistoryBuffer.get_instance().stop()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
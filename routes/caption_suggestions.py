@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from db.setup import get_db
+from services.suggestion_index import get_suggestion_index
+from config import SUGGEST_LIMIT
 import logging
 
 router = APIRouter()
@@ -12,51 +14,19 @@ logger = logging.getLogger(__name__)
 
 
 @router.get("/suggest_captions")
-def suggest_captions(prefix: str = Query(..., min_length=1), db: Session = Depends(get_db)):
+def suggest_captions(prefix: str = Query(..., min_length=1),
+                     limit: int = Query(SUGGEST_LIMIT, ge=1, le=50),
+                     db: Session = Depends(get_db)):
     try:
-        logger.info(f"🔍 מחפש הצעות עבור: '{prefix}'")
+        # אינדקס בזיכרון - בלי גישה למסד הנתונים בכל הקשה
+        suggestions = get_suggestion_index().suggest(prefix, limit)
+        if suggestions is not None:
+            logger.debug(f"✅ {len(suggestions)} הצעות מהאינדקס עבור: '{prefix}'")
+            return suggestions
 
-        # שאילתה משופרת עם ILIKE וטיפול בחיפוש מדויק יותר
-        query_coco = text("""
-                          SELECT caption
-                          FROM images
-                          WHERE caption ILIKE :prefix
-                          GROUP BY caption
-                          ORDER BY LENGTH(caption), caption
-                          LIMIT 8
-                          """)
-
-        query_user = text("""
-                          SELECT caption
-                          FROM user_images
-                          WHERE caption ILIKE :prefix
-                          GROUP BY caption
-                          ORDER BY LENGTH(caption), caption
-                          LIMIT 8
-                          """)
-
-        results_coco = db.execute(query_coco, {"prefix": f"%{prefix}%"}).fetchall()
-        results_user = db.execute(query_user, {"prefix": f"%{prefix}%"}).fetchall()
-
-        logger.info(f"📊 נמצאו {len(results_coco)} תוצאות COCO ו-{len(results_user)} תוצאות משתמש")
-
-        captions = set()
-
-        for row in results_coco:
-            if row[0] and len(row[0].strip()) > 0:
-                captions.add(row[0].strip())
-
-        # הוספת תוצאות משתמש
-        for row in results_user:
-            if row[0] and len(row[0].strip()) > 0:
-                captions.add(row[0].strip())
-
-        # המרה לרשימה וסידור לפי אורך
-        suggestions = sorted(list(captions), key=lambda x: (len(x), x.lower()))[:10]
-
-        logger.info(f"✅ מחזיר {len(suggestions)} הצעות: {suggestions[:3]}...")
-
-        return suggestions
+        # האינדקס עדיין נבנה - חיפוש במסד הנתונים (אינדקס טריגרמים)
+        logger.info(f"🔍 האינדקס עדיין נבנה, מחפש הצעות במסד הנתונים עבור: '{prefix}'")
+        return _suggest_from_db(prefix, limit, db)
 
     except Exception as e:
         logger.error(f"❌ שגיאה בחיפוש הצעות: {str(e)}")
@@ -64,6 +34,38 @@ def suggest_captions(prefix: str = Query(..., min_length=1), db: Session = Depen
         return []
 
 
+def _suggest_from_db(prefix: str, limit: int, db: Session):
+    """ILIKE על התיאורים - נענה מאינדקס pg_trgm כשהוא קיים, מדורג לפי שכיחות"""
+    query = text("""
+                 SELECT caption, SUM(occurrences) AS occurrences
+                 FROM (
+                     SELECT caption, COUNT(*) AS occurrences FROM images
+                     WHERE caption ILIKE :prefix GROUP BY caption
+                     UNION ALL
+                     SELECT caption, COUNT(*) AS occurrences FROM user_images
+                     WHERE caption ILIKE :prefix GROUP BY caption
+                 ) matches
+                 GROUP BY caption
+                 ORDER BY SUM(occurrences) DESC, LENGTH(caption), caption
+                 LIMIT :limit
+                 """)
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    rows = db.execute(query, {"prefix": f"%{escaped}%", "limit": limit * 2}).fetchall()
+
+    suggestions = []
+    for row in rows:
+        caption = " ".join(row[0].split()) if row[0] else ""
+        if caption and caption not in suggestions:
+            suggestions.append(caption)
+    return suggestions[:limit]
+
+
+@router.get("/suggestion_stats")
+def suggestion_stats():
+    """מצב אינדקס ההצעות: גודל, דלתא, רענונים"""
+    return get_suggestion_index().stats()
+
+
 @router.get("/test_suggestions")
 def test_suggestions(db: Session = Depends(get_db)):
     """endpoint לבדיקת קיום נתונים בטבלאות"""
@@ -7,6 +7,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from db.setup import get_db
 from db.models import SearchHistory, ImageModel
+from services.search_history_buffer import record_search
 from collections import Counter
 import requests
 
@@ -76,9 +77,7 @@ async def chatbot_answer(request: Request, db: Session = Depends(get_db)):
 
     # שמירה להיסטוריית חיפושים – רק אם יש טקסט תקני
     if question:
-        new_search = SearchHistory(query=question)
-        db.add(new_search)
-        db.commit()
+        record_search(question)
 
     # בונה הקשר מהמסד ומבצע שיחה
     context = build_context_from_db(db)
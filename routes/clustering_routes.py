@@ -1,32 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from db.setup import get_db
-from services.enhanced_cluster_processing_service import process_enhanced_clusters
+from services.cluster_results import get_cluster_result_store
+from services.clustering_jobs import get_clustering_jobs
 
 router = APIRouter()
 
 @router.get("/coco/clustering")
-def get_clusters(db: Session = Depends(get_db)):
+def get_clusters(response: Response, db: Session = Depends(get_db)):
     try:
-        print("🚀 Starting enhanced cluster processing...")
-
-        # בדיקת מסד נתונים
-        try:
-            from db.models import ExtraTrainingImage
-            images_count = db.query(ExtraTrainingImage).count()
-            print(f"📊 Found {images_count} images in the database")
-
-            if images_count == 0:
-                print("❌ No images in the database - returning empty result")
-                return []
-        except Exception as db_error:
-            print(f"❌ Database error: {db_error}")
-            raise HTTPException(status_code=500, detail=f"Database error: {str(db_error)}")
-
-        # ביצוע קלאסטרינג משופר
-        result = process_enhanced_clusters(db)
-        print(f"✅ Enhanced clustering completed. Returning {len(result)} categories")
-
+        # תוצאה שמורה מהמסד; חישוב מחדש ברקע רק כשהתמונות השתנו
+        store = get_cluster_result_store()
+        result, run = store.get(db)
+        if run is None:
+            # אין עדיין תוצאה שמורה - get() כבר הגיש job; עם אותו fingerprint (מהמטמון) מקבלים אותו בחזרה
+            job = store.recompute_in_background(store.fingerprint(db))
+            return JSONResponse(status_code=202, content=job,
+                                headers={"Location": f"/coco/clustering/jobs/{job['job_id']}"})
+        response.headers["X-Clustering-Run"] = str(run["id"])
+        response.headers["X-Clustering-Stale"] = "1" if run["stale"] else "0"
         return result
 
     except Exception as e:
@@ -36,6 +30,53 @@ def get_clusters(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Enhanced clustering error: {str(e)}")
 
 
+@router.post("/coco/clustering/refresh")
+def refresh_clusters():
+    return get_cluster_result_store().recompute_in_background()
+
+
+@router.post("/coco/clustering/refit", status_code=202)
+def refit_clusters():
+    # רק קטגוריות שהתמונות החדשות שלהן התרחקו מהמרכזים
+    return get_cluster_result_store().refit_in_background()
+
+
+@router.post("/coco/clustering/jobs", status_code=202)
+def submit_clustering_job(max_clusters_per_category: Optional[int] = Query(None, ge=1, le=50)):
+    return get_clustering_jobs().submit({"max_clusters_per_category": max_clusters_per_category})
+
+
+@router.get("/coco/clustering/jobs")
+def list_clustering_jobs():
+    return get_clustering_jobs().list()
+
+
+@router.get("/coco/clustering/jobs/{job_id}")
+def clustering_job_status(job_id: str):
+    status = get_clustering_jobs().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Clustering job not found")
+    return status
+
+
+@router.get("/coco/clustering/jobs/{job_id}/result")
+def clustering_job_result(job_id: str):
+    status = get_clustering_jobs().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Clustering job not found")
+    if status["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Clustering job is {status['status']}")
+    return get_clustering_jobs().result(job_id)
+
+
+@router.delete("/coco/clustering/jobs/{job_id}")
+def cancel_clustering_job(job_id: str):
+    status = get_clustering_jobs().cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Clustering job not found")
+    return status
+
+
 @router.get("/coco/clustering/debug")
 def debug_clusters(db: Session = Depends(get_db)):
     debug_info = {
@@ -70,4 +111,6 @@ def debug_clusters(db: Session = Depends(get_db)):
     except Exception as e:
         debug_info["classifier_status"] = f"error: {str(e)}"
 
+    debug_info["materialized"] = get_cluster_result_store().stats(db)
+
     return debug_info
\ No newline at end of file
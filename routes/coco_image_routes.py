@@ -1,12 +1,19 @@
-
-from fastapi import APIRouter
-from fastapi.responses import FileResponse
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
 import os
+from services.image_serving import cached_stat, conditional_file_response
+from routes.image_routes import serve_thumbnail
+from config import COCO_IMAGE_CACHE_CONTROL
 router = APIRouter()
 COCO_IMAGE_DIR = r"D:\coco\val2017"
 @router.get("/coco_images/{filename}")
-def serve_coco_image(filename: str):
-    image_path = os.path.join(COCO_IMAGE_DIR, filename)
-    if not os.path.exists(image_path):
-        return {"detail": "Image not found"}
-    return FileResponse(image_path)
+async def serve_coco_image(request: Request, filename: str,
+                           size: Optional[str] = Query(None, description="thumbnail size")):
+    image_path = os.path.join(COCO_IMAGE_DIR, os.path.basename(filename))
+    stat = cached_stat(image_path)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if size:
+        return await serve_thumbnail(request, image_path, size)
+    # COCO files never change, so they may be cached for long and revalidated cheaply
+    return conditional_file_response(request, image_path, COCO_IMAGE_CACHE_CONTROL, stat=stat)
@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import APIRouter, Query, HTTPException, Depends
 from sqlalchemy.orm import Session
 from db.setup import get_db
@@ -12,6 +13,10 @@ router = APIRouter()
 def search_user_folder(
         query: str = Query(..., description="Textual description to search for"),
         folder_path: str = Query(..., description="Absolute path to the user's image folder"),
+        ef_search: Optional[int] = Query(None, ge=1, le=1000, description="HNSW candidate list size"),
+        probes: Optional[int] = Query(None, ge=1, description="IVFFlat lists to visit"),
+        mode: Optional[str] = Query(None, pattern="^(vector|hybrid)$",
+                                    description="vector, or hybrid (full-text + vector, rank fused)"),
         db: Session = Depends(get_db)
 ):
     """
@@ -21,6 +26,9 @@ def search_user_folder(
     </summary>
     <param name="query">The textual description provided by the user</param>
     <param name="folder_path">The full path to the image folder on the user's computer</param>
+    <param name="ef_search">Optional HNSW candidate list size for this request</param>
+    <param name="probes">Optional number of IVFFlat lists to visit for this request</param>
+    <param name="mode">Optional ranking mode, defaults to SEARCH_MODE</param>
     <param name="db">The database session, injected by FastAPI</param>
     <returns>A list of matching images ranked by similarity</returns>
     """
@@ -35,7 +43,7 @@ def search_user_folder(
         except ImportError as e:
             logger.error(f"Import error: {e}")
             raise HTTPException(status_code=500, detail=f"Import error: {str(e)}")
-        results = search_in_user_folder(query, folder_path, db)
+        results = search_in_user_folder(query, folder_path, db, ef_search=ef_search, probes=probes, mode=mode)
         logger.info(f"Custom search completed successfully. Found {len(results) if results else 0} results")
         return {"results": results or []}
     except HTTPException:
@@ -5,12 +5,14 @@ import logging
 import json
 import os
 import asyncio
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 router = APIRouter()
+_manifest_lock = threading.Lock()
 
 # משתנים גלובליים למעקב על סריקה פעילה
 current_scan_status = {
@@ -20,8 +22,11 @@ current_scan_status = {
     "current_image": "",
     "start_time": None,
     "errors": 0,
-    "can_cancel": True
+    "can_cancel": True,
+    "stages": {}
 }
+# ה-future של העבודה שרצה ב-ScanWorker, כדי שביטול יעצור רק אותה
+_scan_future = None
 
 
 class ScanRequest(BaseModel):
@@ -82,46 +87,31 @@ def get_last_scan_time():
     return datetime.now() - timedelta(hours=25)
 
 
-def find_new_images_since_last_scan(folder_path, last_scan_time):
-    """מציאת תמונות שלא קיימות במסד נתונים"""
-    from db.setup import get_db
-    from db.user_image_access import image_exists
-
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
-    new_images = []
+def find_new_images_since_last_scan(folder_path, last_scan_time, refresh=True):
+    """
+    מציאת תמונות שלא קיימות במסד נתונים - לפי מניפסט הקבצים, רק תיקיות שהשתנו נסרקות.
+    refresh=False לבדיקות סטטוס: רק השוואה, בלי לעדכן את המניפסט ואת user_images.
+    חוסם (מערכת קבצים + מסד) - לקרוא מחוץ ל-event loop.
+    """
+    from db.setup import SessionLocal
+    from services.file_manifest import refresh_manifest, diff_manifest
 
     try:
         logger.info(f"🔍 סורק תיקייה לתמונות לא מעובדות: {folder_path}")
 
-        db = next(get_db())
-
+        db = SessionLocal()
         try:
-            for root, dirs, files in os.walk(folder_path):
-                dirs[:] = [d for d in dirs if not d.startswith('.') and not d.startswith('$')]
-
-                for file in files:
-                    try:
-                        file_path = Path(root) / file
-
-                        if file_path.suffix.lower() not in image_extensions:
-                            continue
-
-                        if file_path.stat().st_size == 0:
-                            continue
-
-                        normalized_path = str(file_path).replace("\\", "/")
-                        if not image_exists(db, normalized_path):
-                            new_images.append(normalized_path)
-
-                    except Exception as e:
-                        logger.warning(f"⚠️ שגיאה בבדיקת קובץ {file}: {e}")
-                        continue
-
+            if refresh:
+                # רק סריקה אחת מעדכנת את האינדקס בכל רגע
+                with _manifest_lock:
+                    diff = refresh_manifest(db, folder_path)
+            else:
+                diff = diff_manifest(db, folder_path)
         finally:
             db.close()
 
-        logger.info(f"📸 נמצאו {len(new_images)} תמונות לא מעובדות")
-        return new_images
+        logger.info(f"📸 נמצאו {len(diff.pending)} תמונות לא מעובדות ({diff.summary()})")
+        return diff.pending
 
     except Exception as e:
         logger.error(f"❌ שגיאה בסריקת תיקייה: {e}")
@@ -143,7 +133,7 @@ async def daily_check():
             }
 
         last_scan = get_last_scan_time()
-        new_images = find_new_images_since_last_scan(folder_path, last_scan)
+        new_images = await asyncio.to_thread(find_new_images_since_last_scan, folder_path, last_scan, False)
 
         return {
             "has_new_images": len(new_images) > 0,
@@ -169,7 +159,8 @@ async def get_scan_progress():
         "errors": current_scan_status["errors"],
         "percentage": round((current_scan_status["processed"] / current_scan_status["total"]) * 100, 1) if
         current_scan_status["total"] > 0 else 0,
-        "can_cancel": current_scan_status["can_cancel"]
+        "can_cancel": current_scan_status["can_cancel"],
+        "stages": current_scan_status["stages"]
     }
 
 
@@ -199,7 +190,7 @@ async def start_async_scan(request: Optional[ScanRequest] = None, background_tas
 
         # מציאת תמונות חדשות
         last_scan = get_last_scan_time()
-        new_images = find_new_images_since_last_scan(folder_path, last_scan)
+        new_images = await asyncio.to_thread(find_new_images_since_last_scan, folder_path, last_scan)
 
         if not new_images and not request.force:
             return {
@@ -219,7 +210,8 @@ async def start_async_scan(request: Optional[ScanRequest] = None, background_tas
             "current_image": "",
             "start_time": datetime.now(),
             "errors": 0,
-            "can_cancel": True
+            "can_cancel": True,
+            "stages": {}
         })
 
         # הפעלת הסריקה ברקע
@@ -253,91 +245,59 @@ async def cancel_scan():
             "message": "אין סריקה פעילה לביטול"
         }
 
+    # is_running נשאר True עד שה-worker באמת עוצר (מתאפס ב-process_images_async)
     current_scan_status["can_cancel"] = False
-    current_scan_status["is_running"] = False
+    if _scan_future is not None:
+        from services.scan_worker import ScanWorker
+        ScanWorker.get_instance().cancel(_scan_future)
 
     return {
         "success": True,
-        "message": "סריקה מבוטלת",
+        "message": "הסריקה בתהליך ביטול",
         "processed": current_scan_status["processed"]
     }
 
 
 async def process_images_async(image_paths):
-    """עיבוד תמונות אסינכרוני ברקע"""
+    """עיבוד תמונות ברקע - ההסקה רצה בתהליך worker נפרד ולא חוסמת את ה-event loop"""
+    global _scan_future
+    processed_count = 0
     try:
-        # ייבוא הספריות הנדרשות
-        from services.blip_captioner import Blip2Captioner
-        from services.text_encoder import encode_text
-        from db.setup import get_db
-        from db.user_image_access import add_user_image, image_exists
+        from services.scan_worker import ScanWorker
 
         logger.info(f"🚀 מתחיל עיבוד אסינכרוני של {len(image_paths)} תמונות...")
 
-        captioner = Blip2Captioner.get_instance()
-        processed_count = 0
-        errors = 0
-
-        db = next(get_db())
+        def on_progress(progress):
+            # מגיע מה-worker, נקרא ע"י /scan_progress
+            current_scan_status.update({
+                "processed": progress["processed"],
+                "errors": progress["errors"],
+                "current_image": Path(progress["current_image"]).name if progress["current_image"] else "",
+                "stages": progress["stages"]
+            })
 
         try:
-            for i, image_path in enumerate(image_paths, 1):
-                # בדיקה אם הסריקה בוטלה
-                if not current_scan_status["can_cancel"] or not current_scan_status["is_running"]:
-                    logger.info("⏹️ סריקה בוטלה על ידי המשתמש")
-                    break
-
-                try:
-                    # עדכון סטטוס נוכחי
-                    current_scan_status["current_image"] = Path(image_path).name
-                    current_scan_status["processed"] = processed_count
-
-                    logger.info(f"🔄 מעבד תמונה {i}/{len(image_paths)}: {Path(image_path).name}")
-
-                    # בדיקה אם התמונה כבר קיימת
-                    normalized_path = image_path.replace("\\", "/")
-                    if image_exists(db, normalized_path):
-                        logger.info(f"⏭️ תמונה כבר קיימת במסד נתונים")
-                        continue
-
-                    # יצירת תיאור
-                    caption = captioner.generate_caption(image_path)
-                    logger.info(f"📝 תיאור נוצר: {caption[:50]}...")
-
-                    # יצירת embedding
-                    embedding = encode_text(caption)
-
-                    # שמירה במסד נתונים
-                    add_user_image(db, caption, embedding, normalized_path)
-                    processed_count += 1
-
-                    # שמירה תקופתית כל 5 תמונות
-                    if processed_count % 5 == 0:
-                        db.commit()
-                        logger.info(f"💾 נשמרו {processed_count} תמונות")
+            future = ScanWorker.get_instance().submit(image_paths, on_progress=on_progress)
+            _scan_future = future
+            if not current_scan_status["can_cancel"]:
+                # הביטול הגיע לפני שהעבודה נשלחה ל-worker
+                ScanWorker.get_instance().cancel(future)
+            summary = await asyncio.wrap_future(future)
+            processed_count = summary["processed"]
+            current_scan_status.update({"errors": summary["errors"], "stages": summary["stages"]})
 
-                        # מתן זמן לשרת לטפל בבקשות אחרות
-                        await asyncio.sleep(0.1)
+            if summary["cancelled"]:
+                logger.info("⏹️ סריקה בוטלה על ידי המשתמש")
 
-                    # מתן זמן לשרת אחרי כל תמונה
-                    await asyncio.sleep(0.05)
-
-                except Exception as e:
-                    errors += 1
-                    current_scan_status["errors"] = errors
-                    logger.error(f"❌ שגיאה בעיבוד {image_path}: {e}")
-                    continue
-
-            # שמירה סופית
-            db.commit()
-            logger.info(f"✅ עיבוד אסינכרוני הושלם: {processed_count} הצליחו, {errors} שגיאות")
+            logger.info(f"✅ עיבוד אסינכרוני הושלם: {processed_count} הצליחו, {summary['errors']} שגיאות")
+            logger.info(f"🗃️ cache hits: {summary['cache_hits']}, misses: {summary['cache_misses']}")
 
             # שמירת זמן הסריקה
             save_last_scan_time()
 
         finally:
-            db.close()
-            # איפוס סטטוס הסריקה
+            # איפוס סטטוס הסריקה - רק אחרי שהעבודה הסתיימה או בוטלה בפועל
+            _scan_future = None
             current_scan_status.update({
                 "is_running": False,
                 "processed": processed_count,
@@ -424,7 +384,7 @@ async def get_scan_status():
 
         new_images_count = 0
         if folder_path:
-            new_images = find_new_images_since_last_scan(folder_path, last_scan)
+            new_images = await asyncio.to_thread(find_new_images_since_last_scan, folder_path, last_scan, False)
             new_images_count = len(new_images)
 
         hours_since_scan = (datetime.now() - last_scan).total_seconds() / 3600
@@ -444,6 +404,52 @@ async def get_scan_status():
         raise HTTPException(status_code=500, detail=f"שגיאה בקבלת סטטוס: {str(e)}")
 
 
+@router.post("/start_watcher")
+async def start_watcher():
+    """הפעלת מעקב אחרי תיקיית המשתמש - תמונות חדשות נקלטות תוך שניות"""
+    from services.folder_watcher import FolderWatcher
+
+    folder_path = get_user_folder_path()
+    if not folder_path:
+        return {"success": False, "message": "לא הוגדרה תיקיית משתמש"}
+
+    watcher = FolderWatcher.get_instance()
+    if not watcher.available():
+        return {"success": False, "message": "ספריית watchdog אינה מותקנת"}
+
+    started = await asyncio.to_thread(watcher.start, folder_path)
+    return {"success": started, "message": "מעקב תיקייה הופעל" if started else "לא ניתן להפעיל מעקב תיקייה",
+            "watcher": watcher.status()}
+
+
+@router.post("/stop_watcher")
+async def stop_watcher():
+    """עצירת מעקב התיקייה"""
+    from services.folder_watcher import FolderWatcher
+
+    watcher = FolderWatcher.get_instance()
+    await asyncio.to_thread(watcher.stop)
+    return {"success": True, "message": "מעקב תיקייה נעצר", "watcher": watcher.status()}
+
+
+@router.get("/watcher_status")
+async def watcher_status():
+    from services.folder_watcher import FolderWatcher
+
+    return FolderWatcher.get_instance().status()
+
+
+@router.get("/latency_stats")
+async def latency_stats(reset: bool = False):
+    """זמני תגובה של חיפושים (p50/p95/p99) - בנפרד בזמן סריקה ובזמן רגיל"""
+    from services.latency_stats import latency_recorder
+
+    report = latency_recorder.snapshot()
+    if reset:
+        latency_recorder.reset()
+    return {"scan_running": current_scan_status["is_running"], "routes": report}
+
+
 @router.get("/health")
 async def health_check():
     return {
@@ -228,6 +228,7 @@ def process_images_with_smart_strategy(image_paths):
         from services.text_encoder import encode_text
         from db.setup import get_db
         from db.user_image_access import add_user_image, image_exists
+        from services.index_changes import user_images_added
 
         captioner = Blip2Captioner.get_instance()
         db = next(get_db())
@@ -263,7 +264,9 @@ def process_images_with_smart_strategy(image_paths):
 
                         caption = captioner.generate_caption(image_path)
                         embedding = encode_text(caption)
-                        add_user_image(db, caption, embedding, normalized_path)
+                        row_id = add_user_image(db, caption, embedding, normalized_path)
+                        if row_id is not None:
+                            user_images_added([(row_id, normalized_path, caption, embedding)])
 
                         # עדכון זמן ממוצע
                         image_time = time.time() - image_start_time
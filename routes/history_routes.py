@@ -3,10 +3,13 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from db.setup import get_db
 from db.models import SearchHistory
+from services.search_history_buffer import SearchHistoryBuffer
 from datetime import datetime
 router = APIRouter()
 @router.get("/history", tags=["Search History"])
 def get_search_history(db: Session = Depends(get_db)):
+    # searches are written behind; make the latest ones visible first
+    SearchHistoryBuffer.get_instance().flush()
     history = db.query(SearchHistory).order_by(desc(SearchHistory.timestamp)).limit(50).all()
 
     result = []
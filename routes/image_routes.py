@@ -1,10 +1,13 @@
 import logging
-import os
-import urllib.parse
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from fastapi.responses import FileResponse
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import Response
 from services.image_handler import process_uploaded_image
+from services.thumbnails import get_thumbnail_service
+from services.image_serving import resolve_path, cached_stat, conditional_file_response, not_modified_response
+from config import THUMBNAIL_SIZES, THUMBNAIL_MAX_AGE, USER_IMAGE_CACHE_CONTROL
 router = APIRouter()
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
 logging.basicConfig(level=logging.INFO)
 @router.post("/describe_image")
 async def describe_image(file: UploadFile = File(...)):
@@ -18,38 +21,52 @@ async def describe_image(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def serve_thumbnail(request: Request, image_path: str, size: str) -> Response:
+    """תמונה מוקטנת - כתובת לפי תוכן, אפשר לשמור במטמון לזמן ארוך"""
+    service = get_thumbnail_service()
+    try:
+        service.size_of(size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cache_control = f"public, max-age={THUMBNAIL_MAX_AGE}"
+    # ה-ETag נבנה מ-stat של המקור בלבד: 304 בלי לקרוא את התמונה המקורית או המוקטנת
+    etag = f'"{service.etag(image_path, size)}"'
+    not_modified = not_modified_response(request, etag, cache_control)
+    if not_modified is not None:
+        return not_modified
+    # נוצרת ב-thread pool ונשמרת במטמון
+    thumbnail_path = await service.get(image_path, size)
+    return conditional_file_response(request, thumbnail_path, cache_control, etag=etag)
+
+
 @router.get("/image/")
-async def serve_user_image(filename: str = Query(...), folder_path: str = Query(...)):
+async def serve_user_image(request: Request, filename: str = Query(...), folder_path: str = Query(...),
+                           size: Optional[str] = Query(None, description=f"thumbnail size: {', '.join(THUMBNAIL_SIZES)}")):
     """
-    מחזיר תמונה של משתמש לפי שם קובץ ונתיב תיקייה, כולל הדפסות דיאגנוסטיקה
+    מחזיר תמונה של משתמש לפי שם קובץ ונתיב תיקייה, עם ETag/Last-Modified ותשובת 304
     """
     try:
-        print(f"📥 קיבלתי בקשה לתמונה:")
-        print(f"   📁 folder_path: {folder_path}")
-        print(f"   🖼️ filename: {filename}")
-
-        # ניקוי תווים חשודים
-        filename = urllib.parse.unquote(filename)
-        folder_path = urllib.parse.unquote(folder_path)
-
-        image_path = os.path.join(folder_path)
-
-        print(f" {image_path}")
-        if not os.path.exists(image_path):
+        # ניקוי תווים חשודים - הפענוח והבדיקה על הדיסק נשמרים במטמון
+        image_path = resolve_path(folder_path)
+        stat = cached_stat(image_path)
+        if stat is None:
             raise HTTPException(status_code=404, detail=f"Image not found: {filename}")
 
-        if not filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')):
+        if not resolve_path(filename).lower().endswith(IMAGE_EXTENSIONS):
             raise HTTPException(status_code=400, detail="Invalid image format")
 
-        print("✅ הקובץ נמצא, מחזיר עם FileResponse...")
-        return FileResponse(
-            image_path,
-            media_type="image/jpeg",
-            headers={"Cache-Control": "max-age=3600"}
-        )
+        if size:
+            return await serve_thumbnail(request, image_path, size)
+
+        return conditional_file_response(request, image_path, USER_IMAGE_CACHE_CONTROL, stat=stat)
 
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error serving image {filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/thumbnail_stats")
+def thumbnail_stats():
+    return get_thumbnail_service().stats()
@@ -1,15 +1,66 @@
+from typing import Optional
 from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session
 from db.setup import get_db
+from db.vector_index import explain_vector_search, describe_vector_indexes, DEFAULT_WHERE
+from db.image_root_access import folder_scope
 from services.search_handler import search_similar_images_service
+from services.text_encoder import encode_query, query_embedding_cache
+from services.result_cache import get_result_cache
+from config import MAX_RESULTS, SCORE_THRESHOLD
 router = APIRouter()
 @router.get("/search_coco")
 def search_coco(
     query: str = Query(...),
+    ef_search: Optional[int] = Query(None, ge=1, le=1000, description="HNSW candidate list size"),
+    probes: Optional[int] = Query(None, ge=1, description="IVFFlat lists to visit"),
+    mode: Optional[str] = Query(None, pattern="^(vector|hybrid)$",
+                                description="vector, or hybrid (full-text + vector, rank fused)"),
     db: Session = Depends(get_db)
 ):
     try:
-        results = search_similar_images_service(query, db)
+        results = search_similar_images_service(query, db, ef_search=ef_search, probes=probes, mode=mode)
         return { "results": results }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/search_explain")
+def search_explain(
+    query: str = Query(...),
+    table: str = Query("images", description="images or user_images"),
+    ef_search: Optional[int] = Query(None, ge=1, le=1000),
+    probes: Optional[int] = Query(None, ge=1),
+    analyze: bool = Query(True, description="run the query (EXPLAIN ANALYZE) instead of only planning it"),
+    folder_path: Optional[str] = Query(None, description="user_images only: plan the folder-scoped search"),
+    db: Session = Depends(get_db)
+):
+    """Execution plan of the vector search, to check that the HNSW/IVFFlat index is used"""
+    try:
+        query_embedding = encode_query(query)
+        where, params, exact, scope = DEFAULT_WHERE, None, False, None
+        if folder_path and table == "user_images":
+            scope = folder_scope(db, folder_path)
+            where, params, exact = scope.where, scope.params, scope.exact
+        plan = explain_vector_search(db, table, str(query_embedding.tolist()), limit=MAX_RESULTS,
+                                     threshold=SCORE_THRESHOLD, where=where, params=params, ef_search=ef_search,
+                                     probes=probes, analyze=analyze, exact=exact)
+        uses_index = any("Index Scan" in line and "embedding" in line for line in plan)
+        return {"table": table, "uses_vector_index": uses_index, "plan": plan,
+                "folder_scope": scope._asdict() if scope else None,
+                "indexes": describe_vector_indexes(db)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/cache_stats")
+def cache_stats():
+    """Hit/miss/eviction counters and size of the search result cache and the query embedding cache"""
+    return {**get_result_cache().stats(), "query_embeddings": query_embedding_cache.stats()}
+
+
+@router.post("/cache_clear")
+def cache_clear(source: Optional[str] = Query(None, description="coco or user, default: everything")):
+    get_result_cache().clear(source)
+    return {"success": True, "stats": get_result_cache().stats()}
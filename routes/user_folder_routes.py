@@ -3,6 +3,11 @@ import json
 import os
 from pathlib import Path
 import logging
+import asyncio
+import threading
+from services.folder_watcher import FolderWatcher
+from db.setup import SessionLocal
+from db.image_root_access import register_root, retire_other_roots, list_roots
 
 # הגדרת לוגר
 logging.basicConfig(level=logging.INFO)
@@ -11,6 +16,25 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def register_image_root(folder_path):
+    """
+    רישום התיקייה כשורש חיפוש - אינדקס וקטורי חלקי משלה.
+    שורשים של תיקיות קודמות מבוטלים והאינדקסים שלהם נמחקים.
+    בניית האינדקס איטית - רץ ב-thread ברקע, לא בתוך הבקשה.
+    """
+    db = SessionLocal()
+    try:
+        root_id = register_root(db, folder_path)
+        logger.info(f"🗂️ התיקייה נרשמה כשורש חיפוש #{root_id}: {folder_path}")
+        retired = retire_other_roots(db, folder_path)
+        if retired:
+            logger.info(f"🧹 בוטלו שורשי חיפוש ישנים: {retired}")
+    except Exception as e:
+        logger.error(f"❌ שגיאה ברישום שורש החיפוש: {e}")
+    finally:
+        db.close()
+
+
 @router.post("/set_user_folder")
 async def set_user_folder(request: Request):
     """
@@ -65,6 +89,15 @@ async def set_user_folder(request: Request):
 
             logger.info(f"💾 תיקייה נשמרה בהצלחה: {folder_path}")
 
+            # חיפוש בתיקייה ישתמש באינדקס של התיקייה בלבד - נבנה ברקע, עד אז חיפוש לפי path_key
+            threading.Thread(target=register_image_root, args=(folder_path,),
+                             name="image-root-register", daemon=True).start()
+
+            # אם מעקב התיקייה פעיל - עוברים לעקוב אחרי התיקייה החדשה
+            watcher = FolderWatcher.get_instance()
+            if watcher.running and watcher.folder_path != folder_path:
+                await asyncio.to_thread(watcher.start, folder_path)
+
             # בדיקה כמה תמונות יש בתיקייה (אופציונלי)
             image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
             image_count = 0
@@ -120,6 +153,18 @@ async def set_user_folder(request: Request):
         }
 
 
+@router.get("/image_roots")
+async def get_image_roots():
+    """
+    התיקיות הרשומות כשורשי חיפוש ומספר התמונות בכל אחת
+    """
+    db = SessionLocal()
+    try:
+        return {"roots": await asyncio.to_thread(list_roots, db)}
+    finally:
+        db.close()
+
+
 @router.get("/get_user_folder")
 async def get_user_folder():
     """
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import argparse
+# the benchmark measures CPU throughput, so hide any GPU before torch is imported
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.blip_captioner import Blip2Captioner
+from services.image_utils import is_image_file
+
+BATCH_SIZES = [1, 4, 8, 16]
+DEFAULT_IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extra_training_data")
+
+
+def collect_images(folder: str, limit: int):
+    paths = []
+    for root, _, files in os.walk(folder):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            if is_image_file(path):
+                paths.append(path)
+            if len(paths) >= limit:
+                return paths
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BLIP-2 captioning throughput per batch size (CPU)")
+    parser.add_argument("--images", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--count", type=int, default=32)
+    args = parser.parse_args()
+
+    paths = collect_images(args.images, args.count)
+    if not paths:
+        print(f"❌ no images found in {args.images}")
+        return
+
+    captioner = Blip2Captioner.get_instance()
+    print(f"📦 {len(paths)} images, device={captioner.device}")
+
+    # warm-up so the first measured run does not pay for lazy initialisation
+    captioner.generate_captions(paths[:1], batch_size=1)
+
+    for batch_size in BATCH_SIZES:
+        start = time.perf_counter()
+        captions = captioner.generate_captions(paths, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        captioned = sum(1 for caption in captions if caption)
+        print(f"batch_size={batch_size:>2}  {captioned / elapsed:6.2f} images/sec  ({elapsed:.1f}s for {captioned} images)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import services.cluster_engine as cluster_engine
+import services.parallel_clustering as parallel_clustering
+
+SIZES = [1000, 5000, 20000, 50000]
+
+
+def make_images(n: int, dim: int, centers: int, seed: int = 42):
+    """n fake images with embeddings drawn around a few centers, like captions of a few topics"""
+    rng = np.random.default_rng(seed)
+    means = rng.normal(size=(centers, dim)).astype(np.float32)
+    labels = rng.integers(0, centers, size=n)
+    embeddings = means[labels] + rng.normal(scale=0.8, size=(n, dim)).astype(np.float32)
+    return [SimpleNamespace(id=i, embedding=embeddings[i]) for i in range(n)]
+
+
+def measure(images, scalable: bool):
+    # the mode normally follows SCALABLE_CLUSTERING_MIN_SAMPLES; force it for the comparison
+    cluster_engine.SCALABLE_CLUSTERING_MIN_SAMPLES = 0 if scalable else sys.maxsize
+    tracemalloc.start()
+    start = time.perf_counter()
+    clusters = cluster_engine.run_kmeans(images)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, len(clusters)
+
+
+def measure_categories(n: int, dim: int, categories: int):
+    """Serial vs process-pool clustering of n embeddings split into independent categories"""
+    rng = np.random.default_rng(7)
+    tasks = {f"category-{i}": (rng.normal(size=(n // categories, dim)).astype(np.float32), (8,))
+             for i in range(categories)}
+    timings = {}
+    for mode, processes in (("serial", 1), ("parallel", 0)):
+        parallel_clustering.CLUSTERING_PROCESSES = processes
+        start = time.perf_counter()
+        parallel_clustering.cluster_categories(cluster_engine.cluster_matrix, tasks)
+        timings[mode] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clustering runtime and peak memory versus n: KMeans vs MiniBatchKMeans mode")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--centers", type=int, default=8)
+    parser.add_argument("--classic-max", type=int, default=20000, help="skip the classic mode above this n")
+    parser.add_argument("--categories", type=int, default=0,
+                        help="also time n images split into this many categories, serial vs process pool")
+    args = parser.parse_args()
+    threshold = cluster_engine.SCALABLE_CLUSTERING_MIN_SAMPLES
+
+    print(f"📦 dim={args.dim}, centers={args.centers}, automatic switch at n >= {threshold}")
+    print(f"{'n':>8} {'mode':>10} {'seconds':>9} {'peak MB':>9} {'clusters':>9}")
+    for n in args.sizes:
+        images = make_images(n, args.dim, args.centers)
+        for scalable in (False, True):
+            mode = "scalable" if scalable else "classic"
+            if not scalable and n > args.classic_max:
+                print(f"{n:>8} {mode:>10} {'skipped':>9}")
+                continue
+            elapsed, peak, clusters = measure(images, scalable)
+            print(f"{n:>8} {mode:>10} {elapsed:>9.2f} {peak / 2 ** 20:>9.1f} {clusters:>9}")
+    cluster_engine.SCALABLE_CLUSTERING_MIN_SAMPLES = threshold
+
+    if args.categories:
+        print(f"\n⚙️ {args.categories} categories, {parallel_clustering.pool_size(args.categories)} processes")
+        for n in args.sizes:
+            timings = measure_categories(n, args.dim, args.categories)
+            print(f"{n:>8} serial {timings['serial']:.2f}s  parallel {timings['parallel']:.2f}s  "
+                  f"x{timings['serial'] / timings['parallel']:.1f}")
+    print("✅ done")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.text_encoder import encode_text, encode_texts
+
+BATCH_SIZES = [1, 16, 32, 64, 128, 256]
+DEFAULT_ANNOTATIONS = r"D:\coco\annotations\captions_val2017.json"
+WORDS = ["a", "man", "woman", "dog", "cat", "sitting", "on", "the", "table", "next", "to", "red", "bus",
+         "street", "with", "two", "people", "playing", "tennis", "in", "a", "park", "kitchen", "pizza"]
+
+
+def load_texts(annotations: str, count: int):
+    if os.path.exists(annotations):
+        with open(annotations, "r", encoding="utf-8") as f:
+            captions = [item["caption"] for item in json.load(f)["annotations"]]
+        return captions[:count]
+    # no COCO on this machine - caption-like strings of realistic, varied length
+    rng = random.Random(42)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text encoding throughput: one call per string vs encode_texts batches")
+    parser.add_argument("--annotations", default=DEFAULT_ANNOTATIONS)
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--processes", type=int, default=0, help="also measure a multi-process run")
+    args = parser.parse_args()
+
+    texts = load_texts(args.annotations, args.count)
+    print(f"📦 {len(texts)} texts, {len(set(texts))} unique")
+
+    # warm-up so the first measured run does not pay for loading the model
+    encode_texts(texts[:8])
+
+    sample = texts[:min(len(texts), 500)]
+    start = time.perf_counter()
+    for text in sample:
+        encode_text(text)
+    elapsed = time.perf_counter() - start
+    print(f"encode_text loop      {len(sample) / elapsed:8.1f} texts/sec  ({len(sample)} texts)")
+
+    for batch_size in BATCH_SIZES:
+        start = time.perf_counter()
+        encode_texts(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"batch_size={batch_size:>3}        {len(texts) / elapsed:8.1f} texts/sec  ({elapsed:.1f}s)")
+
+    if args.processes > 1:
+        start = time.perf_counter()
+        encode_texts(texts, processes=args.processes)
+        elapsed = time.perf_counter() - start
+        print(f"processes={args.processes:>2}          {len(texts) / elapsed:8.1f} texts/sec  ({elapsed:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text
+from db.setup import SessionLocal
+from db.schema import ensure_schema
+from services.index_changes import compact_coco
+from db.vector_index import describe_vector_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert the per-caption COCO rows (images) into one fused row per image (coco_images)")
+    parser.add_argument("--path", action="append", help="only refresh this image (repeatable, default: all)")
+    args = parser.parse_args()
+
+    ensure_schema()
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        written = compact_coco(db, args.path)
+        print(f"✅ {written} images compacted in {time.perf_counter() - start:.1f}s")
+        captions = db.execute(text("SELECT COUNT(*) FROM images")).scalar()
+        images = db.execute(text("SELECT COUNT(*) FROM coco_images")).scalar()
+        print(f"📊 {captions} caption rows -> {images} image rows")
+        for index in describe_vector_indexes(db):
+            if index["table"] in ("images", "coco_images"):
+                print(f"   {index['index']}: {index['size_bytes'] / 1024 / 1024:.1f} MB")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from sqlalchemy import text
 from db.setup import SessionLocal
 from db.models import ImageModel
 from services.blip_captioner import Blip2Captioner
-from config import IMAGE_DB_DIR
+from config import IMAGE_DB_DIR, CAPTION_BATCH_SIZE
 
 def generate_blip_captions():
     start_time = time.time()
@@ -32,7 +32,8 @@ def generate_blip_captions():
         new_captions = {}
         updated_rows = 0
 
-        for idx, image in enumerate(unique_images):
+        pending = []
+        for image in unique_images:
             image_path = os.path.join(IMAGE_DB_DIR, image.image_path)
 
             if not os.path.exists(image_path):
@@ -42,21 +43,28 @@ def generate_blip_captions():
             if image.image_path in caption_cache:
                 continue
 
-            try:
-                with torch.no_grad():
-                    caption = captioner.generate_caption(image_path)
+            pending.append((image.image_path, image_path))
 
-                if caption.strip():
-                    new_captions[image.image_path] = caption
-                    caption_cache[image.image_path] = caption
-                    print(f"📷 {image.image_path} → 📝 {caption}")
+        for batch_start in range(0, len(pending), CAPTION_BATCH_SIZE):
+            batch = pending[batch_start:batch_start + CAPTION_BATCH_SIZE]
+
+            # BLIP מקבל batch שלם בקריאה אחת
+            with torch.no_grad():
+                captions = captioner.generate_captions([image_path for _, image_path in batch])
+
+            for (relative_path, _), caption in zip(batch, captions):
+                if caption is None:
+                    print(f"❌ שגיאה ב־{relative_path}")
+                elif caption.strip():
+                    new_captions[relative_path] = caption
+                    caption_cache[relative_path] = caption
+                    print(f"📷 {relative_path} → 📝 {caption}")
                 else:
-                    print(f"⚠️ תיאור ריק עבור: {image.image_path}")
-            except Exception as e:
-                print(f"❌ שגיאה ב־{image.image_path}: {e}")
+                    print(f"⚠️ תיאור ריק עבור: {relative_path}")
 
             # כל 20 תיאורים → שמירה למסד
-            if len(new_captions) % 20 == 0:
+            if len(new_captions) >= 20:
+                saved = len(new_captions)
                 for path, cap in new_captions.items():
                     result = db.execute(
                         text("UPDATE images SET blip_caption = :caption WHERE image_path = :path AND blip_caption IS NULL"),
@@ -64,11 +72,10 @@ def generate_blip_captions():
                     )
                     updated_rows += result.rowcount
                 db.commit()
-                print(f"💾 נשמרו למסד 20 תיאורים")
+                print(f"💾 נשמרו למסד {saved} תיאורים")
                 new_captions.clear()  # מאפסים רק את מה ששמרנו
 
-            if idx % 10 == 0:
-                print(f"🟢 עובדו {idx + 1} תמונות")
+            print(f"🟢 עובדו {batch_start + len(batch)} תמונות")
 
         # לשמור את מה שנשאר בסוף
         if new_captions:
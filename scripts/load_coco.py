@@ -1,10 +1,12 @@
 import os
 import json
 from tqdm import tqdm
-from db.Database_Access import add_images
-from services.text_encoder import encode_text
+from services.index_changes import add_coco_images
+from db.setup import SessionLocal
+from services.text_encoder import encode_texts
 ANNOTATIONS_FILE = r"D:\coco\annotations\captions_val2017.json"
 IMAGES_DIR = r"D:\coco\val2017"
+ENCODE_PROCESSES = max(1, (os.cpu_count() or 1) // 2)
 def load_annotations():
     with open(ANNOTATIONS_FILE, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -15,7 +17,7 @@ def build_image_path(filename):
     return os.path.join(IMAGES_DIR, filename)
 def main():
     annotations = load_annotations()
-    results = []
+    valid = []
     for item in tqdm(annotations, desc="🔄 טוען"):
         caption = item["caption"]
         filename = os.path.normpath(build_filename(item["image_id"]))
@@ -24,9 +26,15 @@ def main():
         if "coco" not in normalized_path or not os.path.exists(image_path):
             print(f"🚫 מדלג על קובץ חשוד: {image_path}")
             continue
-        embedding = encode_text(caption)
-        results.append((caption, embedding, filename))
+        valid.append((caption, filename))
+    # קידוד כל הכיתובים בבת אחת - batches לפי אורך, ובמקביל על כמה תהליכים
+    embeddings = encode_texts([caption for caption, _ in valid], processes=ENCODE_PROCESSES)
+    results = [(caption, embedding, filename) for (caption, filename), embedding in zip(valid, embeddings)]
     print(f"📥 ייטענו למסד {len(results)} תמונות חוקיות מתוך {len(annotations)}")
-    add_images(results)
+    db = SessionLocal()
+    try:
+        add_coco_images(db, results)
+    finally:
+        db.close()
 if __name__ == "__main__":
     main()
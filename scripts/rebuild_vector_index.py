@@ -0,0 +1,30 @@
+import os
+import sys
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.setup import engine
+from db.vector_index import rebuild_vector_index, INDEX_METHODS
+from config import VECTOR_INDEX_METHOD, VECTOR_INDEXED_TABLES, HNSW_M, HNSW_EF_CONSTRUCTION, IVFFLAT_LISTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the pgvector embedding indexes")
+    parser.add_argument("--table", choices=VECTOR_INDEXED_TABLES, action="append",
+                        help="table to rebuild (repeatable, default: all)")
+    parser.add_argument("--method", choices=INDEX_METHODS, default=VECTOR_INDEX_METHOD)
+    parser.add_argument("--m", type=int, default=HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--lists", type=int, default=IVFFLAT_LISTS,
+                        help="IVFFlat lists, roughly rows/1000 up to 1M rows, sqrt(rows) above")
+    args = parser.parse_args()
+
+    for table in args.table or VECTOR_INDEXED_TABLES:
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            rebuild_vector_index(conn, table, args.method, args.m, args.ef_construction, args.lists)
+        print(f"✅ {table}: {args.method} index rebuilt in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from db.setup import SessionLocal
 from db.models import ExtraTrainingImage
 from services.blip_captioner import Blip2Captioner
 from services.text_encoder import encode_text
+from services.cluster_results import get_cluster_result_store
 from sqlalchemy import exists
 
 BASE_DIR = "D:/fastApi/extra_training_data/interior"
@@ -28,6 +29,7 @@ if len(image_files) == 0:
 processed = 0
 skipped = 0
 errors = 0
+new_images = []
 for filename in image_files:
     image_path = os.path.join(BASE_DIR, filename)
 
@@ -67,6 +69,7 @@ for filename in image_files:
         )
         db.add(new_img)
         db.commit()
+        new_images.append(new_img)
         processed += 1
         print(f"✅ נשמר: {filename} → '{caption}'")
 
@@ -74,6 +77,24 @@ for filename in image_files:
         errors += 1
         print(f"❌ שגיאה ב־{filename}: {e}")
 
+# שיוך התמונות החדשות לאשכולות השמורים במקום חישוב אשכולות מחדש
+if new_images:
+    try:
+        store = get_cluster_result_store()
+        summary = store.assign_new_images(db, new_images)
+        if summary is None:
+            print("ℹ️ אין ריצת אשכולות שמורה מתאימה - האשכולות יחושבו מחדש בשרת")
+        elif summary["unknown"]:
+            print(f"ℹ️ קטגוריות חדשות ({', '.join(summary['unknown'])}) - האשכולות יחושבו מחדש בשרת")
+        else:
+            print(f"🧩 שויכו {summary['assigned']} תמונות לאשכולות קיימים")
+            if summary["drifted"]:
+                print(f"🔄 התאמה מחדש של קטגוריות שסטו: {', '.join(summary['drifted'])}")
+                store.refit_drifted(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ שיוך לאשכולות נכשל, השרת יחשב מחדש: {e}")
+
 db.close()
 print(f"\n🎉 סיום סריקה!")
 print(f"✅ נוספו: {processed} תמונות")
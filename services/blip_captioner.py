@@ -2,7 +2,10 @@ from transformers import Blip2Processor, Blip2ForConditionalGeneration
 import torch
 from PIL import Image
 import os
-from config import MAX_NEW_TOKENS
+import logging
+from typing import List, Optional
+from config import MAX_NEW_TOKENS, CAPTION_BATCH_SIZE
+logger = logging.getLogger(__name__)
 class Blip2Captioner:
     _instance = None
     @classmethod
@@ -26,9 +29,55 @@ class Blip2Captioner:
             print("BLIP-2 ")
         except Exception as e:
             print(" {e}")
-    def generate_caption(self, image_path: str) -> str:
-        image = Image.open(image_path).convert("RGB")
-        inputs = self.processor(image, return_tensors="pt").to(self.device)
+    def _generate(self, images: List[Image.Image]) -> List[str]:
+        inputs = self.processor(images=images, return_tensors="pt").to(self.device, self.model.dtype)
         with torch.no_grad():
             outputs = self.model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)
-        return self.processor.decode(outputs[0], skip_special_tokens=True)
+        return [caption.strip() for caption in self.processor.batch_decode(outputs, skip_special_tokens=True)]
+    def generate_caption(self, image_path: str) -> str:
+        image = Image.open(image_path).convert("RGB")
+        return self._generate([image])[0]
+    def _caption_batch(self, images: List[Image.Image], labels: List[str]) -> List[Optional[str]]:
+        try:
+            return self._generate(images)
+        except Exception as e:
+            # one bad image must not cost the whole batch - retry one by one
+            logger.warning(f"Batch captioning failed ({e}), retrying {len(images)} images one by one")
+        captions: List[Optional[str]] = []
+        for label, image in zip(labels, images):
+            try:
+                captions.append(self._generate([image])[0])
+            except Exception as item_error:
+                logger.error(f"Failed to caption {label}: {item_error}")
+                captions.append(None)
+        return captions
+    def generate_captions(self, image_paths: List[str], batch_size: int = CAPTION_BATCH_SIZE) -> List[Optional[str]]:
+        """
+        Caption many images with one padded generate call per batch.
+        Returns captions in input order; an image that fails to load or caption gets None.
+        """
+        captions: List[Optional[str]] = [None] * len(image_paths)
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(image_paths), batch_size):
+            indices = []
+            images = []
+            for index in range(start, min(start + batch_size, len(image_paths))):
+                try:
+                    images.append(Image.open(image_paths[index]).convert("RGB"))
+                    indices.append(index)
+                except Exception as e:
+                    logger.error(f"Failed to load {image_paths[index]}: {e}")
+            if not images:
+                continue
+            batch_captions = self._caption_batch(images, [image_paths[index] for index in indices])
+            for index, caption in zip(indices, batch_captions):
+                captions[index] = caption
+        return captions
+    def generate_captions_for_images(self, images: List[Image.Image], batch_size: int = CAPTION_BATCH_SIZE) -> List[Optional[str]]:
+        """Same as generate_captions, for images that were already decoded by the caller."""
+        captions: List[Optional[str]] = []
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            captions.extend(self._caption_batch(batch, [f"image #{start + offset}" for offset in range(len(batch))]))
+        return captions
@@ -0,0 +1,13 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class CaptionCacheStats:
+    """Hit/miss counters for one scan run"""
+    hits: int = 0
+    misses: int = 0
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"cache hits: {self.hits}, misses: {self.misses} ({rate:.1f}% hit rate)"
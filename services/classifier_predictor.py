@@ -5,6 +5,7 @@ from db.setup import SessionLocal
 from db.Database_Access import get_all_images
 from config import CLUSTER_CATEGORIES
 _model = None
+CLASSIFIER_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models", "classifier", "saved_classifier.pkl")
 def get_category_from_caption(caption: str) -> str | None:
     if not caption:
         return None
@@ -27,11 +28,9 @@ def get_category_from_caption(caption: str) -> str | None:
 def get_classifier_model():
     global _model
     if _model is None:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(base_dir, "..", "models", "classifier", "saved_classifier.pkl")
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"{model_path}")
-        with open(model_path, "rb") as f:
+        if not os.path.exists(CLASSIFIER_MODEL_PATH):
+            raise FileNotFoundError(f"{CLASSIFIER_MODEL_PATH}")
+        with open(CLASSIFIER_MODEL_PATH, "rb") as f:
             _model = pickle.load(f)
     return _model
 def get_labeled_embeddings():
@@ -0,0 +1,201 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from db.cluster_result_access import (load_category_models, record_assignments, add_cluster_links,
+                                      images_by_path)
+from services.cluster_engine import valid_embeddings, make_kmeans, cluster_matrix, assign_images
+from services.enhanced_cluster_processing_service import (categorize_images, build_category_clusters,
+                                                          merge_similar_clusters)
+from config import (EMBEDDING_CLIP_PERCENTILE, KMEANS_RANDOM_STATES, CLUSTER_DRIFT_INERTIA_GROWTH,
+                    CLUSTER_DRIFT_P95_GROWTH, CLUSTER_DRIFT_MIN_ASSIGNED, CLUSTER_DRIFT_DISTANCES_KEPT)
+logger = logging.getLogger(__name__)
+
+
+class CategoryModel:
+    """
+    What a category of a cluster run needs to place a new image without refitting: the clipping
+    and standardization the clustering applied, one centroid per stored cluster, and how far the
+    members were from their centroid at fit time. Distances of assigned images are tracked
+    against the latter to tell when the clusters no longer describe the category (drift).
+    """
+
+    def __init__(self, category: str, clip: float, mean: np.ndarray, scale: np.ndarray, centroids: np.ndarray,
+                 fit_inertia: float, fit_p95: float, assigned_count: int = 0, assigned_sq_sum: float = 0.0,
+                 assigned_distances: Optional[List[float]] = None, cluster_ids: Optional[List[int]] = None,
+                 cluster_sizes: Optional[List[int]] = None):
+        self.category = category
+        self.clip = clip
+        self.mean = mean
+        self.scale = scale
+        self.centroids = centroids
+        self.fit_inertia = fit_inertia
+        self.fit_p95 = fit_p95
+        self.assigned_count = assigned_count
+        self.assigned_sq_sum = assigned_sq_sum
+        self.assigned_distances = list(assigned_distances or [])
+        self.cluster_ids = cluster_ids or []
+        self.cluster_sizes = cluster_sizes or []
+
+    @classmethod
+    def fit(cls, category: str, embeddings: np.ndarray, labels: np.ndarray) -> "CategoryModel":
+        """labels are indexes into the category's clusters, one per embedding row"""
+        clip = float(np.percentile(np.abs(embeddings), EMBEDDING_CLIP_PERCENTILE))
+        clipped = np.clip(embeddings, -clip, clip)
+        mean = clipped.mean(axis=0)
+        scale = clipped.std(axis=0)
+        scale[scale == 0] = 1.0
+        scaled = (clipped - mean) / scale
+        centroids = np.stack([scaled[labels == label].mean(axis=0) for label in range(int(labels.max()) + 1)])
+        distances = np.linalg.norm(scaled - centroids[labels], axis=1)
+        return cls(category, clip, mean, scale, centroids,
+                   fit_inertia=float(np.mean(distances ** 2)), fit_p95=float(np.percentile(distances, 95)))
+
+    @classmethod
+    def from_rows(cls, model, clusters: List) -> "CategoryModel":
+        return cls(model.category, model.clip, np.asarray(model.scaler_mean, dtype=np.float32),
+                   np.asarray(model.scaler_scale, dtype=np.float32),
+                   np.stack([np.asarray(_vector(row.centroid), dtype=np.float32) for row in clusters]),
+                   model.fit_inertia, model.fit_p95, model.assigned_count, model.assigned_sq_sum,
+                   model.assigned_distances, [row.id for row in clusters], [row.members for row in clusters])
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        return (np.clip(embeddings, -self.clip, self.clip) - self.mean) / self.scale
+
+    def nearest(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Index of the closest centroid of every row and the distance to it"""
+        scaled = self.transform(embeddings)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, without an n x k x d difference array
+        squared = ((scaled ** 2).sum(axis=1)[:, None] - 2 * scaled @ self.centroids.T
+                   + (self.centroids ** 2).sum(axis=1)[None, :])
+        labels = squared.argmin(axis=1)
+        return labels, np.sqrt(np.maximum(squared[np.arange(len(labels)), labels], 0))
+
+    def record(self, distances: np.ndarray) -> None:
+        self.assigned_count += len(distances)
+        self.assigned_sq_sum += float(np.sum(distances ** 2))
+        self.assigned_distances = (self.assigned_distances + distances.tolist())[-CLUSTER_DRIFT_DISTANCES_KEPT:]
+
+    def drift(self) -> Dict:
+        if not self.assigned_count:
+            return {"assigned": 0, "inertia_growth": None, "p95_growth": None, "drifted": False}
+        inertia_growth = (self.assigned_sq_sum / self.assigned_count) / max(self.fit_inertia, 1e-9)
+        p95_growth = float(np.percentile(self.assigned_distances, 95)) / max(self.fit_p95, 1e-9)
+        drifted = self.assigned_count >= CLUSTER_DRIFT_MIN_ASSIGNED and (
+            inertia_growth > CLUSTER_DRIFT_INERTIA_GROWTH or p95_growth > CLUSTER_DRIFT_P95_GROWTH)
+        return {"assigned": self.assigned_count, "inertia_growth": round(inertia_growth, 3),
+                "p95_growth": round(p95_growth, 3), "drifted": drifted}
+
+    @property
+    def drifted(self) -> bool:
+        return self.drift()["drifted"]
+
+
+def _vector(value):
+    # pgvector returns numpy arrays; raw text() results come back as '[...]' strings
+    if isinstance(value, str):
+        return [float(x) for x in value.strip("[]").split(",")]
+    return value
+
+
+def fit_category_models(result: List[Dict], images: Dict[str, object]) -> Dict[str, CategoryModel]:
+    """A CategoryModel for every category of a clustering result; images maps a path to its row"""
+    models = {}
+    for category_data in result:
+        label_of = {}
+        for position, cluster in enumerate(category_data["clusters"]):
+            for image in cluster["images"]:
+                row = images.get(image["path"])
+                if row is not None:
+                    label_of[id(row)] = (row, position)
+        embeddings, valid = valid_embeddings([row for row, _ in label_of.values()])
+        if len(embeddings) == 0:
+            continue
+        row_labels = np.array([label_of[id(row)][1] for row in valid])
+        if len(set(row_labels.tolist())) < len(category_data["clusters"]):
+            # a cluster without one usable embedding cannot get a centroid; leave the category to refits
+            continue
+        models[category_data["category"]] = CategoryModel.fit(category_data["category"], embeddings, row_labels)
+    return models
+
+
+def load_models(db: Session, run_id: int) -> Dict[str, CategoryModel]:
+    return {model.category: CategoryModel.from_rows(model, clusters)
+            for model, clusters in load_category_models(db, run_id) if clusters}
+
+
+def assign_to_run(db: Session, run_id: int, images: Iterable) -> Dict:
+    """
+    Add images to the closest cluster of their category in the stored run, without refitting.
+    Images of a category the run has no model for are left out and reported as unknown.
+    The caller commits.
+    """
+    images = list(images)
+    models = load_models(db, run_id)
+    summary = {"assigned": 0, "unknown": [], "drifted": []}
+    links = []
+    for category, category_images in categorize_images(images).items():
+        model = models.get(category)
+        if model is None:
+            summary["unknown"].append(category)
+            continue
+        embeddings, valid = valid_embeddings(category_images)
+        valid_ids = {id(image) for image in valid}
+        if len(valid):
+            labels, distances = model.nearest(embeddings)
+            model.record(distances)
+            record_assignments(db, run_id, category, model.assigned_count, model.assigned_sq_sum,
+                               model.assigned_distances)
+            links += [_link(model.cluster_ids[label], image) for label, image in zip(labels, valid)]
+        # unusable embeddings join the largest cluster, as in a full clustering
+        largest = model.cluster_ids[int(np.argmax(model.cluster_sizes))] if model.cluster_sizes else model.cluster_ids[0]
+        links += [_link(largest, image) for image in category_images if id(image) not in valid_ids]
+        summary["assigned"] += len(category_images)
+        if model.drifted:
+            summary["drifted"].append(category)
+    add_cluster_links(db, links)
+    return summary
+
+
+def _link(cluster_id: int, image) -> Dict:
+    return {"cluster_id": cluster_id, "image_path": image.image_path,
+            "caption": getattr(image, 'blip_caption', '') or getattr(image, 'caption', '') or ""}
+
+
+def warm_refit(db: Session, result: List[Dict], models: Dict[str, CategoryModel],
+               categories: Iterable[str]) -> Tuple[List[Dict], Dict[str, CategoryModel]]:
+    """
+    Refit the given categories starting from their current centroids (one KMeans run instead of
+    the full k search), rename their clusters and fit fresh models; other categories are kept.
+    """
+    categories = set(categories)
+    new_result, new_models = [], dict(models)
+    for category_data in result:
+        category = category_data["category"]
+        if category not in categories or category not in models:
+            new_result.append(category_data)
+            continue
+        paths = [image["path"] for cluster in category_data["clusters"] for image in cluster["images"]]
+        rows = images_by_path(db, paths)
+        category_images = [rows[path] for path in dict.fromkeys(paths) if path in rows]
+        embeddings, valid = valid_embeddings(category_images)
+        model = models[category]
+        if len(embeddings) > len(model.centroids):
+            refit = CategoryModel.fit(category, embeddings, np.zeros(len(embeddings), dtype=int))
+            # previous centroids, moved from the old standardized space into the new one
+            raw_centroids = model.centroids * model.scale + model.mean
+            init = refit.transform(raw_centroids)
+            kmeans = make_kmeans(len(init), KMEANS_RANDOM_STATES[0], len(embeddings), init=init)
+            labels = kmeans.fit_predict(refit.transform(embeddings))
+            row_clusters = {int(label): np.flatnonzero(labels == label).tolist() for label in np.unique(labels)}
+        else:
+            row_clusters = cluster_matrix(embeddings)
+        clusters = assign_images(category_images, valid, row_clusters)
+        merged = merge_similar_clusters([{"category": category,
+                                          "clusters": build_category_clusters(category, clusters)}])[0]
+        new_result.append(merged)
+        logger.info(f"Category {category} refit from its centroids: {len(merged['clusters'])} clusters")
+        new_models.pop(category, None)
+        new_models.update(fit_category_models([merged], rows))
+    new_result.sort(key=lambda x: sum(len(cluster["images"]) for cluster in x["clusters"]), reverse=True)
+    return new_result, new_models
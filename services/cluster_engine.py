@@ -1,33 +1,85 @@
-from sklearn.cluster import KMeans, DBSCAN
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
+import os
 import numpy as np
-from typing import List, Dict
+from joblib import Parallel, delayed
+from typing import List, Dict, Optional, Tuple
 from config import DEFAULT_NUM_CLUSTERS
 from config import KMEANS_RANDOM_STATES
 from config import KMEANS_N_INIT, KMEANS_MAX_ITER, KMEANS_TOL
+from config import RANDOM_STATE, MIN_K, TOP_K
 from config import DBSCAN_EPS_PERCENTILE, DBSCAN_MIN_SAMPLES_DIVISOR
 from config import MIN_VALID_EMBEDDING_STD
 from config import MIN_CLUSTER_SIZE,DEFAULT_MAX_K,DEFAULT_MIN_K,DEFAULT_CLUSTER_ID,BALANCE_SCORE_BASE,CLUSTERING_MIN_CLUSTERS,KMEANS_N_INIT_EXPLORATION,KMEANS_MAX_K_LIMIT,CLUSTERING_DIVISOR,KMEANS_MAX_ITER_EXPLORATION,DBSCAN_NOISE_LABEL,MIN_SAMPLES_FOR_DBSCAN,DEFAULT_CLUSTER_SCORE,EMBEDDING_CLIP_PERCENTILE,DBSCAN_MAX_CLUSTER_RATIO,DBSCAN_MIN_SAMPLES_MIN
+from config import (SCALABLE_CLUSTERING_MIN_SAMPLES, SILHOUETTE_SAMPLE_SIZE, MINIBATCH_BATCH_SIZE, MINIBATCH_N_INIT,
+                    MINIBATCH_MAX_NO_IMPROVEMENT, KMEANS_SWEEP_JOBS, KMEANS_SWEEP_MIN_SAMPLES)
 import logging
 logger = logging.getLogger(__name__)
-def find_optimal_clusters(embeddings: np.ndarray, max_k: int = DEFAULT_MAX_K, min_k: int = DEFAULT_MIN_K) -> int:
+# processes for the random-state sweep (0 = one per core); clustering pool workers set it to 1
+sweep_jobs = KMEANS_SWEEP_JOBS
+# k -> (labels, silhouette) of the best fit seen while selecting k, so the final clustering reuses it
+KMeansFits = Dict[int, Tuple[np.ndarray, float]]
+def is_scalable(n_samples: int) -> bool:
+    return n_samples >= SCALABLE_CLUSTERING_MIN_SAMPLES
+def stratified_sample(labels: np.ndarray, sample_size: int, random_state: int) -> np.ndarray:
+    """Indices of about sample_size points, every label proportionally represented (at least 2 each)"""
+    rng = np.random.default_rng(random_state)
+    unique, counts = np.unique(labels, return_counts=True)
+    picked = []
+    for label, count in zip(unique, counts):
+        members = np.flatnonzero(labels == label)
+        take = min(count, max(2, int(round(sample_size * count / len(labels)))))
+        picked.append(rng.choice(members, size=take, replace=False))
+    return np.sort(np.concatenate(picked))
+def clustering_score(embeddings: np.ndarray, labels: np.ndarray, random_state: int = KMEANS_RANDOM_STATES[0]) -> float:
+    """Silhouette score; exact up to SILHOUETTE_SAMPLE_SIZE points, on a stratified sample above"""
+    labels = np.asarray(labels)
+    if len(labels) <= SILHOUETTE_SAMPLE_SIZE:
+        return float(silhouette_score(embeddings, labels))
+    sample = stratified_sample(labels, SILHOUETTE_SAMPLE_SIZE, random_state)
+    return float(silhouette_score(embeddings[sample], labels[sample]))
+def make_kmeans(n_clusters: int, random_state: int, n_samples: int, n_init: int = KMEANS_N_INIT,
+                max_iter: int = KMEANS_MAX_ITER, tol: float = KMEANS_TOL, init="k-means++"):
+    """
+    KMeans, or MiniBatchKMeans (bounded memory, linear time) from SCALABLE_CLUSTERING_MIN_SAMPLES on.
+    init may be an array of starting centroids (a warm start), which is then run once.
+    """
+    warm = not isinstance(init, str)
+    if is_scalable(n_samples):
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, init=init,
+                               n_init=1 if warm else MINIBATCH_N_INIT, batch_size=MINIBATCH_BATCH_SIZE,
+                               max_iter=max_iter, max_no_improvement=MINIBATCH_MAX_NO_IMPROVEMENT)
+    return KMeans(n_clusters=n_clusters, random_state=random_state, init=init, n_init=1 if warm else n_init,
+                  max_iter=max_iter, tol=tol)
+def find_optimal_clusters(embeddings: np.ndarray, max_k: int = DEFAULT_MAX_K, min_k: int = DEFAULT_MIN_K,
+                          fits: Optional[KMeansFits] = None) -> int:
+    """
+    k with the best mean silhouette over KMEANS_RANDOM_STATES. In scalable mode the exploration
+    fits are full MiniBatchKMeans fits, and the best one per k is kept in fits for reuse.
+    """
     if len(embeddings) < min_k:
         return CLUSTERING_MIN_CLUSTERS
     max_k = min(max_k, len(embeddings) - CLUSTERING_MIN_CLUSTERS)
     if max_k < min_k:
         return max(CLUSTERING_MIN_CLUSTERS, max_k)
+    scalable = is_scalable(len(embeddings))
     best_score = DBSCAN_NOISE_LABEL
     best_k = min_k
     for k in range(min_k, max_k + 1):
         try:
             scores = []
             for random_state in  KMEANS_RANDOM_STATES:
-                kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=KMEANS_N_INIT_EXPLORATION, max_iter=KMEANS_MAX_ITER_EXPLORATION)
+                if scalable:
+                    kmeans = make_kmeans(k, random_state, len(embeddings))
+                else:
+                    kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=KMEANS_N_INIT_EXPLORATION, max_iter=KMEANS_MAX_ITER_EXPLORATION)
                 labels = kmeans.fit_predict(embeddings)
                 if len(set(labels)) > 1:
-                    score = silhouette_score(embeddings, labels)
+                    score = clustering_score(embeddings, labels, random_state)
                     scores.append(score)
+                    if scalable and fits is not None and score > fits.get(k, (None, DBSCAN_NOISE_LABEL))[1]:
+                        fits[k] = (labels, score)
             if scores:
                 avg_score = np.mean(scores)
                 logger.debug(f"   K={k}: silhouette_score={avg_score:.3f}")
@@ -39,8 +91,47 @@ def find_optimal_clusters(embeddings: np.ndarray, max_k: int = DEFAULT_MAX_K, mi
             continue
     logger.info(f" {best_k} (mark: {best_score:.3f})")
     return best_k
+def select_k_single_state(embeddings: np.ndarray, min_k: int = MIN_K, max_k: int = TOP_K,
+                          fits: Optional[KMeansFits] = None, random_state: int = RANDOM_STATE) -> int:
+    """k selection of the smart clustering engine: one random state, TOP_K initializations per k"""
+    if len(embeddings) < min_k:
+        return min(len(embeddings), 1)
+    max_k = min(max_k, len(embeddings) - 1)
+    if max_k < min_k:
+        return max_k
+    best_score = -1
+    best_k = min_k
+    for k in range(min_k, max_k + 1):
+        try:
+            kmeans = make_kmeans(k, random_state, len(embeddings), n_init=TOP_K)
+            labels = kmeans.fit_predict(embeddings)
+            score = clustering_score(embeddings, labels, random_state)
+            logger.info(f"   K={k}: silhouette_score={score:.3f}")
+            if fits is not None and is_scalable(len(embeddings)):
+                fits[k] = (labels, score)
+            if score > best_score:
+                best_score = score
+                best_k = k
+        except Exception as e:
+            logger.warning(f"eror{k}: {e}")
+            continue
+    logger.info(f" num of clusters: {best_k} (score: {best_score:.3f})")
+    return best_k
+def category_labels(embeddings: np.ndarray, max_clusters: int, random_state: int = RANDOM_STATE) -> np.ndarray:
+    """Cluster label of every row of one category's embedding matrix (smart clustering engine)"""
+    embeddings_scaled = StandardScaler().fit_transform(embeddings)
+    fits: KMeansFits = {}
+    optimal_k = select_k_single_state(embeddings_scaled, min_k=MIN_K,
+                                      max_k=min(max_clusters, len(embeddings) // CLUSTERING_DIVISOR), fits=fits)
+    logger.info(f" KMeans  {optimal_k}.")
+    if optimal_k <= CLUSTERING_MIN_CLUSTERS:
+        return np.zeros(len(embeddings), dtype=int)
+    if optimal_k in fits:
+        return fits[optimal_k][0]
+    kmeans = make_kmeans(optimal_k, random_state, len(embeddings_scaled), n_init=KMEANS_N_INIT)
+    return kmeans.fit_predict(embeddings_scaled)
 def preprocess_embeddings(embeddings: List) -> np.ndarray:
-    if not embeddings:
+    if len(embeddings) == 0:
         return np.array([])
     embeddings_array = np.array(embeddings)
     if len(embeddings_array.shape) > DBSCAN_MIN_SAMPLES_MIN:
@@ -52,18 +143,20 @@ def preprocess_embeddings(embeddings: List) -> np.ndarray:
     percentile_99 = np.percentile(np.abs(embeddings_array), EMBEDDING_CLIP_PERCENTILE)
     embeddings_array = np.clip(embeddings_array, -percentile_99, percentile_99)
     return embeddings_array
-def try_advanced_clustering(embeddings: np.ndarray, images: List, target_clusters: int) -> Dict[int, List]:
+def try_advanced_clustering(embeddings: np.ndarray, images: List, target_clusters: int,
+                            fits: Optional[KMeansFits] = None) -> Dict[int, List]:
     best_clusters = None
     best_score = -1
     try:
-        kmeans_clusters, kmeans_score = try_improved_kmeans(embeddings, images, target_clusters)
+        kmeans_clusters, kmeans_score = try_improved_kmeans(embeddings, images, target_clusters, fits)
         if kmeans_score > best_score:
             best_clusters = kmeans_clusters
             best_score = kmeans_score
             logger.debug(f"   KMeans: {kmeans_score:.3f}")
     except Exception as e:
         logger.warning(f" {e}")
-    if len(embeddings) >= MIN_SAMPLES_FOR_DBSCAN:
+    # DBSCAN needs a neighbour graph of all points; not worth it at scalable sizes
+    if MIN_SAMPLES_FOR_DBSCAN <= len(embeddings) and not is_scalable(len(embeddings)):
         try:
             dbscan_clusters, dbscan_score = try_dbscan_clustering(embeddings, images)
             if dbscan_score > best_score:
@@ -73,26 +166,18 @@ def try_advanced_clustering(embeddings: np.ndarray, images: List, target_cluster
         except Exception as e:
             logger.warning(f" {e}")
     return best_clusters if best_clusters else {0: images}
-def try_improved_kmeans(embeddings: np.ndarray, images: List, target_clusters: int) -> tuple:
+def try_improved_kmeans(embeddings: np.ndarray, images: List, target_clusters: int,
+                        fits: Optional[KMeansFits] = None) -> tuple:
     best_labels = None
     best_score = DBSCAN_NOISE_LABEL
-    for random_state in KMEANS_RANDOM_STATES:
-        try:
-            kmeans = KMeans(
-                n_clusters=target_clusters,
-                random_state=random_state,
-                n_init=KMEANS_N_INIT,
-                max_iter=KMEANS_MAX_ITER,
-                tol=KMEANS_TOL
-            )
-            labels = kmeans.fit_predict(embeddings)
-            if len(set(labels)) > 1:
-                score = silhouette_score(embeddings, labels)
-                if score > best_score:
-                    best_score = score
-                    best_labels = labels
-        except Exception:
-            continue
+    if fits and target_clusters in fits:
+        # already fitted for every random state while k was selected
+        best_labels, best_score = fits[target_clusters]
+    random_states = [] if best_labels is not None else KMEANS_RANDOM_STATES
+    for labels, score in sweep_random_states(embeddings, target_clusters, random_states):
+        if labels is not None and score > best_score:
+            best_score = score
+            best_labels = labels
     if best_labels is None:
         return {0: images}, DEFAULT_CLUSTER_SCORE
     clusters = {}
@@ -103,6 +188,25 @@ def try_improved_kmeans(embeddings: np.ndarray, images: List, target_clusters: i
         if i < len(images):
             clusters[label_int].append(images[i])
     return clusters, best_score
+def _fit_random_state(embeddings: np.ndarray, n_clusters: int, random_state: int) -> tuple:
+    try:
+        labels = make_kmeans(n_clusters, random_state, len(embeddings)).fit_predict(embeddings)
+        if len(set(labels)) > 1:
+            return labels, clustering_score(embeddings, labels, random_state)
+    except Exception:
+        pass
+    return None, DBSCAN_NOISE_LABEL
+def sweep_random_states(embeddings: np.ndarray, n_clusters: int, random_states: List[int]) -> List[tuple]:
+    """
+    (labels, silhouette) of one fit per random state. From KMEANS_SWEEP_MIN_SAMPLES rows the fits
+    run in parallel joblib processes, which get the matrix as a memmap instead of a pickled copy.
+    """
+    jobs = min(len(random_states), sweep_jobs or os.cpu_count() or 1)
+    if jobs <= 1 or len(embeddings) < KMEANS_SWEEP_MIN_SAMPLES:
+        return [_fit_random_state(embeddings, n_clusters, random_state) for random_state in random_states]
+    return Parallel(n_jobs=jobs, max_nbytes="1M")(
+        delayed(_fit_random_state)(embeddings, n_clusters, random_state) for random_state in random_states
+    )
 def try_dbscan_clustering(embeddings: np.ndarray, images: List) -> tuple:
     from sklearn.neighbors import NearestNeighbors
     k = min(KMEANS_N_INIT_EXPLORATION, len(embeddings) - 1)
@@ -131,14 +235,12 @@ def try_dbscan_clustering(embeddings: np.ndarray, images: List) -> tuple:
         clusters[largest_cluster].extend(noise_images)
     valid_labels = [l for l in labels if l != -1]
     if len(set(valid_labels)) > 1:
-        score = silhouette_score(embeddings[labels != -1], valid_labels)
+        score = clustering_score(embeddings[labels != -1], valid_labels)
     else:
         score = 0.0
     return clusters, score
-def run_kmeans(images: List, num_clusters: int = None) -> Dict[int, List[Dict]]:
-    logger.info(f" {len(images)} ")
-    if not images:
-        return {}
+def valid_embeddings(images: List) -> Tuple[np.ndarray, List]:
+    """Embedding matrix of the images whose embedding is usable, and those images"""
     embeddings = []
     valid_images = []
     for img in images:
@@ -151,30 +253,39 @@ def run_kmeans(images: List, num_clusters: int = None) -> Dict[int, List[Dict]]:
                         valid_images.append(img)
             except Exception as e:
                 continue
-    if len(embeddings) < MIN_CLUSTER_SIZE:
-        return {0: images}
-    logger.info(f" {len(valid_images)} {len(images)}")
+    return np.array(embeddings, dtype=np.float32), valid_images
+def cluster_matrix(embeddings: np.ndarray, num_clusters: int = None) -> Dict[int, List[int]]:
+    """
+    Cluster the rows of an embedding matrix: label -> row numbers. Works on plain arrays only,
+    so it can run in a worker process on a memmapped slice (see services/parallel_clustering.py).
+    """
+    rows = list(range(len(embeddings)))
     embeddings = preprocess_embeddings(embeddings)
     if len(embeddings) == DEFAULT_CLUSTER_ID:
-        return {DEFAULT_CLUSTER_ID: images}
+        return {DEFAULT_CLUSTER_ID: rows}
     scaler = StandardScaler()
     try:
         X_scaled = scaler.fit_transform(embeddings)
     except Exception as e:
         X_scaled = embeddings
+    fits: KMeansFits = {}
     if num_clusters is None:
-        num_clusters = find_optimal_clusters(X_scaled, max_k=min(KMEANS_MAX_K_LIMIT, len(valid_images) // CLUSTERING_DIVISOR))
+        num_clusters = find_optimal_clusters(X_scaled, max_k=min(KMEANS_MAX_K_LIMIT, len(rows) // CLUSTERING_DIVISOR),
+                                             fits=fits)
     else:
-        num_clusters = min(num_clusters, len(valid_images))
+        num_clusters = min(num_clusters, len(rows))
     if num_clusters < CLUSTERING_MIN_CLUSTERS:
         num_clusters = CLUSTERING_MIN_CLUSTERS
     logger.info(f" {num_clusters} clusters")
     if num_clusters == 1:
-        return {DEFAULT_CLUSTER_ID: valid_images}
-    clusters = try_advanced_clustering(X_scaled, valid_images, num_clusters)
-    if not clusters:
-        return {DEFAULT_CLUSTER_ID: valid_images}
-    invalid_images = [img for img in images if img not in valid_images]
+        return {DEFAULT_CLUSTER_ID: rows}
+    clusters = try_advanced_clustering(X_scaled, rows, num_clusters, fits)
+    return clusters or {DEFAULT_CLUSTER_ID: rows}
+def assign_images(images: List, valid_images: List, row_clusters: Dict[int, List[int]]) -> Dict[int, List]:
+    """Turn the row numbers of cluster_matrix() back into images; unusable images join the largest cluster"""
+    clusters = {label: [valid_images[row] for row in rows] for label, rows in row_clusters.items()}
+    valid_ids = {id(img) for img in valid_images}
+    invalid_images = [img for img in images if id(img) not in valid_ids]
     if invalid_images and clusters:
         largest_cluster = max(clusters.keys(), key=lambda k: len(clusters[k]))
         clusters[largest_cluster].extend(invalid_images)
@@ -186,6 +297,15 @@ def run_kmeans(images: List, num_clusters: int = None) -> Dict[int, List[Dict]]:
     for cluster_id, cluster_images in clusters.items():
         logger.debug(f"    {cluster_id}: {len(cluster_images)} ")
     return clusters
+def run_kmeans(images: List, num_clusters: int = None) -> Dict[int, List[Dict]]:
+    logger.info(f" {len(images)} ")
+    if not images:
+        return {}
+    embeddings, valid_images = valid_embeddings(images)
+    if len(embeddings) < MIN_CLUSTER_SIZE:
+        return {0: images}
+    logger.info(f" {len(valid_images)} {len(images)}")
+    return assign_images(images, valid_images, cluster_matrix(embeddings, num_clusters))
 def validate_clustering_result(clusters: Dict[int, List], min_cluster_size: int = MIN_CLUSTER_SIZE):
     if not clusters:
         return clusters
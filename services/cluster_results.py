@@ -0,0 +1,257 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from db.cluster_result_access import (dataset_fingerprint, save_cluster_run, latest_cluster_run, load_cluster_run,
+                                      cluster_run_info, unassigned_images, sync_cluster_links, set_run_fingerprint,
+                                      images_by_path)
+from db.models import ExtraTrainingImage
+from db.setup import SessionLocal
+from services.classifier_predictor import CLASSIFIER_MODEL_PATH
+from services.enhanced_cluster_processing_service import process_enhanced_clusters
+from services.cluster_assignment import fit_category_models, load_models, assign_to_run, warm_refit
+from config import (CLUSTER_FINGERPRINT_TTL_SECONDS, CLUSTER_RESULT_VERSION, MAX_CLUSTERS_PER_CATEGORY,
+                    CLUSTERING_DIVISOR, SCALABLE_CLUSTERING_MIN_SAMPLES)
+logger = logging.getLogger(__name__)
+
+
+class ClusterResultStore:
+    """
+    Serves /coco/clustering from the last materialized run (clusters / cluster_images), kept in
+    memory as well. A run is current while the fingerprint of extra_training_images, the
+    classifier and the clustering settings matches the one it was computed from. When only the
+    images changed, new ones are assigned to the nearest stored centroid and drifted categories
+    are refit from their centroids in the background; when the classifier or the settings
+    changed, the stale run keeps being served while a full clustering job runs.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._computing = threading.Lock()
+        self._assigning = threading.Lock()
+        self._result: Optional[List[Dict]] = None
+        self._run: Optional[Dict] = None
+        self._fingerprint: Optional[str] = None
+        self._fingerprint_checked = 0.0
+        self._catching_up = False
+        # fingerprint for which catch_up found it cannot help; only the full job is waited for
+        self._full_run_needed: Optional[str] = None
+        self.stats_counters = {"served": 0, "stale_served": 0, "recomputes": 0, "assigned": 0, "refits": 0}
+
+    def get(self, db) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
+        """
+        The clustering result and its run info, or (None, None) while nothing is stored yet; a
+        missing or stale run is brought up to date in the background, never inside the request.
+        """
+        fingerprint = self.fingerprint(db)
+        if self._run is None or self._run["fingerprint"] != fingerprint:
+            # another worker process may have stored a newer run already
+            self._load_latest(db)
+        with self._lock:
+            result, run = self._result, self._run
+        if run is None:
+            self.recompute_in_background(fingerprint)
+            return None, None
+        stale = run["fingerprint"] != fingerprint
+        if stale:
+            self.stats_counters["stale_served"] += 1
+            self.update_in_background(fingerprint)
+        self.stats_counters["served"] += 1
+        return result, {**run, "stale": stale, "recomputing": self._computing.locked()}
+
+    def current(self) -> Tuple[Optional[List[Dict]], Optional[Dict]]:
+        with self._lock:
+            return self._result, self._run
+
+    @staticmethod
+    def settings() -> str:
+        """Digest of what a run was computed with besides the images: classifier and clustering settings"""
+        try:
+            classifier_version = os.stat(CLASSIFIER_MODEL_PATH).st_mtime_ns
+        except OSError:
+            classifier_version = 0
+        raw = f"{classifier_version}:{CLUSTER_RESULT_VERSION}:{MAX_CLUSTERS_PER_CATEGORY}:{CLUSTERING_DIVISOR}:" \
+              f"{SCALABLE_CLUSTERING_MIN_SAMPLES}"
+        return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+    def fingerprint(self, db, force: bool = False) -> str:
+        now = time.monotonic()
+        if force or self._fingerprint is None or now - self._fingerprint_checked >= CLUSTER_FINGERPRINT_TTL_SECONDS:
+            self._fingerprint = dataset_fingerprint(db, self.settings())
+            self._fingerprint_checked = now
+        return self._fingerprint
+
+    def recompute(self, db, fingerprint: Optional[str] = None,
+                  on_progress: Optional[Callable[[str, Dict], None]] = None,
+                  should_continue: Optional[Callable[[], bool]] = None) -> None:
+        with self._computing:
+            fingerprint = fingerprint or self.fingerprint(db, force=True)
+            if self._run is not None and self._run["fingerprint"] == fingerprint:
+                return
+            started = time.perf_counter()
+            result = process_enhanced_clusters(db, on_progress=on_progress, should_continue=should_continue)
+            paths = [image["path"] for category in result for cluster in category["clusters"]
+                     for image in cluster["images"]]
+            models = fit_category_models(result, images_by_path(db, paths))
+            seconds = round(time.perf_counter() - started, 2)
+            image_count = len(set(paths))
+            save_cluster_run(db, fingerprint, result, image_count, seconds, models, self.settings())
+            self._load_latest(db)
+            self.stats_counters["recomputes"] += 1
+            logger.info(f"Clustering recomputed: {len(result)} categories, {image_count} images in {seconds}s")
+
+    def catch_up(self, db, fingerprint: Optional[str] = None) -> bool:
+        """
+        Bring the stored run up to date without reclustering: drop removed images, assign new ones
+        to their nearest centroid. False when that is not possible (no run, other settings, or a
+        category the run has no model for) and a full clustering is needed.
+        """
+        with self._assigning:
+            # read under _assigning: a refit that finished meanwhile has replaced the run
+            with self._lock:
+                run = self._run
+            if run is None or run["settings"] != self.settings():
+                return False
+            try:
+                # taken before looking for unassigned images, so nothing inserted later is stamped as covered
+                fingerprint = fingerprint or self.fingerprint(db, force=True)
+                sync_cluster_links(db, run["id"])
+                summary = assign_to_run(db, run["id"], unassigned_images(db, run["id"]))
+                if summary["unknown"]:
+                    db.rollback()
+                    logger.info(f"Clustering needs a full run, no model for: {', '.join(summary['unknown'])}")
+                    return False
+                set_run_fingerprint(db, run["id"], fingerprint)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Incremental cluster assignment failed: {e}")
+                return False
+        self._load_latest(db)
+        self.stats_counters["assigned"] += summary["assigned"]
+        if summary["drifted"]:
+            self.refit_in_background()
+        return True
+
+    def update_in_background(self, fingerprint: str) -> None:
+        """catch_up on a thread of its own; when it cannot help, the full clustering job takes over"""
+        if self._full_run_needed == fingerprint:
+            self.recompute_in_background(fingerprint)
+            return
+        with self._lock:
+            if self._catching_up:
+                return
+            self._catching_up = True
+        threading.Thread(target=self._catch_up_thread, args=(fingerprint,), name="cluster-catch-up",
+                         daemon=True).start()
+
+    def _catch_up_thread(self, fingerprint: str) -> None:
+        db = SessionLocal()
+        try:
+            if not self.catch_up(db, fingerprint):
+                self._full_run_needed = fingerprint
+                self.recompute_in_background(fingerprint)
+        except Exception as e:
+            logger.error(f"Clustering catch-up failed: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._catching_up = False
+
+    def assign_new_images(self, db, images: Iterable[ExtraTrainingImage]) -> Optional[Dict]:
+        """
+        Insert-time hook: place freshly stored images into the current run right away. Returns the
+        assign_to_run summary (None without a usable run); refitting drifted categories is left to
+        the caller. The run's fingerprint is not moved: other images may have arrived meanwhile,
+        and the server's catch_up stamps it once it has checked for those.
+        """
+        run = latest_cluster_run(db)
+        if run is None or run.settings != self.settings():
+            return None
+        summary = assign_to_run(db, run.id, images)
+        if summary["unknown"]:
+            db.rollback()
+            return summary
+        db.commit()
+        self.stats_counters["assigned"] += summary["assigned"]
+        return summary
+
+    def refit_drifted(self, db, on_progress: Optional[Callable[[str, Dict], None]] = None,
+                      should_continue: Optional[Callable[[], bool]] = None) -> List[str]:
+        """Refit the categories whose drift passed the thresholds, warm-started from their centroids"""
+        # _assigning keeps catch_up from assigning into (and stamping) the run being replaced
+        with self._computing, self._assigning:
+            self._load_latest(db)
+            with self._lock:
+                result, run = self._result, self._run
+            if run is None:
+                return []
+            models = load_models(db, run["id"])
+            drifted = [category for category, model in models.items() if model.drifted]
+            if not drifted:
+                return []
+            for category in drifted:
+                if on_progress is not None:
+                    on_progress(category, {"status": "running"})
+            started = time.perf_counter()
+            new_result, new_models = warm_refit(db, result, models, drifted)
+            paths = {image["path"] for category in new_result for cluster in category["clusters"]
+                     for image in cluster["images"]}
+            # the refit covers exactly the images of the run, so it keeps the run's fingerprint
+            save_cluster_run(db, run["fingerprint"], new_result, len(paths),
+                             round(time.perf_counter() - started, 2), new_models, run["settings"])
+            self._load_latest(db)
+            self.stats_counters["refits"] += 1
+            for category in drifted:
+                if on_progress is not None:
+                    on_progress(category, {"status": "done"})
+            return drifted
+
+    def refit_in_background(self) -> Dict:
+        from services.clustering_jobs import get_clustering_jobs
+        return get_clustering_jobs().submit({"mode": "refit"})
+
+    def warm(self, db) -> None:
+        """Load the stored run into memory and bring it up to date (startup)"""
+        fingerprint = self.fingerprint(db, force=True)
+        self._load_latest(db)
+        if self._run is None:
+            self.recompute_in_background(fingerprint)
+        elif self._run["fingerprint"] != fingerprint and not self.catch_up(db, fingerprint):
+            self._full_run_needed = fingerprint
+            self.recompute_in_background(fingerprint)
+
+    def recompute_in_background(self, fingerprint: Optional[str] = None) -> Dict:
+        """Submit (or attach to) the clustering job with the default settings; returns the job"""
+        from services.clustering_jobs import get_clustering_jobs
+        return get_clustering_jobs().submit({}, fingerprint=fingerprint)
+
+    def stats(self, db=None) -> Dict:
+        stats = {"run": self._run, "fingerprint": self._fingerprint, "recomputing": self._computing.locked(),
+                 **self.stats_counters}
+        if db is not None and self._run is not None:
+            stats["drift"] = {category: model.drift() for category, model in load_models(db, self._run["id"]).items()}
+        return stats
+
+    def _load_latest(self, db) -> None:
+        run = latest_cluster_run(db)
+        # incremental assignment keeps the run id and only moves the fingerprint
+        current = (self._run["id"], self._run["fingerprint"]) if self._run is not None else None
+        if run is None or current == (run.id, run.fingerprint):
+            return
+        result = load_cluster_run(db, run.id)
+        with self._lock:
+            self._result, self._run = result, cluster_run_info(run)
+
+
+def get_cluster_result_store() -> ClusterResultStore:
+    return ClusterResultStore.get_instance()
@@ -0,0 +1,180 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from db.setup import SessionLocal
+from services.cluster_results import get_cluster_result_store
+from services.enhanced_cluster_processing_service import process_enhanced_clusters, ClusteringCancelled
+from config import CLUSTERING_JOB_WORKERS, CLUSTERING_JOB_HISTORY, MAX_CLUSTERS_PER_CATEGORY
+logger = logging.getLogger(__name__)
+FINISHED = ("done", "failed", "cancelled")
+
+
+class ClusteringJob:
+    def __init__(self, params: Dict, fingerprint: str):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.fingerprint = fingerprint
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.result: Optional[List[Dict]] = None
+        self.run_id: Optional[int] = None
+        # category -> {"status": pending/running/done, "images": n, "clusters": n}
+        self.categories: "OrderedDict[str, Dict]" = OrderedDict()
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+
+    @property
+    def key(self) -> tuple:
+        return tuple(sorted(self.params.items())), self.fingerprint
+
+    def on_progress(self, category: str, info: Dict) -> None:
+        self.categories[category] = {**self.categories.get(category, {}), **info}
+
+    def to_dict(self) -> Dict:
+        categories = dict(self.categories)
+        done = sum(1 for info in categories.values() if info.get("status") == "done")
+        running = [name for name, info in categories.items() if info.get("status") == "running"]
+        finished = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "fingerprint": self.fingerprint,
+            "progress": {"categories_total": len(categories), "categories_done": done,
+                         "current_category": running[0] if running else None, "categories": categories},
+            "run_id": self.run_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "seconds": round(finished - self.started_at, 2) if self.started_at else None,
+        }
+
+
+class ClusteringJobManager:
+    """
+    Clustering runs as jobs on a small thread pool instead of inside HTTP requests. A job is
+    keyed by its parameters and the dataset fingerprint, so submitting the same clustering
+    again attaches to the queued, running or finished job. Jobs with the default settings
+    store their result as the materialized /coco/clustering run; others keep it on the job,
+    for the last CLUSTERING_JOB_HISTORY finished jobs. A "refit" job refits the drifted
+    categories of the materialized run from their centroids.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, workers: int = CLUSTERING_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="clustering-job")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, ClusteringJob]" = OrderedDict()
+        self._by_key: Dict[tuple, str] = {}
+
+    @staticmethod
+    def normalize_params(params: Dict) -> Dict:
+        max_clusters = params.get("max_clusters_per_category") or MAX_CLUSTERS_PER_CATEGORY
+        mode = params.get("mode") or "full"
+        if mode not in ("full", "refit"):
+            raise ValueError(f"unknown clustering mode: {mode}")
+        return {"max_clusters_per_category": int(max_clusters), "mode": mode}
+
+    def submit(self, params: Dict, fingerprint: Optional[str] = None) -> Dict:
+        params = self.normalize_params(params)
+        if fingerprint is None:
+            db = SessionLocal()
+            try:
+                fingerprint = get_cluster_result_store().fingerprint(db, force=True)
+            finally:
+                db.close()
+        job = ClusteringJob(params, fingerprint)
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(job.key))
+            if existing is not None and existing.status in ("queued", "running", "done"):
+                return {**existing.to_dict(), "attached": True}
+            self._jobs[job.id] = job
+            self._by_key[job.key] = job.id
+            job.future = self._executor.submit(self._run, job)
+        logger.info(f"Clustering job {job.id} submitted: {params}")
+        return {**job.to_dict(), "attached": False}
+
+    def get(self, job_id: str) -> Optional[ClusteringJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        job = self.get(job_id)
+        return job.to_dict() if job is not None else None
+
+    def result(self, job_id: str) -> Optional[List[Dict]]:
+        job = self.get(job_id)
+        return job.result if job is not None else None
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a queued job right away, a running one at the next category"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.status == "queued" and job.future.cancel():
+            self._finish(job, "cancelled")
+        return job.to_dict()
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def _run(self, job: ClusteringJob) -> None:
+        if job.cancel_event.is_set():
+            self._finish(job, "cancelled")
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        should_continue = lambda: not job.cancel_event.is_set()
+        db = SessionLocal()
+        try:
+            store = get_cluster_result_store()
+            if job.params["mode"] == "refit":
+                store.refit_drifted(db, on_progress=job.on_progress, should_continue=should_continue)
+                job.result, run = store.current()
+                job.run_id = run["id"] if run else None
+            elif job.params == self.normalize_params({}):
+                store.recompute(db, job.fingerprint, on_progress=job.on_progress, should_continue=should_continue)
+                job.result, run = store.current()
+                job.run_id = run["id"] if run else None
+            else:
+                job.result = process_enhanced_clusters(db, job.params["max_clusters_per_category"],
+                                                       on_progress=job.on_progress, should_continue=should_continue)
+            self._finish(job, "done")
+        except ClusteringCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            logger.error(f"Clustering job {job.id} failed: {e}")
+            job.error = str(e)
+            self._finish(job, "failed")
+        finally:
+            db.close()
+
+    def _finish(self, job: ClusteringJob, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        logger.info(f"Clustering job {job.id} {status}")
+        with self._lock:
+            finished = [other for other in self._jobs.values() if other.status in FINISHED]
+            for old in finished[:max(0, len(finished) - CLUSTERING_JOB_HISTORY)]:
+                self._jobs.pop(old.id, None)
+                if self._by_key.get(old.key) == old.id:
+                    self._by_key.pop(old.key)
+
+
+def get_clustering_jobs() -> ClusteringJobManager:
+    return ClusteringJobManager.get_instance()
@@ -1,14 +1,17 @@
 import os
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from dataclasses import dataclass
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sqlalchemy import text
 from sqlalchemy.orm import Session
-from services.text_encoder import encode_text, TextEncoder
-from db.models import SearchHistory
-from config import SCORE_THRESHOLD, MAX_RESULTS,TOP_K,ROUND_DECIMALS
+from services.text_encoder import encode_query
+from services.search_history_buffer import record_search
+from db.vector_index import vector_search
+from db.image_root_access import folder_scope, path_key
+from services.vector_mirror import mirror_for
+from services.hybrid_search import hybrid_search
+from services.word_vocabulary import get_vocabulary
+from services.result_cache import get_result_cache
+from config import SCORE_THRESHOLD, MAX_RESULTS,TOP_K,ROUND_DECIMALS, SEARCH_MODE
 logger = logging.getLogger(__name__)
 @dataclass
 class SearchResult:
@@ -21,63 +24,39 @@ class SearchResult:
 class ImageSearchService:
     """Service class for image search operations"""
     def __init__(self):
-        self._model = TextEncoder.get_instance()
-        self._cache: Dict[str, List[SearchResult]] = {}
+        self._cache = get_result_cache()
 
     def clear_cache(self) -> None:
-        """Clear the search cache"""
-        self._cache.clear()
+        """Clear the cached user-folder results"""
+        self._cache.clear("user")
         logger.info("Search cache cleared")
     def _normalize_path(self, path: str) -> str:
         """Normalize file path for consistent comparison"""
         return path.replace("\\", "/").lower().strip()
     def _save_search_history(self, query: str, db: Session) -> None:
-        """Save search query to history"""
+        """Queue the query for the search history (written in the background, no commit here)"""
         try:
-            search_entry = SearchHistory(query=query)
-            db.add(search_entry)
-            db.commit()
+            record_search(query)
         except Exception as e:
             logger.error(f"Failed to save search history: {e}")
-            db.rollback()
     def _get_matched_words(self, query: str, caption: str, top_k: int = TOP_K, threshold: float = SCORE_THRESHOLD) -> List[str]:
         """Find the top matching words from a caption that are semantically similar to the query."""
-        if not query or not caption:
-            return []
-        try:
-            query_words = [word.strip() for word in query.lower().split() if word.strip()]
-            caption_words = [word.strip() for word in caption.lower().split() if word.strip()]
-
-            if not query_words or not caption_words:
-                return []
-
-            query_vecs = self._model.encode(query_words)
-            caption_vecs = self._model.encode(caption_words)
-
-            if query_vecs is None or caption_vecs is None:
-                logger.warning("Failed to encode words for similarity matching")
-                return []
-
-            matches = []
-            for i, q_vec in enumerate(query_vecs):
-                if q_vec is None:
-                    continue
-
-                similarities = cosine_similarity([q_vec], caption_vecs)[0]
-                max_similarity = np.max(similarities)
-
-                if max_similarity >= threshold:
-                    matches.append((query_words[i], float(max_similarity)))
-
-            # Sort by similarity score (descending)
-            matches.sort(key=lambda x: x[1], reverse=True)
-            return [word for word, _ in matches[:top_k]]
+        return self._get_matched_words_batch(query, [caption], top_k, threshold)[0]
 
+    def _get_matched_words_batch(self, query: str, captions: List[str], top_k: int = TOP_K,
+                                 threshold: float = SCORE_THRESHOLD) -> List[List[str]]:
+        """Matched words for every caption of a result page, with one matrix multiply over the vocabulary."""
+        if not query or not captions:
+            return [[] for _ in captions]
+        try:
+            return get_vocabulary().matched_words(query, captions, top_k, threshold)
         except Exception as e:
             logger.error(f"Error computing word embeddings: {e}")
-            return []
+            return [[] for _ in captions]
 
-    def search_in_user_folder(self, query: str, folder_path: str, db: Session) -> List[Dict]:
+    def search_in_user_folder(self, query: str, folder_path: str, db: Session,
+                              ef_search: Optional[int] = None, probes: Optional[int] = None,
+                              mode: Optional[str] = None) -> List[Dict]:
         """
         Search user images stored in the database using a text query.
 
@@ -85,6 +64,9 @@ class ImageSearchService:
             query: The user's textual description to search for
             folder_path: The absolute path to the user's image folder
             db: The active database session
+            ef_search: HNSW candidate list size for this query (recall vs. speed)
+            probes: IVFFlat lists to visit for this query
+            mode: "vector" or "hybrid" (full-text + vector, rank fused); SEARCH_MODE by default
 
         Returns:
             A list of dictionaries with search results
@@ -97,67 +79,52 @@ class ImageSearchService:
             logger.warning("Empty folder path provided")
             return []
         query = query.strip()
-        logger.info(f"Starting search in user folder for query: '{query}'")
+        mode = mode or SEARCH_MODE
+        logger.info(f"Starting {mode} search in user folder for query: '{query}'")
         # Check cache first
-        cache_key = f"{query}:{folder_path}"
-        if cache_key in self._cache:
+        cache_key = (query, folder_path, ef_search, probes, mode)
+        cache_version = self._cache.version("user")
+        cached = self._cache.get("user", cache_key)
+        if cached is not None:
             logger.info("Returning cached results")
-            # Convert cached SearchResult objects to dictionaries
-            return [
-                {
-                    "filename": result.filename,
-                    "caption": result.caption,
-                    "score": result.score,
-                    "path": result.path,
-                    "matched_words": result.matched_words
-                }
-                for result in self._cache[cache_key]
-            ]
+            return [dict(result) for result in cached]
 
         # Save search history
         self._save_search_history(query, db)
 
         try:
             # Encode query
-            query_embedding = encode_text(query)
+            query_embedding = encode_query(query)
             if query_embedding is None:
                 logger.error("Failed to encode query text")
                 return []
 
-            # Normalize folder path
-            folder_path_normalized = self._normalize_path(folder_path)
-
-            # Execute search query using pgvector
+            # Execute search query - in-memory mirror when enabled, pgvector otherwise
             embedding_list = query_embedding.tolist()
-            result = db.execute(
-                text("""
-                     SELECT image_path,
-                            caption,
-                            (embedding <=> CAST(:embedding_vector AS vector)) as distance
-                     FROM user_images
-                     WHERE LOWER(REPLACE(image_path, CHR(92), '/')) LIKE :folder_pattern
-                       AND embedding IS NOT NULL
-                       AND caption IS NOT NULL
-                       AND caption != ''
-                      AND (embedding <=> CAST(:embedding_vector AS vector)) <= :score_threshold
-                     ORDER BY embedding <=> CAST (:embedding_vector AS vector)
-                         LIMIT :max_results
-                     """),
-                {
-                    'embedding_vector': str(embedding_list),
-                    'folder_pattern': f"{folder_path_normalized}%",
-                    'score_threshold': float(SCORE_THRESHOLD),
-                    'max_results': int(MAX_RESULTS)
-                }
-            )
+            mirror = mirror_for("user_images")
+            path_prefix = f"{path_key(folder_path)}/"
+            if mirror is not None and mode != "hybrid":
+                result = mirror.search(query_embedding, MAX_RESULTS, SCORE_THRESHOLD, path_prefix=path_prefix)
+            else:
+                # indexed folder filter: root partial index, or an exact scan of a small folder
+                scope = folder_scope(db, folder_path)
+                where = f"""{scope.where}
+                             AND caption IS NOT NULL
+                             AND caption != ''"""
+                if mode == "hybrid":
+                    result = hybrid_search("user_images", query, query_embedding, MAX_RESULTS, SCORE_THRESHOLD,
+                                           where=where, params=scope.params, ef_search=ef_search, probes=probes,
+                                           exact=scope.exact, path_prefix=path_prefix)
+                else:
+                    result = vector_search(
+                        db, "user_images", str(embedding_list), limit=MAX_RESULTS, threshold=SCORE_THRESHOLD,
+                        where=where, params=scope.params, ef_search=ef_search, probes=probes, exact=scope.exact
+                    )
             # Process results
-            search_results = []
             final_results = []
-            for row in result:
-                if not row.image_path or not row.caption:
-                    continue
-                matched_words = self._get_matched_words(query, row.caption)
-                # Create SearchResult for cache
+            rows = [row for row in result if row.image_path and row.caption]
+            matched_per_row = self._get_matched_words_batch(query, [row.caption for row in rows])
+            for row, matched_words in zip(rows, matched_per_row):
                 search_result = SearchResult(
                     filename=os.path.basename(row.image_path),
                     caption=row.caption,
@@ -165,8 +132,6 @@ class ImageSearchService:
                     path=self._normalize_path(row.image_path),
                     matched_words=matched_words
                 )
-                search_results.append(search_result)
-                # Create dictionary for return
                 final_results.append({
                     "filename": search_result.filename,
                     "caption": search_result.caption,
@@ -174,20 +139,23 @@ class ImageSearchService:
                     "path": search_result.path,
                     "matched_words": search_result.matched_words
                 })
-            logger.info(f"Found {len(final_results)} results using pgvector")
-            # Cache results
-            self._cache[cache_key] = search_results
+            backend = "hybrid" if mode == "hybrid" else ("vector mirror" if mirror else "pgvector")
+            logger.info(f"Found {len(final_results)} results using {backend}")
+            # Cache results - dropped automatically once new user images are ingested
+            self._cache.put("user", cache_key, final_results, cache_version)
 
-            return final_results
+            return [dict(result) for result in final_results]
 
         except Exception as e:
             logger.error(f"Error during search operation: {e}")
             return []
 # Global service instance
 _search_service = ImageSearchService()
-def search_in_user_folder(query: str, folder_path: str, db: Session) -> List[Dict]:
+def search_in_user_folder(query: str, folder_path: str, db: Session,
+                          ef_search: Optional[int] = None, probes: Optional[int] = None,
+                          mode: Optional[str] = None) -> List[Dict]:
     """Search user images in a folder using text query."""
-    return _search_service.search_in_user_folder(query, folder_path, db)
+    return _search_service.search_in_user_folder(query, folder_path, db, ef_search, probes, mode)
 def clear_search_cache() -> None:
     """Clear the search cache"""
     _search_service.clear_cache()
@@ -210,4 +178,8 @@ def get_matched_words(
     Returns:
         A list of top matched words from the caption
     """
-    return _search_service._get_matched_words(query, caption, top_k, threshold)
\ No newline at end of file
+    return _search_service._get_matched_words(query, caption, top_k, threshold)
+def get_matched_words_batch(query: str, captions: List[str], top_k: int = TOP_K,
+                            threshold: float = SCORE_THRESHOLD) -> List[List[str]]:
+    """Matched words for several captions at once (one entry per caption, same order)."""
+    return _search_service._get_matched_words_batch(query, captions, top_k, threshold)
@@ -1,11 +1,12 @@
 import numpy as np
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 from sqlalchemy.orm import Session
 from db.models import ExtraTrainingImage
-from services.cluster_engine import run_kmeans
+from services.cluster_engine import valid_embeddings, cluster_matrix, assign_images
+from services.parallel_clustering import cluster_categories, ClusteringCancelled
 from services.classifier_predictor import get_classifier_model, get_category_from_caption
 from collections import defaultdict, Counter
-from config import MIN_WORD_LENGTH,MAX_CLUSTERS_PER_CATEGORY,MIN_CLUSTERS_PER_CATEGORY,CLUSTERING_DIVISOR,ROUND,COHERENCE_SCALE
+from config import MIN_WORD_LENGTH,MAX_CLUSTERS_PER_CATEGORY,MIN_CLUSTERS_PER_CATEGORY,CLUSTERING_DIVISOR,ROUND,COHERENCE_SCALE,MIN_CLUSTER_SIZE
 import re
 import logging
 logger = logging.getLogger(__name__)
@@ -71,21 +72,14 @@ def analyze_cluster_quality(cluster_images: List) -> Dict:
         "dominant_theme": dominant_theme,
         "size": len(cluster_images)
     }
-def process_enhanced_clusters(db: Session) -> List[Dict]:
-    images: List[ExtraTrainingImage] = db.query(ExtraTrainingImage).all()
-    if not images:
-        return []
-
-    # הסרת כפילויות לפי path
-    unique_images = {img.image_path: img for img in images}
-    unique_imgs_list = list(unique_images.values())
-
+def categorize_images(images: List) -> Dict[str, List]:
+    """Category (classifier prediction, normalized) -> images; "Uncategorized" when there is none"""
     try:
         classifier_model = get_classifier_model()
         categorized_images = defaultdict(list)
         uncategorized_images = []
 
-        for img in unique_imgs_list:
+        for img in images:
             category = None
             if hasattr(img, 'embedding') and img.embedding is not None:
                 try:
@@ -104,7 +98,7 @@ def process_enhanced_clusters(db: Session) -> List[Dict]:
     except Exception as e:
         print(f"Classifier error: {e}")
         categorized_images = {}
-        uncategorized_images = unique_imgs_list
+        uncategorized_images = images
 
     # איחוד קבוצות
     all_groups = dict(categorized_images)
@@ -115,11 +109,89 @@ def process_enhanced_clusters(db: Session) -> List[Dict]:
     for category_name, category_images in all_groups.items():
         normalized_name = normalize_category_name(category_name)
         merged_groups[normalized_name].extend(category_images)
+    return dict(merged_groups)
+def build_category_clusters(category_name: str, clusters: Dict[int, List]) -> List[Dict]:
+    """Named clusters of one category, most coherent first"""
+    from services.save_clusters_to_db import smart_clustering_engine
+    category_clusters = []
+    for cluster_id, cluster_imgs in clusters.items():
+        cluster_info = smart_clustering_engine.generate_cluster_name(
+            cluster_imgs, category_name, cluster_id
+        )
+        original_name = cluster_info["name"]
+        words = original_name.strip().split()
+        if len(words) == MIN_CLUSTERS_PER_CATEGORY and words[0].lower() == words[1].lower():
+            original_name = words[0].capitalize()
+
+        quality = analyze_cluster_quality(cluster_imgs)
+
+        cluster_data = {
+            "id": cluster_id,
+            "name": original_name,
+            "quality": quality,
+            "images": [{
+                "caption": getattr(img, 'blip_caption', '') or getattr(img, 'caption', ''),
+                "path": getattr(img, 'image_path', '')
+            } for img in cluster_imgs]
+        }
+        category_clusters.append(cluster_data)
+
+    category_clusters.sort(
+        key=lambda x: (x["quality"]["coherence"], len(x["images"])),
+        reverse=True
+    )
+    return category_clusters
+def process_enhanced_clusters(db: Session, max_clusters_per_category: int = MAX_CLUSTERS_PER_CATEGORY,
+                              on_progress: Optional[Callable[[str, Dict], None]] = None,
+                              should_continue: Optional[Callable[[], bool]] = None) -> List[Dict]:
+    """
+    on_progress(category, info) is called when a category is found, starts and is done;
+    should_continue() is checked between categories and a False raises ClusteringCancelled.
+    The categories are clustered in parallel processes (services/parallel_clustering.py).
+    """
+    def report(category_name: str, **info):
+        if on_progress is not None:
+            on_progress(category_name, info)
+
+    images: List[ExtraTrainingImage] = db.query(ExtraTrainingImage).all()
+    if not images:
+        return []
+
+    # הסרת כפילויות לפי path
+    unique_images = {img.image_path: img for img in images}
+    unique_imgs_list = list(unique_images.values())
+
+    merged_groups = categorize_images(unique_imgs_list)
 
     final_result = []
-    from services.save_clusters_to_db import smart_clustering_engine
 
+    # מטריצת embeddings לכל קטגוריה; הקטגוריות בלתי תלויות ולכן מקובצות במקביל
+    matrices = {}
     for category_name, category_images in merged_groups.items():
+        report(category_name, status="pending", images=len(category_images))
+        if len(category_images) < MIN_CLUSTERS_PER_CATEGORY:
+            continue
+        embeddings, valid_images = valid_embeddings(category_images)
+        if len(embeddings) < MIN_CLUSTER_SIZE:
+            continue
+        # חישוב מספר הקלאסטרים
+        num_clusters = min(
+            max_clusters_per_category,
+            max(MIN_CLUSTERS_PER_CATEGORY, len(category_images) // CLUSTERING_DIVISOR)
+        )
+        matrices[category_name] = (embeddings, valid_images, num_clusters)
+
+    row_clusters = cluster_categories(
+        cluster_matrix,
+        {name: (embeddings, (num_clusters,)) for name, (embeddings, _, num_clusters) in matrices.items()},
+        on_done=lambda name, clusters: report(name, status="done", clusters=len(clusters)),
+        should_continue=should_continue,
+        on_start=lambda name: report(name, status="running"),
+    )
+
+    for category_name, category_images in merged_groups.items():
+        if should_continue is not None and not should_continue():
+            raise ClusteringCancelled(f"cancelled before {category_name}")
         if len(category_images) < MIN_CLUSTERS_PER_CATEGORY:
             cluster_name = get_meaningful_cluster_name(category_images, 0)
             quality = analyze_cluster_quality(category_images)
@@ -137,46 +209,16 @@ def process_enhanced_clusters(db: Session) -> List[Dict]:
                 "category": category_name,
                 "clusters": [cluster_data]
             })
+            report(category_name, status="done", images=len(category_images), clusters=1)
             continue
 
-        # חישוב מספר הקלאסטרים
-        num_clusters = min(
-            MAX_CLUSTERS_PER_CATEGORY,
-            max(MIN_CLUSTERS_PER_CATEGORY, len(category_images) // CLUSTERING_DIVISOR)
-        )
-
-        clusters = run_kmeans(category_images, num_clusters)
-        if not clusters:
-            continue
-
-        category_clusters = []
-        for cluster_id, cluster_imgs in clusters.items():
-            cluster_info = smart_clustering_engine.generate_cluster_name(
-                cluster_imgs, category_name, cluster_id
-            )
-            original_name = cluster_info["name"]
-            words = original_name.strip().split()
-            if len(words) == MIN_CLUSTERS_PER_CATEGORY and words[0].lower() == words[1].lower():
-                original_name = words[0].capitalize()
-
-            quality = analyze_cluster_quality(cluster_imgs)
-
-            cluster_data = {
-                "id": cluster_id,
-                "name": original_name,
-                "quality": quality,
-                "images": [{
-                    "caption": getattr(img, 'blip_caption', '') or getattr(img, 'caption', ''),
-                    "path": getattr(img, 'image_path', '')
-                } for img in cluster_imgs]
-            }
-            category_clusters.append(cluster_data)
-
-        category_clusters.sort(
-            key=lambda x: (x["quality"]["coherence"], len(x["images"])),
-            reverse=True
-        )
+        if category_name in matrices:
+            clusters = assign_images(category_images, matrices[category_name][1], row_clusters[category_name])
+        else:
+            clusters = {0: category_images}
+            report(category_name, status="done", images=len(category_images), clusters=1)
 
+        category_clusters = build_category_clusters(category_name, clusters)
         final_result.append({
             "category": category_name,
             "clusters": category_clusters
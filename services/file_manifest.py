@@ -0,0 +1,343 @@
+import os
+import time
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from db.user_models import FileManifestModel, ScanDirectoryModel
+from db.caption_cache_access import compute_content_hash
+from services.image_utils import is_image_file
+from services.index_changes import user_images_changed
+from config import MANIFEST_FULL_SCAN_INTERVAL_SECONDS
+logger = logging.getLogger(__name__)
+STATUS_PENDING = "pending"
+STATUS_INDEXED = "indexed"
+DB_CHUNK_SIZE = 1000
+
+
+@dataclass
+class ManifestDiff:
+    """What changed under a folder since the previous scan"""
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    moved: List[Tuple[str, str]] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    pending: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    scanned_dirs: int = 0
+    skipped_dirs: int = 0
+    elapsed_seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (f"added {len(self.added)}, modified {len(self.modified)}, moved {len(self.moved)}, "
+                f"deleted {len(self.deleted)}, unchanged {self.unchanged}, pending {len(self.pending)} | "
+                f"dirs listed {self.scanned_dirs}, skipped {self.skipped_dirs} | {self.elapsed_seconds:.1f}s")
+
+
+def _normalize(path: str) -> str:
+    return path.replace("\\", "/").rstrip("/")
+
+
+def _chunks(items: List, size: int = DB_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _load_manifest(db: Session, root: str):
+    prefix = root + "/%"
+    files = {}
+    files_by_dir = defaultdict(list)
+    for entry in db.query(FileManifestModel).filter(FileManifestModel.path.like(prefix)).yield_per(DB_CHUNK_SIZE):
+        files[entry.path] = (entry.size, entry.mtime_ns, entry.inode, entry.content_hash, entry.status)
+        files_by_dir[entry.dir_path].append(entry.path)
+    dirs = {}
+    subdirs_by_parent = defaultdict(list)
+    query = db.query(ScanDirectoryModel).filter(
+        (ScanDirectoryModel.path == root) | ScanDirectoryModel.path.like(prefix))
+    for entry in query.yield_per(DB_CHUNK_SIZE):
+        dirs[entry.path] = entry.mtime_ns
+        if entry.parent_path is not None:
+            subdirs_by_parent[entry.parent_path].append(entry.path)
+    return files, files_by_dir, dirs, subdirs_by_parent
+
+
+def _walk(root: str, known_dirs: Dict, files_by_dir: Dict, subdirs_by_parent: Dict, full: bool, diff: ManifestDiff):
+    """Stat every directory, but only list the ones whose mtime changed since the previous scan"""
+    seen_files = {}
+    unchanged_dir_files = set()
+    seen_dirs = {}
+    stack = [(root, None)]
+    while stack:
+        dir_path, parent = stack.pop()
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            continue
+        seen_dirs[dir_path] = (parent, dir_mtime)
+        if not full and known_dirs.get(dir_path) == dir_mtime:
+            # same listing as last time: trust the manifest for this directory's entries
+            diff.skipped_dirs += 1
+            unchanged_dir_files.update(files_by_dir.get(dir_path, ()))
+            stack.extend((subdir, dir_path) for subdir in subdirs_by_parent.get(dir_path, ()))
+            continue
+        diff.scanned_dirs += 1
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.') and not entry.name.startswith('$'):
+                                stack.append((_normalize(entry.path), dir_path))
+                        elif entry.is_file() and is_image_file(entry.name):
+                            stat = entry.stat()
+                            if stat.st_size > 0:
+                                seen_files[_normalize(entry.path)] = (stat.st_size, stat.st_mtime_ns, entry.inode() or None)
+                    except OSError as e:
+                        logger.warning(f"Cannot stat {entry.path}: {e}")
+        except OSError as e:
+            logger.warning(f"Cannot list {dir_path}: {e}")
+    return seen_files, unchanged_dir_files, seen_dirs
+
+
+def _match_moves(added: List[str], missing: List[str], seen_files: Dict, known_files: Dict) -> List[Tuple[str, str]]:
+    """Pair vanished files with new ones by (size, inode), falling back to the content hash"""
+    by_inode = {}
+    by_size = defaultdict(list)
+    for path in missing:
+        size, _, inode, content_hash, _ = known_files[path]
+        if inode:
+            by_inode[(size, inode)] = path
+        if content_hash:
+            by_size[size].append(path)
+    moves = []
+    claimed = set()
+    for new_path in added:
+        size, _, inode = seen_files[new_path]
+        old_path = by_inode.get((size, inode)) if inode else None
+        if old_path is None and by_size.get(size):
+            try:
+                content_hash = compute_content_hash(new_path)
+            except OSError:
+                continue
+            old_path = next((path for path in by_size[size]
+                             if path not in claimed and known_files[path][3] == content_hash), None)
+        if old_path is not None and old_path not in claimed:
+            claimed.add(old_path)
+            moves.append((old_path, new_path))
+    return moves
+
+
+def _apply_to_index(db: Session, diff: ManifestDiff) -> None:
+    """Keep user_images in line with the disk: follow moves, drop deleted and changed files"""
+    for old_path, new_path in diff.moved:
+        db.execute(text("""
+            DELETE FROM user_images
+            WHERE image_path = :old_path
+              AND EXISTS (SELECT 1 FROM user_images WHERE image_path = :new_path)
+        """), {"old_path": old_path, "new_path": new_path})
+        db.execute(text("UPDATE user_images SET image_path = :new_path WHERE image_path = :old_path"),
+                   {"old_path": old_path, "new_path": new_path})
+    # a modified file gets a fresh caption; the content-hash cache makes a pure touch cheap
+    for chunk in _chunks(diff.deleted + diff.modified):
+        db.execute(text("DELETE FROM user_images WHERE image_path = ANY(:paths)"), {"paths": chunk})
+
+
+def _save_manifest(db: Session, diff: ManifestDiff, seen_files: Dict, seen_dirs: Dict, known_dirs: Dict) -> None:
+    for chunk in _chunks(diff.deleted):
+        db.execute(delete(FileManifestModel).where(FileManifestModel.path.in_(chunk)))
+    for old_path, new_path in diff.moved:
+        size, mtime_ns, inode = seen_files[new_path]
+        db.execute(update(FileManifestModel).where(FileManifestModel.path == old_path).values(
+            path=new_path, dir_path=os.path.dirname(new_path), size=size, mtime_ns=mtime_ns, inode=inode))
+    moved_targets = {new_path for _, new_path in diff.moved}
+    rows = [
+        {"path": path, "dir_path": os.path.dirname(path), "size": seen_files[path][0],
+         "mtime_ns": seen_files[path][1], "inode": seen_files[path][2], "content_hash": None, "status": STATUS_PENDING}
+        for path in diff.added + diff.modified if path not in moved_targets
+    ]
+    for chunk in _chunks(rows):
+        statement = insert(FileManifestModel).values(chunk)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[FileManifestModel.path],
+            set_={column: statement.excluded[column]
+                  for column in ("dir_path", "size", "mtime_ns", "inode", "content_hash", "status")}))
+    dir_rows = [{"path": path, "parent_path": parent, "mtime_ns": mtime_ns}
+                for path, (parent, mtime_ns) in seen_dirs.items() if known_dirs.get(path) != mtime_ns]
+    for chunk in _chunks(dir_rows):
+        statement = insert(ScanDirectoryModel).values(chunk)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[ScanDirectoryModel.path],
+            set_={"parent_path": statement.excluded.parent_path, "mtime_ns": statement.excluded.mtime_ns}))
+    gone_dirs = [path for path in known_dirs if path not in seen_dirs]
+    for chunk in _chunks(gone_dirs):
+        db.execute(delete(ScanDirectoryModel).where(ScanDirectoryModel.path.in_(chunk)))
+
+
+def _diff(db: Session, root: str, full: bool):
+    """The changes under root since the stored manifest, plus what persisting them needs; writes nothing"""
+    started = time.perf_counter()
+    diff = ManifestDiff()
+    known_files, files_by_dir, known_dirs, subdirs_by_parent = _load_manifest(db, root)
+    seen_files, unchanged_dir_files, seen_dirs = _walk(root, known_dirs, files_by_dir, subdirs_by_parent, full, diff)
+
+    added = []
+    for path, (size, mtime_ns, _) in seen_files.items():
+        known = known_files.get(path)
+        if known is None:
+            added.append(path)
+        elif known[0] != size or known[1] != mtime_ns:
+            diff.modified.append(path)
+        else:
+            diff.unchanged += 1
+    diff.unchanged += len(unchanged_dir_files)
+    missing = [path for path in known_files if path not in seen_files and path not in unchanged_dir_files]
+    diff.moved = _match_moves(added, missing, seen_files, known_files)
+    moved_from = {old_path for old_path, _ in diff.moved}
+    moved_to = {new_path for _, new_path in diff.moved}
+    diff.added = [path for path in added if path not in moved_to]
+    diff.deleted = [path for path in missing if path not in moved_from]
+
+    deleted = set(diff.deleted)
+    candidates = {path for path, known in known_files.items()
+                  if known[4] != STATUS_INDEXED and path not in moved_from and path not in deleted}
+    candidates |= moved_to | set(diff.added)
+    diff.elapsed_seconds = time.perf_counter() - started
+    return diff, candidates, seen_files, seen_dirs, known_dirs
+
+
+def diff_manifest(db: Session, folder_path: str, full: bool = False) -> ManifestDiff:
+    """
+    Read-only refresh_manifest: the same diff and pending list, but neither the manifest nor
+    user_images is touched. For status checks that must not race a scan.
+    """
+    root = _normalize(folder_path)
+    diff, candidates, _, _, _ = _diff(db, root, full)
+    candidates -= set(_indexed(db, sorted(candidates)))
+    diff.pending = sorted(candidates | set(diff.modified))
+    return diff
+
+
+def _full_scan_due(db: Session, root: str) -> bool:
+    last = db.query(ScanDirectoryModel.full_scan_at).filter(ScanDirectoryModel.path == root).scalar()
+    return last is None or time.time() - last >= MANIFEST_FULL_SCAN_INTERVAL_SECONDS
+
+
+def refresh_manifest(db: Session, folder_path: str, full: Optional[bool] = None) -> ManifestDiff:
+    """
+    Diff a folder against the stored manifest in one pass, persist the new state and
+    return the changes. Directories whose mtime did not change are not listed again
+    unless the scan is full: a directory mtime does not change when a file is edited
+    in place, so with full=None a full scan runs whenever the last one is older than
+    MANIFEST_FULL_SCAN_INTERVAL_SECONDS.
+    diff.pending holds every file that still has to be ingested, including leftovers
+    from earlier scans that stopped early.
+    """
+    started = time.perf_counter()
+    root = _normalize(folder_path)
+    if full is None:
+        full = _full_scan_due(db, root)
+    diff, candidates, seen_files, seen_dirs, known_dirs = _diff(db, root, full)
+
+    _apply_to_index(db, diff)
+    _save_manifest(db, diff, seen_files, seen_dirs, known_dirs)
+    if full:
+        db.execute(update(ScanDirectoryModel).where(ScanDirectoryModel.path == root)
+                   .values(full_scan_at=int(time.time())))
+
+    # files that are already in user_images (e.g. indexed before the manifest existed) are settled here
+    candidates -= set(_mark_indexed(db, sorted(candidates)))
+    diff.pending = sorted(candidates | set(diff.modified))
+    db.commit()
+    user_images_changed(diff.moved, diff.deleted + diff.modified)
+    diff.elapsed_seconds = time.perf_counter() - started
+    logger.info(f"Manifest {root}{' (full)' if full else ''}: {diff.summary()}")
+    return diff
+
+
+def record_changes(db: Session, changed: List[str], removed: List[str],
+                   moved: List[Tuple[str, str]] = ()) -> ManifestDiff:
+    """
+    Apply individual file events (e.g. from the folder watcher) to the manifest without
+    walking any directory. Returns the diff; diff.pending lists the changed files that
+    still have to be ingested.
+    """
+    started = time.perf_counter()
+    diff = ManifestDiff()
+    moved = [(_normalize(old_path), _normalize(new_path)) for old_path, new_path in moved]
+    paths = {_normalize(path) for path in changed} | {new_path for _, new_path in moved}
+    seen_files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.st_size > 0 and is_image_file(path):
+            seen_files[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino or None)
+    known_files = {}
+    lookup = list(seen_files) + [_normalize(path) for path in removed] + [old_path for old_path, _ in moved]
+    for chunk in _chunks(lookup):
+        for entry in db.query(FileManifestModel).filter(FileManifestModel.path.in_(chunk)):
+            known_files[entry.path] = (entry.size, entry.mtime_ns, entry.status)
+
+    diff.moved = [(old_path, new_path) for old_path, new_path in moved
+                  if old_path in known_files and new_path in seen_files and new_path not in known_files]
+    moved_to = {new_path for _, new_path in diff.moved}
+    for path, (size, mtime_ns, _) in seen_files.items():
+        known = known_files.get(path)
+        if path in moved_to:
+            continue
+        if known is None:
+            diff.added.append(path)
+        elif known[0] != size or known[1] != mtime_ns:
+            diff.modified.append(path)
+        else:
+            diff.unchanged += 1
+    moved_from = {old_path for old_path, _ in diff.moved}
+    gone = {_normalize(path) for path in removed} | {old_path for old_path, _ in moved if old_path not in moved_from}
+    diff.deleted = sorted(path for path in gone if path in known_files and path not in seen_files)
+
+    _apply_to_index(db, diff)
+    _save_manifest(db, diff, seen_files, {}, {})
+    candidates = set(diff.added) | moved_to
+    candidates |= {path for path in seen_files
+                   if path in known_files and path not in diff.modified and known_files[path][2] != STATUS_INDEXED}
+    candidates -= set(_mark_indexed(db, sorted(candidates)))
+    diff.pending = sorted(candidates | set(diff.modified))
+    db.commit()
+    user_images_changed(diff.moved, diff.deleted + diff.modified)
+    diff.elapsed_seconds = time.perf_counter() - started
+    return diff
+
+
+def _indexed(db: Session, paths: List[str]) -> List[str]:
+    indexed = []
+    for chunk in _chunks(paths):
+        rows = db.execute(text("SELECT image_path FROM user_images WHERE image_path = ANY(:paths)"), {"paths": chunk})
+        indexed.extend(row[0] for row in rows)
+    return indexed
+
+
+def _mark_indexed(db: Session, paths: List[str]) -> List[str]:
+    indexed = []
+    for chunk in _chunks(paths):
+        # the content hash comes from the caption cache, so no file is read again here
+        rows = db.execute(text("""
+            UPDATE file_manifest m
+            SET status = :indexed,
+                content_hash = (SELECT c.content_hash FROM caption_cache c WHERE c.image_path = m.path LIMIT 1)
+            WHERE m.path = ANY(:paths)
+              AND EXISTS (SELECT 1 FROM user_images u WHERE u.image_path = m.path)
+            RETURNING m.path
+        """), {"paths": chunk, "indexed": STATUS_INDEXED})
+        indexed.extend(row[0] for row in rows)
+    return indexed
+
+
+def mark_indexed(db: Session, paths: List[str]) -> int:
+    """Flag manifest entries whose image made it into user_images; the rest stay pending for the next scan"""
+    indexed = _mark_indexed(db, [_normalize(path) for path in paths])
+    db.commit()
+    return len(indexed)
@@ -0,0 +1,191 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from db.setup import SessionLocal
+from services.file_manifest import refresh_manifest, record_changes
+from services.image_utils import is_image_file
+from config import WATCHER_DEBOUNCE_SECONDS, WATCHER_MAX_BATCH_SIZE, WATCHER_MAX_WAIT_SECONDS, WATCHER_RECONCILE_SECONDS
+try:
+    # watchdog uses inotify on Linux, FSEvents on macOS and ReadDirectoryChangesW on Windows
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+logger = logging.getLogger(__name__)
+
+
+class _EventCollector(FileSystemEventHandler):
+    def __init__(self, watcher: "FolderWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        kind = event.event_type
+        if kind == "moved":
+            self.watcher.record(event.dest_path, src_path=event.src_path)
+        elif kind == "deleted":
+            self.watcher.record(event.src_path, removed=True)
+        elif kind in ("created", "modified", "closed"):
+            self.watcher.record(event.src_path)
+
+
+class FolderWatcher:
+    """
+    Near-real-time ingestion: filesystem events for the user folder are debounced per
+    file, coalesced into micro-batches and fed through the manifest and the regular
+    ingestion pipeline. The periodic full scan becomes a reconciliation pass.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, debounce_seconds: float = WATCHER_DEBOUNCE_SECONDS,
+                 max_batch_size: int = WATCHER_MAX_BATCH_SIZE,
+                 max_wait_seconds: float = WATCHER_MAX_WAIT_SECONDS,
+                 reconcile_seconds: float = WATCHER_RECONCILE_SECONDS):
+        self.debounce_seconds = debounce_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(debounce_seconds, max_wait_seconds)
+        self.reconcile_seconds = reconcile_seconds
+        self.folder_path = None
+        self._observer = None
+        self._worker = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        # path -> (first event, last event, removed, moved-from path)
+        self._pending: Dict[str, Tuple[float, float, bool, Optional[str]]] = {}
+        self._reconcile = False
+        self.stats = {"events": 0, "batches": 0, "ingested": 0, "errors": 0, "last_batch_at": None}
+
+    @staticmethod
+    def available() -> bool:
+        return Observer is not None
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def start(self, folder_path: str, reconcile: bool = True) -> bool:
+        """Watch folder_path recursively; reconcile=True first catches up on changes made while not watching"""
+        if Observer is None:
+            logger.warning("watchdog is not installed - folder watcher is disabled")
+            return False
+        if not os.path.isdir(folder_path):
+            logger.warning(f"Folder watcher: {folder_path} is not a directory")
+            return False
+        self.stop()
+        self.folder_path = folder_path
+        self._stop.clear()
+        self._reconcile = reconcile
+        observer = Observer()
+        observer.schedule(_EventCollector(self), folder_path, recursive=True)
+        observer.start()
+        self._observer = observer
+        self._worker = threading.Thread(target=self._run, name="folder-watcher", daemon=True)
+        self._worker.start()
+        logger.info(f"Folder watcher started on {folder_path}")
+        return True
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._worker is not None:
+            self._stop.set()
+            self._wake.set()
+            self._worker.join()
+            self._worker = None
+            logger.info(f"Folder watcher stopped on {self.folder_path}")
+
+    def status(self) -> Dict:
+        with self._lock:
+            queued = len(self._pending)
+        return {"available": self.available(), "running": self.running, "folder_path": self.folder_path,
+                "queued": queued, **self.stats}
+
+    def record(self, path: str, removed: bool = False, src_path: Optional[str] = None) -> None:
+        if not is_image_file(path) and not (src_path and is_image_file(src_path)):
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.stats["events"] += 1
+            if src_path is not None and src_path in self._pending:
+                # a file that is renamed again before its batch ran keeps its original source
+                first, _, _, src_path = self._pending.pop(src_path)
+            else:
+                first = self._pending.get(path, (now,))[0]
+            self._pending[path] = (first, now, removed, src_path)
+        self._wake.set()
+
+    def _take_ready(self) -> Dict[str, Tuple[float, float, bool, Optional[str]]]:
+        now = time.monotonic()
+        with self._lock:
+            ready = [path for path, (first, last, _, _) in self._pending.items()
+                     if now - last >= self.debounce_seconds or now - first >= self.max_wait_seconds]
+            ready = ready[:self.max_batch_size]
+            return {path: self._pending.pop(path) for path in ready}
+
+    def _run(self) -> None:
+        if self._reconcile:
+            self._ingest_folder()
+        reconciled_at = time.monotonic()
+        while not self._stop.is_set():
+            self._wake.wait(self.debounce_seconds / 2)
+            self._wake.clear()
+            if time.monotonic() - reconciled_at >= self.reconcile_seconds:
+                # events can be lost (overflowed inotify queue, network shares); refresh_manifest
+                # also turns itself into a full scan once MANIFEST_FULL_SCAN_INTERVAL_SECONDS passed
+                self._ingest_folder()
+                reconciled_at = time.monotonic()
+            batch = self._take_ready()
+            while batch and not self._stop.is_set():
+                self._ingest_events(batch)
+                batch = self._take_ready()
+
+    def _ingest_folder(self) -> None:
+        db = SessionLocal()
+        try:
+            diff = refresh_manifest(db, self.folder_path)
+            self._ingest(diff.pending)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Folder watcher reconciliation failed: {e}")
+        finally:
+            db.close()
+
+    def _ingest_events(self, batch: Dict[str, Tuple[float, float, bool, Optional[str]]]) -> None:
+        changed = [path for path, (_, _, removed, src) in batch.items() if not removed and src is None]
+        removed = [path for path, (_, _, was_removed, _) in batch.items() if was_removed]
+        moved = [(src, path) for path, (_, _, was_removed, src) in batch.items() if not was_removed and src]
+        db = SessionLocal()
+        try:
+            diff = record_changes(db, changed, removed, moved)
+            logger.info(f"Folder watcher batch of {len(batch)} events: {diff.summary()}")
+            self._ingest(diff.pending)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Folder watcher batch failed: {e}")
+        finally:
+            db.close()
+        self.stats["batches"] += 1
+        self.stats["last_batch_at"] = time.time()
+
+    def _ingest(self, paths) -> None:
+        if not paths:
+            return
+        from services.scan_worker import ScanWorker
+        # same worker as the scans: one BLIP instance, and inference stays off the API process
+        summary = ScanWorker.get_instance().submit(paths).result()
+        self.stats["ingested"] += summary["processed"]
+        self.stats["errors"] += summary["errors"]
@@ -0,0 +1,76 @@
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional
+from db.setup import SessionLocal
+from db.text_search import fulltext_search
+from db.vector_index import vector_search, DEFAULT_WHERE
+from services.vector_mirror import mirror_for
+from config import HYBRID_CANDIDATES, HYBRID_RRF_K
+logger = logging.getLogger(__name__)
+HybridHit = namedtuple("HybridHit", ["image_path", "caption", "distance", "fused_score"])
+# each leg runs on its own connection, so the two queries overlap instead of adding up
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = HYBRID_RRF_K) -> Dict[Hashable, float]:
+    """RRF: every list adds 1 / (k + rank) to the items it contains; ranks start at 1"""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def _vector_leg(table, query_embedding, candidates, threshold, where, params, ef_search, probes, exact,
+                path_prefix):
+    mirror = mirror_for(table)
+    if mirror is not None:
+        return mirror.search(query_embedding, candidates, threshold, path_prefix=path_prefix)
+    db = SessionLocal()
+    try:
+        return list(vector_search(db, table, str(query_embedding.tolist()), limit=candidates, threshold=threshold,
+                                  where=where, params=params, ef_search=ef_search, probes=probes, exact=exact))
+    finally:
+        db.close()
+
+
+def _text_leg(table, query, query_embedding, candidates, where, params):
+    db = SessionLocal()
+    try:
+        return list(fulltext_search(db, table, query, str(query_embedding.tolist()), candidates,
+                                    where=where, params=params))
+    finally:
+        db.close()
+
+
+def hybrid_search(table: str, query: str, query_embedding, limit: int, threshold: float,
+                  where: str = DEFAULT_WHERE, params: Optional[Dict] = None, ef_search: Optional[int] = None,
+                  probes: Optional[int] = None, exact: bool = False, path_prefix: Optional[str] = None,
+                  candidates: int = HYBRID_CANDIDATES) -> List[HybridHit]:
+    """
+    Full-text and ANN candidates, queried concurrently and merged with reciprocal rank fusion.
+    Captions that contain the query words rank high even when MiniLM scores them poorly, so
+    text hits are kept regardless of the distance threshold; vector-only hits still respect it.
+    """
+    candidates = max(int(candidates), int(limit))
+    vector_future = _executor.submit(_vector_leg, table, query_embedding, candidates, threshold, where, params,
+                                     ef_search, probes, exact, path_prefix)
+    text_future = _executor.submit(_text_leg, table, query, query_embedding, candidates, where, params)
+    vector_rows = vector_future.result()
+    try:
+        text_rows = text_future.result()
+    except Exception as e:
+        # e.g. caption_tsv missing on an old schema: fall back to the vector ranking alone
+        logger.warning(f"Full-text leg of hybrid search failed: {e}")
+        text_rows = []
+
+    rows_by_path = {}
+    for row in list(text_rows) + list(vector_rows):
+        # one result per image: COCO's per-caption rows collapse to the best ranked caption
+        rows_by_path.setdefault(row.image_path, row)
+    scores = reciprocal_rank_fusion([list(dict.fromkeys(row.image_path for row in text_rows)),
+                                     list(dict.fromkeys(row.image_path for row in vector_rows))])
+    ranked = sorted(scores, key=lambda path: (-scores[path], float(rows_by_path[path].distance)))[:limit]
+    return [HybridHit(path, rows_by_path[path].caption, float(rows_by_path[path].distance), round(scores[path], 6))
+            for path in ranked]
@@ -5,7 +5,9 @@ from fastapi import UploadFile, HTTPException
 from PIL import Image as PILImage
 from services.blip_captioner import Blip2Captioner
 from services.text_encoder import encode_text
-from db.Database_Access import add_images
+from services.index_changes import add_coco_images
+from db.setup import SessionLocal
+from db.caption_cache_access import get_cached_result, store_cached_result
 from config import TEMP_IMAGE_DIR, IMAGE_DB_DIR
 #when the user uploads new photos
 captioner = Blip2Captioner.get_instance()
@@ -26,23 +28,32 @@ async def process_uploaded_image(file: UploadFile):
     except Exception:
         logging.warning("Uploaded file is not a valid image")
         raise HTTPException(status_code=400, detail="The image file is corrupt or invalid.")
+    db = SessionLocal()
     try:
-        caption = captioner.generate_caption(image_path)
-        logging.info(f"Generated caption: {caption}")
-    except Exception as e:
-        logging.error(f"Caption generation failed: {e}")
-        raise HTTPException(status_code=500, detail="Error creating image description")
-    try:
-        embedding = encode_text(caption)
-    except Exception as e:
-        logging.error(f"Text encoding failed: {e}")
-        raise HTTPException(status_code=500, detail="Error encoding the description for the vector")
-    try:
-        shutil.copy(image_path, permanent_path)
-        add_images([(caption, embedding.tolist(), file.filename)])
-    except Exception as e:
-        logging.error(f"Database insert failed: {e}")
-        raise HTTPException(status_code=500, detail="")
+        cached = get_cached_result(db, image_path)
+        if cached is not None:
+            caption, embedding = cached
+            logging.info(f"Caption cache hit: {caption}")
+        else:
+            try:
+                caption = captioner.generate_caption(image_path)
+                logging.info(f"Generated caption: {caption}")
+            except Exception as e:
+                logging.error(f"Caption generation failed: {e}")
+                raise HTTPException(status_code=500, detail="Error creating image description")
+            try:
+                embedding = encode_text(caption)
+            except Exception as e:
+                logging.error(f"Text encoding failed: {e}")
+                raise HTTPException(status_code=500, detail="Error encoding the description for the vector")
+            store_cached_result(db, image_path, caption, embedding)
+        try:
+            shutil.copy(image_path, permanent_path)
+            add_coco_images(db, [(caption, list(embedding), file.filename)])
+        except Exception as e:
+            logging.error(f"Database insert failed: {e}")
+            raise HTTPException(status_code=500, detail="")
     finally:
+        db.close()
         os.remove(image_path)
     return caption
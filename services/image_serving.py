@@ -0,0 +1,98 @@
+import os
+import time
+import mimetypes
+import threading
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from config import IMAGE_STAT_TTL_SECONDS
+
+# a few image types are missing from the default tables on some platforms (notably Windows)
+for _type, _extension in (("image/webp", ".webp"), ("image/tiff", ".tif"), ("image/tiff", ".tiff"),
+                          ("image/bmp", ".bmp")):
+    mimetypes.add_type(_type, _extension)
+
+_stat_lock = threading.Lock()
+_stat_cache: Dict[str, Tuple[float, Optional[os.stat_result]]] = {}
+_STAT_CACHE_MAX = 16384
+
+
+@lru_cache(maxsize=8192)
+def resolve_path(raw_path: str) -> str:
+    """URL-unquoted, normalized file path (pure string work, so it is memoized)"""
+    return os.path.normpath(urllib.parse.unquote(raw_path))
+
+
+@lru_cache(maxsize=256)
+def media_type_for(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def cached_stat(path: str) -> Optional[os.stat_result]:
+    """os.stat() of path, or None when missing; results are reused for IMAGE_STAT_TTL_SECONDS"""
+    now = time.monotonic()
+    entry = _stat_cache.get(path)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+    with _stat_lock:
+        if len(_stat_cache) >= _STAT_CACHE_MAX:
+            _stat_cache.clear()
+        _stat_cache[path] = (now + IMAGE_STAT_TTL_SECONDS, stat)
+    return stat
+
+
+def stat_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _not_modified(request: Request, etag: str, mtime: Optional[float]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since; weak validators compare equal here
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    """304 when the client already holds etag, before anything else is done for the request"""
+    if _not_modified(request, etag, None):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+def conditional_file_response(request: Request, path: str, cache_control: str,
+                              stat: Optional[os.stat_result] = None, etag: Optional[str] = None) -> Response:
+    """
+    Serve path with ETag/Last-Modified from its stat and a 304 (no file access) when the client's
+    copy is current. stat may come from cached_stat: it only decides the 304; a body is sent with
+    headers from a fresh stat, and FileResponse stats the file itself for Content-Length. Range
+    requests are answered by FileResponse itself.
+    """
+    stat = stat or os.stat(path)
+    if _not_modified(request, etag or stat_etag(stat), stat.st_mtime):
+        return Response(status_code=304, headers={"ETag": etag or stat_etag(stat), "Cache-Control": cache_control,
+                                                  "Last-Modified": formatdate(stat.st_mtime, usegmt=True)})
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # deleted since the cached stat was taken
+        with _stat_lock:
+            _stat_cache.pop(path, None)
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = {"ETag": etag or stat_etag(stat), "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+               "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    return FileResponse(path, media_type=media_type_for(path), headers=headers)
@@ -1,5 +1,5 @@
 from PIL import Image
 def is_image_file(file_path: str) -> bool:
-    return file_path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".gif"))
+    return file_path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tiff", ".tif"))
 def load_image(path: str):
     return Image.open(path).convert("RGB")
@@ -0,0 +1,47 @@
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from db.Database_Access import add_images
+from db.coco_image_access import compact_coco_images, get_coco_image_rows
+from services.vector_mirror import record_added, record_moved, record_removed
+from services.result_cache import bump_version
+
+
+# Everything here runs after the transaction that made the change has committed: the vector
+# mirror delta logs and the result cache versions must never announce rows a rollback undid.
+
+
+def user_images_added(rows: List[Tuple[int, str, str, object]]) -> None:
+    """rows: (id, image_path, caption, embedding) of committed user_images inserts"""
+    if rows:
+        record_added("user_images", rows)
+        bump_version("user")
+
+
+def user_images_changed(moved: List[Tuple[str, str]], removed: List[str]) -> None:
+    """Committed moves and deletes of user_images rows (manifest refresh, folder watcher)"""
+    record_moved("user_images", moved)
+    record_removed("user_images", removed)
+    if moved or removed:
+        bump_version("user")
+
+
+def add_coco_images(db: Session, images_data) -> bool:
+    """Insert COCO caption rows (and their fused coco_images rows), then publish them"""
+    added = add_images(db, images_data)
+    if added is None:
+        return False
+    record_added("images", added)
+    record_added("coco_images", get_coco_image_rows(db, [path for _, path, _, _ in added]))
+    bump_version("coco")
+    return True
+
+
+def compact_coco(db: Session, paths: Optional[Iterable[str]] = None) -> int:
+    """compact_coco_images, then publish the refreshed rows"""
+    paths = None if paths is None else sorted(set(paths))
+    written = compact_coco_images(db, paths)
+    if paths is not None:
+        # a full conversion is an offline job: mirrors notice the changed row count and reload
+        record_added("coco_images", get_coco_image_rows(db, paths))
+    bump_version("coco")
+    return written
@@ -0,0 +1,388 @@
+import os
+import time
+import queue
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+from PIL import Image
+from db.setup import SessionLocal
+from db.user_image_access import add_user_image, get_existing_image_paths
+from db.caption_cache_access import get_cached_result
+from services.caption_cache import CaptionCacheStats
+from services.image_utils import is_image_file
+from services.text_encoder import encode_text, encode_texts
+from services.word_vocabulary import get_vocabulary
+from services.index_changes import user_images_added
+from services.thumbnails import get_thumbnail_service
+from config import (CAPTION_BATCH_SIZE, INGEST_QUEUE_SIZE, INGEST_DECODE_WORKERS, INGEST_WRITE_BATCH_SIZE,
+                    INGEST_BATCH_WAIT_SECONDS, INGEST_STATS_LOG_INTERVAL, THUMBNAIL_AT_INGEST)
+logger = logging.getLogger(__name__)
+_DONE = object()
+CONTINUE_CHECK_INTERVAL = 1.0
+
+
+def iter_image_files(folder_path: str) -> Iterable[str]:
+    """Walk a folder lazily, skipping hidden and system directories"""
+    for root, dirs, files in os.walk(folder_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and not d.startswith('$')]
+        for file in files:
+            file_path = os.path.join(root, file)
+            if is_image_file(file_path):
+                yield file_path
+
+
+@dataclass
+class IngestItem:
+    path: str
+    normalized_path: str
+    image: Optional[Image.Image] = None
+    caption: Optional[str] = None
+    embedding: object = None
+
+
+class StageStats:
+    """Throughput counters for one pipeline stage"""
+    def __init__(self, name: str, input_queue: Optional[queue.Queue] = None):
+        self.name = name
+        self.input_queue = input_queue
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def record(self, processed: int = 0, errors: int = 0, busy_seconds: float = 0.0) -> None:
+        with self._lock:
+            self.processed += processed
+            self.errors += errors
+            self.busy_seconds += busy_seconds
+
+    def as_dict(self) -> Dict:
+        end = self.finished_at or time.perf_counter()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "processed": self.processed,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 2),
+            "items_per_second": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "queue_depth": self.input_queue.qsize() if self.input_queue is not None else 0,
+            "queue_capacity": self.input_queue.maxsize if self.input_queue is not None else 0,
+        }
+
+
+class IngestionPipeline:
+    """
+    Staged ingestion: discover -> decode -> caption -> encode + DB write.
+    Stages run in their own threads and are connected by bounded queues, so a slow
+    stage blocks the ones before it instead of letting work pile up in memory.
+    """
+    def __init__(self, captioner,
+                 decode_workers: int = INGEST_DECODE_WORKERS,
+                 queue_size: int = INGEST_QUEUE_SIZE,
+                 caption_batch_size: int = CAPTION_BATCH_SIZE,
+                 write_batch_size: int = INGEST_WRITE_BATCH_SIZE,
+                 skip_existing: bool = True,
+                 should_continue: Optional[Callable[[], bool]] = None,
+                 on_item: Optional[Callable[[str, bool], None]] = None):
+        self.captioner = captioner
+        self.decode_workers = max(1, decode_workers)
+        self.caption_batch_size = max(1, caption_batch_size)
+        self.write_batch_size = max(1, write_batch_size)
+        self.skip_existing = skip_existing
+        self.should_continue = should_continue
+        self.on_item = on_item
+        self._decode_queue = queue.Queue(maxsize=queue_size)
+        self._caption_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._decoders_left = self.decode_workers
+        self.stages = {
+            "discover": StageStats("discover"),
+            "decode": StageStats("decode", self._decode_queue),
+            "caption": StageStats("caption", self._caption_queue),
+            "write": StageStats("write", self._write_queue),
+        }
+        self.cache_stats = CaptionCacheStats()
+        self.consumed = 0
+        self.skipped = 0
+        self.stopped_early = False
+        self._started_at = None
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def written(self) -> int:
+        return self.stages["write"].processed
+
+    def stage_stats(self) -> Dict[str, Dict]:
+        return {name: stage.as_dict() for name, stage in self.stages.items()}
+
+    def summary(self) -> Dict:
+        return {
+            "processed": self.written,
+            "errors": sum(stage.errors for stage in self.stages.values()),
+            "skipped": self.skipped,
+            "consumed": self.consumed,
+            "cache_hits": self.cache_stats.hits,
+            "cache_misses": self.cache_stats.misses,
+            "cancelled": self.cancelled,
+            "stopped_early": self.stopped_early,
+            "elapsed_seconds": round(time.perf_counter() - self._started_at, 2) if self._started_at else 0.0,
+            "stages": self.stage_stats(),
+        }
+
+    def run(self, paths: Iterable[str]) -> Dict:
+        """Ingest every path from the iterable and block until the last DB write is committed"""
+        self._started_at = time.perf_counter()
+        threads = [threading.Thread(target=self._discover, args=(paths,), name="ingest-discover", daemon=True)]
+        threads += [threading.Thread(target=self._decode, name=f"ingest-decode-{i}", daemon=True)
+                    for i in range(self.decode_workers)]
+        threads.append(threading.Thread(target=self._caption, name="ingest-caption", daemon=True))
+        writer = threading.Thread(target=self._write, name="ingest-write", daemon=True)
+        threads.append(writer)
+        for thread in threads:
+            thread.start()
+        while writer.is_alive():
+            writer.join(INGEST_STATS_LOG_INTERVAL)
+            if writer.is_alive():
+                self._log_stats()
+        for thread in threads:
+            thread.join()
+        self._log_stats()
+        return self.summary()
+
+    def _log_stats(self) -> None:
+        parts = [f"{name}: {stats['processed']} done, {stats['items_per_second']}/s, queue {stats['queue_depth']}/{stats['queue_capacity']}"
+                 for name, stats in self.stage_stats().items()]
+        logger.info("Ingestion | " + " | ".join(parts))
+
+    def _notify(self, item: IngestItem, ok: bool) -> None:
+        if self.on_item:
+            try:
+                self.on_item(item.path, ok)
+            except Exception as e:
+                logger.warning(f"Ingestion progress callback failed: {e}")
+
+    def _take_batch(self, source: queue.Queue, size: int):
+        """Block for one item, then gather up to size items for a short while. Returns (batch, done)."""
+        item = source.get()
+        if item is _DONE:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + INGEST_BATCH_WAIT_SECONDS
+        while len(batch) < size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = source.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _keep_going(self, last_check: List[float]) -> bool:
+        if self.cancelled:
+            return False
+        if self.should_continue is None:
+            return True
+        now = time.monotonic()
+        if now - last_check[0] < CONTINUE_CHECK_INTERVAL:
+            return True
+        last_check[0] = now
+        return self.should_continue()
+
+    def _discover(self, paths: Iterable[str]) -> None:
+        stats = self.stages["discover"]
+        stats.started_at = time.perf_counter()
+        known_paths = set()
+        last_check = [0.0]
+        try:
+            if self.skip_existing:
+                db = SessionLocal()
+                try:
+                    known_paths = get_existing_image_paths(db)
+                finally:
+                    db.close()
+            for path in paths:
+                if not self._keep_going(last_check):
+                    self.stopped_early = not self.cancelled
+                    break
+                self.consumed += 1
+                started = time.perf_counter()
+                normalized_path = path.replace("\\", "/")
+                if normalized_path in known_paths:
+                    self.skipped += 1
+                    continue
+                stats.record(processed=1, busy_seconds=time.perf_counter() - started)
+                self._decode_queue.put(IngestItem(path=path, normalized_path=normalized_path))
+        except Exception as e:
+            logger.error(f"File discovery failed: {e}")
+        finally:
+            stats.finished_at = time.perf_counter()
+            for _ in range(self.decode_workers):
+                self._decode_queue.put(_DONE)
+
+    def _decode(self) -> None:
+        stats = self.stages["decode"]
+        stats.started_at = stats.started_at or time.perf_counter()
+        db = SessionLocal()
+        try:
+            while True:
+                item = self._decode_queue.get()
+                if item is _DONE:
+                    break
+                if self.cancelled:
+                    continue
+                started = time.perf_counter()
+                try:
+                    cached = get_cached_result(db, item.path)
+                    if cached is not None:
+                        db.commit()
+                        item.caption, item.embedding = cached
+                        with self._lock:
+                            self.cache_stats.hits += 1
+                        target = self._write_queue
+                    else:
+                        item.image = Image.open(item.path).convert("RGB")
+                        with self._lock:
+                            self.cache_stats.misses += 1
+                        target = self._caption_queue
+                    stats.record(processed=1, busy_seconds=time.perf_counter() - started)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Failed to read {item.path}: {e}")
+                    stats.record(errors=1, busy_seconds=time.perf_counter() - started)
+                    self._notify(item, False)
+                    continue
+                target.put(item)
+        finally:
+            db.close()
+            with self._lock:
+                self._decoders_left -= 1
+                last = self._decoders_left == 0
+            if last:
+                stats.finished_at = time.perf_counter()
+                self._caption_queue.put(_DONE)
+
+    def _caption(self) -> None:
+        stats = self.stages["caption"]
+        stats.started_at = time.perf_counter()
+        try:
+            done = False
+            while not done:
+                batch, done = self._take_batch(self._caption_queue, self.caption_batch_size)
+                if not batch or self.cancelled:
+                    continue
+                started = time.perf_counter()
+                try:
+                    captions = self.captioner.generate_captions_for_images(
+                        [item.image for item in batch], batch_size=self.caption_batch_size)
+                except Exception as e:
+                    logger.error(f"Captioning failed for {len(batch)} images: {e}")
+                    captions = [None] * len(batch)
+                busy = time.perf_counter() - started
+                ok_items = []
+                for item, caption in zip(batch, captions):
+                    item.image = None
+                    if caption:
+                        item.caption = caption
+                        ok_items.append(item)
+                    else:
+                        self._notify(item, False)
+                stats.record(processed=len(ok_items), errors=len(batch) - len(ok_items), busy_seconds=busy)
+                for item in ok_items:
+                    self._write_queue.put(item)
+        finally:
+            stats.finished_at = time.perf_counter()
+            self._write_queue.put(_DONE)
+
+    def _write(self) -> None:
+        stats = self.stages["write"]
+        stats.started_at = time.perf_counter()
+        db = SessionLocal()
+        try:
+            done = False
+            while not done:
+                batch, done = self._take_batch(self._write_queue, self.write_batch_size)
+                if not batch or self.cancelled:
+                    continue
+                started = time.perf_counter()
+                written = self._write_batch(db, batch)
+                stats.record(processed=len(written), errors=len(batch) - len(written),
+                             busy_seconds=time.perf_counter() - started)
+                if written and THUMBNAIL_AT_INGEST:
+                    get_thumbnail_service().prefetch(item.path for item in written)
+                self._extend_vocabulary(written)
+                written_ids = {id(item) for item in written}
+                for item in batch:
+                    self._notify(item, id(item) in written_ids)
+        finally:
+            stats.finished_at = time.perf_counter()
+            db.close()
+            self._save_vocabulary()
+
+    def _extend_vocabulary(self, written: List[IngestItem]) -> None:
+        # new caption words get their embedding now, in one batch, instead of at search time
+        try:
+            get_vocabulary().add_captions(item.caption for item in written)
+        except Exception as e:
+            logger.warning(f"Could not extend the word vocabulary: {e}")
+
+    def _save_vocabulary(self) -> None:
+        try:
+            get_vocabulary().save()
+        except Exception as e:
+            logger.warning(f"Could not save the word vocabulary: {e}")
+
+    def _write_batch(self, db, batch: List[IngestItem]) -> List[IngestItem]:
+        ready = [item for item in batch if item.embedding is not None]
+        to_encode = [item for item in batch if item.embedding is None]
+        try:
+            # one padded encode call for the whole write batch instead of one per caption
+            for item, embedding in zip(to_encode, encode_texts([item.caption for item in to_encode])):
+                item.embedding = embedding
+            ready += to_encode
+        except Exception as e:
+            logger.warning(f"Batch text encoding failed ({e}), encoding {len(to_encode)} captions one by one")
+            for item in to_encode:
+                try:
+                    item.embedding = encode_text(item.caption)
+                    ready.append(item)
+                except Exception as item_error:
+                    logger.error(f"Text encoding failed for {item.path}: {item_error}")
+        try:
+            rows = []
+            for item in ready:
+                row_id = add_user_image(db, item.caption, list(item.embedding), item.normalized_path, commit=False)
+                if row_id is not None:
+                    rows.append((row_id, item.normalized_path, item.caption, item.embedding))
+            db.commit()
+            user_images_added(rows)
+            return ready
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Batch insert failed ({e}), inserting {len(ready)} images one by one")
+        written = []
+        rows = []
+        for item in ready:
+            try:
+                row_id = add_user_image(db, item.caption, list(item.embedding), item.normalized_path)
+                if row_id is not None:
+                    rows.append((row_id, item.normalized_path, item.caption, item.embedding))
+                written.append(item)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"DB insert failed for {item.path}: {e}")
+        user_images_added(rows)
+        return written
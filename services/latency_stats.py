@@ -0,0 +1,48 @@
+import threading
+from collections import deque
+from typing import Dict
+from config import LATENCY_WINDOW_SIZE
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LatencyRecorder:
+    """Rolling per-route request latencies, kept apart for 'scan running' and 'idle' so the two can be compared"""
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE):
+        self.window_size = window_size
+        self._samples: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, milliseconds: float, during_scan: bool) -> None:
+        key = (route, "during_scan" if during_scan else "idle")
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window_size)
+            samples.append(milliseconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            items = [(key, sorted(samples)) for key, samples in self._samples.items()]
+        report = {}
+        for (route, state), values in items:
+            report.setdefault(route, {})[state] = {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 0.50), 1),
+                "p95_ms": round(_percentile(values, 0.95), 1),
+                "p99_ms": round(_percentile(values, 0.99), 1),
+                "max_ms": round(values[-1], 1),
+            }
+        return report
+
+
+latency_recorder = LatencyRecorder()
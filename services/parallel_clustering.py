@@ -0,0 +1,102 @@
+import os
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+import numpy as np
+from config import CLUSTERING_PROCESSES, CLUSTERING_PARALLEL_MIN_IMAGES, CLUSTERING_TEMP_DIR
+logger = logging.getLogger(__name__)
+_thread_limits = None
+
+
+class ClusteringCancelled(Exception):
+    pass
+
+
+def pool_size(tasks: int) -> int:
+    return max(1, min(tasks, CLUSTERING_PROCESSES or os.cpu_count() or 1))
+
+
+def _init_worker(threads: int) -> None:
+    """Each worker gets its share of the cores for BLAS/OpenMP and runs its fits one after another"""
+    global _thread_limits
+    from threadpoolctl import threadpool_limits
+    import services.cluster_engine as cluster_engine
+    _thread_limits = threadpool_limits(limits=threads)
+    cluster_engine.sweep_jobs = 1
+
+
+def _run_slice(fn: Callable, path: str, start: int, stop: int, args: tuple):
+    # only the pages of this category are read; the file is shared through the OS page cache
+    embeddings = np.load(path, mmap_mode="r")[start:stop]
+    return fn(np.array(embeddings), *args)
+
+
+def cluster_categories(fn: Callable, tasks: Dict[str, Tuple[np.ndarray, tuple]],
+                       on_done: Optional[Callable[[str, Any], None]] = None,
+                       should_continue: Optional[Callable[[], bool]] = None,
+                       on_start: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    fn(embeddings, *args) for every category's embedding matrix. With enough images the
+    categories fan out over a process pool: the matrices are written once into one memmapped
+    .npy file and every worker reads its slice, so no ORM objects or arrays are pickled. fn must
+    be a module-level function. on_start(name) is called when a category actually starts (only
+    as many are in flight as there are workers). should_continue() is checked as categories
+    finish; False cancels the rest and raises ClusteringCancelled.
+    """
+    results: Dict[str, Any] = {}
+    # largest first, so a big category does not start last and keep the pool waiting
+    names = sorted(tasks, key=lambda name: -len(tasks[name][0]))
+    total = sum(len(tasks[name][0]) for name in names)
+    workers = pool_size(len(names))
+    if workers <= 1 or total < CLUSTERING_PARALLEL_MIN_IMAGES:
+        for name in names:
+            if should_continue is not None and not should_continue():
+                raise ClusteringCancelled(f"cancelled before {name}")
+            embeddings, args = tasks[name]
+            if on_start is not None:
+                on_start(name)
+            results[name] = fn(embeddings, *args)
+            if on_done is not None:
+                on_done(name, results[name])
+        return results
+
+    dim = tasks[names[0]][0].shape[1]
+    with tempfile.TemporaryDirectory(prefix="clustering-", dir=CLUSTERING_TEMP_DIR) as temp_dir:
+        path = os.path.join(temp_dir, "embeddings.npy")
+        matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(total, dim))
+        slices = {}
+        offset = 0
+        for name in names:
+            embeddings = tasks[name][0]
+            matrix[offset:offset + len(embeddings)] = embeddings
+            slices[name] = (offset, offset + len(embeddings))
+            offset += len(embeddings)
+        matrix.flush()
+        del matrix
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        logger.info(f"Clustering {len(names)} categories ({total} images) on {workers} processes")
+        # spawn: workers must not inherit DB connections or the parent's thread state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(threads,)) as pool:
+            queue = list(names)
+            futures = {}
+            while queue or futures:
+                # keep one category per worker in flight, so "started" means started
+                while queue and len(futures) < workers:
+                    name = queue.pop(0)
+                    if on_start is not None:
+                        on_start(name)
+                    futures[pool.submit(_run_slice, fn, path, *slices[name], tasks[name][1])] = name
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = futures.pop(future)
+                    results[name] = future.result()
+                    if on_done is not None:
+                        on_done(name, results[name])
+                    if should_continue is not None and not should_continue():
+                        for pending in futures:
+                            pending.cancel()
+                        raise ClusteringCancelled(f"cancelled after {name}")
+    return results
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Hashable, Optional
+from config import RESULT_CACHE_MAX_BYTES, RESULT_CACHE_FILE, RESULT_CACHE_VERSION_DIR
+logger = logging.getLogger(__name__)
+SOURCES = ("coco", "user")
+_MISSING = object()
+VERSION_LOCK_TIMEOUT = 2.0
+VERSION_LOCK_STALE_SECONDS = 10.0
+VERSION_REPLACE_RETRIES = 50
+
+
+def _version_file(source: str) -> str:
+    return os.path.join(RESULT_CACHE_VERSION_DIR, f"{source}.version")
+
+
+def _read_version(source: str) -> int:
+    try:
+        with open(_version_file(source), encoding="ascii") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+@contextmanager
+def _file_lock(path: str, timeout: float = VERSION_LOCK_TIMEOUT):
+    """Exclusive lock between processes: whoever creates the lock file holds it"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                # a holder that died without cleaning up must not block bumps forever
+                if time.time() - os.path.getmtime(path) > VERSION_LOCK_STALE_SECONDS:
+                    os.remove(path)
+                    continue
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise OSError(f"timed out waiting for {path}")
+            time.sleep(0.005)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def _replace(source: str, target: str) -> None:
+    # on Windows the target cannot be replaced while a reader has it open; readers are brief
+    for _ in range(VERSION_REPLACE_RETRIES):
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            time.sleep(0.005)
+    os.replace(source, target)
+
+
+def bump_version(source: str) -> None:
+    """
+    Mark every cached result of a source as stale. Ingestion may run in another process,
+    so the version is a counter in a small file that lookups read. It is incremented under
+    a lock file, so bumps from two processes never collapse into one value (a file mtime
+    could, on filesystems with coarse timestamps).
+    """
+    path = _version_file(source)
+    try:
+        os.makedirs(RESULT_CACHE_VERSION_DIR, exist_ok=True)
+        with _file_lock(path + ".lock"):
+            with open(path + ".tmp", "w", encoding="ascii") as f:
+                f.write(str(_read_version(source) + 1))
+            _replace(path + ".tmp", path)
+    except OSError as e:
+        logger.warning(f"Could not bump the {source} result cache version: {e}")
+    ResultCache.get_instance().local_bump(source)
+
+
+class ResultCache:
+    """
+    One LRU for all search results, bounded by the approximate JSON size of the entries.
+    Every entry remembers the version of its source when it was stored and is dropped
+    on lookup once ingestion has bumped that version.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local_versions: Dict[str, int] = {source: 0 for source in SOURCES}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self, source: str) -> tuple:
+        return _read_version(source), self._local_versions.get(source, 0)
+
+    def local_bump(self, source: str) -> None:
+        with self._lock:
+            self._local_versions[source] = self._local_versions.get(source, 0) + 1
+
+    def get(self, source: str, key: Hashable, default=None):
+        version = self.version(source)
+        with self._lock:
+            entry = self._entries.get((source, key), _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, stored_version, size = entry
+            if stored_version != version:
+                del self._entries[(source, key)]
+                self._bytes -= size
+                self.invalidations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end((source, key))
+            self.hits += 1
+            return value
+
+    def put(self, source: str, key: Hashable, value, version: tuple) -> None:
+        """version: self.version(source) read before the query that produced value, so a bump
+        that lands while the query runs leaves the entry already stale"""
+        try:
+            size = len(json.dumps(value, ensure_ascii=False, default=str))
+        except (TypeError, ValueError):
+            return
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((source, key), None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[(source, key)] = (value, version, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self, source: Optional[str] = None) -> None:
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries if source is None or cache_key[0] == source]:
+                self._bytes -= self._entries.pop(cache_key)[2]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            by_source = {}
+            for (source, _), (_, _, size) in self._entries.items():
+                counts = by_source.setdefault(source, {"entries": 0, "bytes": 0})
+                counts["entries"] += 1
+                counts["bytes"] += size
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "sources": by_source,
+            }
+
+    def save(self, path: Optional[str] = RESULT_CACHE_FILE) -> None:
+        """Write the entries (oldest first) so the next start is warm; versions come along to reject stale ones"""
+        if not path:
+            return
+        with self._lock:
+            entries = [{"source": source, "key": key, "value": value, "version": list(version)}
+                       for (source, key), (value, version, _) in self._entries.items()]
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, default=str)
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not persist the result cache: {e}")
+
+    def load(self, path: Optional[str] = RESULT_CACHE_FILE) -> int:
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the persisted result cache: {e}")
+            return 0
+        loaded = 0
+        for entry in entries:
+            # only the file part of the version survives a restart; local counters start at 0 again
+            version = self.version(entry["source"])
+            if entry["version"][0] != version[0]:
+                continue
+            key = tuple(entry["key"]) if isinstance(entry["key"], list) else entry["key"]
+            self.put(entry["source"], key, entry["value"], version)
+            loaded += 1
+        logger.info(f"Result cache: {loaded} of {len(entries)} persisted entries are still current")
+        return loaded
+
+
+def get_result_cache() -> ResultCache:
+    return ResultCache.get_instance()
@@ -1,22 +1,20 @@
 import os
 import pickle
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import silhouette_score
 from collections import defaultdict, Counter
 from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 import logging
 from db.setup import SessionLocal
 from db.models import ExtraTrainingImage
-from config import RANDOM_STATE,MIN_K,TOP_K,MAX_CLUSTERS_PER_CATEGORY,CLUSTERING_DIVISOR,CONFIDENCE_SCALING_FACTOR,MAX_CONFIDENCE_SCORE,TOP_CLUSTER_KEYWORDS,ROUND_CLUSTER_CONFIDENCE,category_keywords,MIN_IMAGES_FOR_CLUSTERING,CLUSTER_LOG_PRINT_INTERVAL,MIN_CLUSTER_KEYWORD_LENGTH,KMEANS_N_INIT
+from services.cluster_engine import KMeansFits, select_k_single_state, category_labels
+from services.parallel_clustering import cluster_categories
+from config import MIN_K,TOP_K,MAX_CLUSTERS_PER_CATEGORY,CONFIDENCE_SCALING_FACTOR,MAX_CONFIDENCE_SCORE,TOP_CLUSTER_KEYWORDS,ROUND_CLUSTER_CONFIDENCE,category_keywords,MIN_IMAGES_FOR_CLUSTERING,CLUSTER_LOG_PRINT_INTERVAL,MIN_CLUSTER_KEYWORD_LENGTH
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 class SmartClusteringEngine:
     def __init__(self):
         self.classifier_model = None
-        self.scaler = StandardScaler()
         self.load_classifier()
     def load_classifier(self):
         try:
@@ -54,28 +52,9 @@ class SmartClusteringEngine:
         except Exception as e:
             logger.error(f"eror{e}")
             return None
-    def find_optimal_clusters(self, embeddings: np.ndarray, min_k: int = MIN_K, max_k: int = TOP_K) -> int:
-        if len(embeddings) < min_k:
-            return min(len(embeddings), 1)
-        max_k = min(max_k, len(embeddings) - 1)
-        if max_k < min_k:
-            return max_k
-        best_score = -1
-        best_k = min_k
-        for k in range(min_k, max_k + 1):
-            try:
-                kmeans = KMeans(n_clusters=k, random_state=RANDOM_STATE, n_init=TOP_K)
-                labels = kmeans.fit_predict(embeddings)
-                score = silhouette_score(embeddings, labels)
-                logger.info(f"   K={k}: silhouette_score={score:.3f}")
-                if score > best_score:
-                    best_score = score
-                    best_k = k
-            except Exception as e:
-                logger.warning(f"eror{k}: {e}")
-                continue
-        logger.info(f" num of clusters: {best_k} (score: {best_score:.3f})")
-        return best_k
+    def find_optimal_clusters(self, embeddings: np.ndarray, min_k: int = MIN_K, max_k: int = TOP_K,
+                              fits: Optional[KMeansFits] = None) -> int:
+        return select_k_single_state(embeddings, min_k, max_k, fits)
     def cluster_by_category(self, images: List) -> Dict[str, List]:
         categories = defaultdict(list)
         logger.info(f"  {len(images)} ")
@@ -98,9 +77,10 @@ class SmartClusteringEngine:
         for category, images_list in categories.items():
             logger.info(f"   {category}: {len(images_list)} ")
         return dict(categories)
-    def cluster_within_category(self, category_images: List, category_name: str) -> Dict[int, List]:
+    def category_matrix(self, category_images: List, category_name: str) -> Optional[Tuple[np.ndarray, List]]:
+        """Embeddings and images of a category to cluster, or None when it stays one cluster"""
         if len(category_images) < 2:
-            return {0: category_images}
+            return None
         logger.info(f"{category_name} ({len(category_images)} ")
         embeddings = []
         valid_images = []
@@ -114,15 +94,17 @@ class SmartClusteringEngine:
                     continue
         if len(embeddings) < MIN_K:
             logger.warning(f" {category_name}")
+            return None
+        return np.array(embeddings, dtype=np.float32), valid_images
+    def cluster_within_category(self, category_images: List, category_name: str) -> Dict[int, List]:
+        matrix = self.category_matrix(category_images, category_name)
+        if matrix is None:
             return {0: category_images}
-        embeddings = np.array(embeddings)
-        embeddings_scaled = self.scaler.fit_transform(embeddings)
-        optimal_k = self.find_optimal_clusters(embeddings_scaled,
-                                               min_k=MIN_K,
-                                               max_k=min(MAX_CLUSTERS_PER_CATEGORY, len(embeddings) // CLUSTERING_DIVISOR))
-        logger.info(f" KMeans  {optimal_k}.")
-        kmeans = KMeans(n_clusters=optimal_k, random_state=RANDOM_STATE, n_init=KMEANS_N_INIT)
-        labels = kmeans.fit_predict(embeddings_scaled)
+        embeddings, valid_images = matrix
+        labels = category_labels(embeddings, MAX_CLUSTERS_PER_CATEGORY)
+        return self.group_by_label(labels, valid_images, category_name)
+    @staticmethod
+    def group_by_label(labels: np.ndarray, valid_images: List, category_name: str) -> Dict[int, List]:
         clusters = defaultdict(list)
         for i, label in enumerate(labels):
             if i < len(valid_images):
@@ -172,6 +154,16 @@ class SmartClusteringEngine:
         logger.info(f"{len(images)} ")
         categories = self.cluster_by_category(images)
         final_results = []
+        # the categories are independent: their embedding matrices are clustered in parallel processes
+        matrices = {}
+        for category_name, category_images in categories.items():
+            if len(category_images) >= MIN_IMAGES_FOR_CLUSTERING:
+                matrix = self.category_matrix(category_images, category_name)
+                if matrix is not None:
+                    matrices[category_name] = matrix
+        labels_by_category = cluster_categories(
+            category_labels, {name: (embeddings, (MAX_CLUSTERS_PER_CATEGORY,)) for name, (embeddings, _) in matrices.items()}
+        )
         for category_name, category_images in categories.items():
             logger.info(f"\n {category_name}")
             if len(category_images) < MIN_IMAGES_FOR_CLUSTERING:
@@ -192,7 +184,10 @@ class SmartClusteringEngine:
                 }
                 final_results.append(category_result)
                 continue
-            clusters = self.cluster_within_category(category_images, category_name)
+            if category_name in matrices:
+                clusters = self.group_by_label(labels_by_category[category_name], matrices[category_name][1], category_name)
+            else:
+                clusters = {0: category_images}
             category_clusters = []
             for cluster_id, cluster_images in clusters.items():
                 cluster_info = self.generate_cluster_name(cluster_images, category_name, cluster_id)
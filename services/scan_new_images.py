@@ -5,13 +5,11 @@ from datetime import datetime
 import json
 import logging
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from sqlalchemy.orm import Session
-from db.setup import get_db
-from db.user_image_access import add_user_image, image_exists
 from services.blip_captioner import Blip2Captioner
-from text_encoder import encode_text
-from image_utils import is_image_file
-from config import COMMIT_INTERVAL
+from services.ingestion_pipeline import IngestionPipeline
+from services.file_manifest import refresh_manifest, mark_indexed
+from db.schema import ensure_schema
+from db.setup import SessionLocal
 script_dir = Path(__file__).parent.absolute()
 log_file = script_dir / "scan_new_images.log"
 logging.basicConfig(
@@ -62,52 +60,30 @@ def scan_and_update():
             return False
         logger.info(f"{folder_path}")
         try:
-            db: Session = next(get_db())
+            ensure_schema()
         except Exception as e:
             return False
         try:
             captioner = Blip2Captioner()
         except Exception as e:
-            db.close()
             return False
-        processed_count = 0
-        skipped_count = 0
-        error_count = 0
+        db = SessionLocal()
         try:
-            for root, dirs, files in os.walk(folder_path):
-                dirs[:] = [d for d in dirs if not d.startswith('.') and not d.startswith('$')]
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if not is_image_file(file_path):
-                        continue
-                    normalized_path = file_path.replace("\\", "/")
-                    if image_exists(db, normalized_path):
-                        skipped_count += 1
-                        continue
-                    try:
-                        logger.info(f" {Path(file_path).name}")
-                        caption = captioner.generate_caption(file_path)
-                        embedding = encode_text(caption)
-                        add_user_image(db, caption, embedding.tolist(), normalized_path)
-                        processed_count += 1
-                        logger.info(f" {Path(file_path).name}")
-                        if processed_count % COMMIT_INTERVAL == 0:
-                            db.commit()
-                            logger.info(f"{processed_count} ")
-                    except Exception as e:
-                        error_count += 1
-                        logger.error(f" {file_path}: {e}")
-                        continue
-            db.commit()
+            diff = refresh_manifest(db, folder_path)
+            logger.info(f"Manifest: {diff.summary()}")
+            pipeline = IngestionPipeline(captioner)
+            summary = pipeline.run(diff.pending)
+            mark_indexed(db, diff.pending)
         finally:
             db.close()
 
         end_time = datetime.now()
         duration = end_time - start_time
         logger.info(" Scan Summary:")
-        logger.info(f"   New photos added: {processed_count}")
-        logger.info(f"   Existing images that were skipped: {skipped_count}")
-        logger.info(f"    Errors: {error_count}")
+        logger.info(f"   New photos added: {summary['processed']}")
+        logger.info(f"   Existing images that were skipped: {summary['skipped']}")
+        logger.info(f"    Errors: {summary['errors']}")
+        logger.info(f"   Caption cache hits: {summary['cache_hits']}, misses: {summary['cache_misses']}")
         logger.info(f"  Execution time: {duration}")
         logger.info(" Scan completed")
         return True
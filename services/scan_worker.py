@@ -0,0 +1,243 @@
+import time
+import queue
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+from config import SCAN_WORKER_MODE, SCAN_PROGRESS_INTERVAL
+logger = logging.getLogger(__name__)
+_STOP = None
+
+
+def _run_job(captioner, paths: List[str], cancelled: Callable[[], bool], publish: Callable[[Dict], None]) -> Dict:
+    """Ingest one job with a session of its own; progress goes out through publish()"""
+    from db.setup import SessionLocal
+    from services.ingestion_pipeline import IngestionPipeline
+    from services.file_manifest import mark_indexed
+
+    progress = {"processed": 0, "errors": 0, "current_image": "", "stages": {}}
+    last_publish = [0.0]
+    pipeline = None
+
+    def on_item(path, ok):
+        progress["current_image"] = path
+        progress["processed" if ok else "errors"] += 1
+        now = time.monotonic()
+        if now - last_publish[0] >= SCAN_PROGRESS_INTERVAL:
+            last_publish[0] = now
+            progress["stages"] = pipeline.stage_stats()
+            publish(dict(progress))
+
+    pipeline = IngestionPipeline(captioner, on_item=on_item, should_continue=lambda: not cancelled())
+    summary = pipeline.run(paths)
+    db = SessionLocal()
+    try:
+        # whatever did not make it (cancel, errors) stays pending in the manifest for the next scan
+        mark_indexed(db, paths)
+    finally:
+        db.close()
+    summary["cancelled"] = summary["cancelled"] or cancelled()
+    return summary
+
+
+def _worker_main(jobs, events, cancels) -> None:
+    """Entry point of the worker process: loads BLIP once and serves ingestion jobs until told to stop"""
+    logging.basicConfig(level=logging.INFO)
+    from services.blip_captioner import Blip2Captioner
+    captioner = Blip2Captioner.get_instance()
+    cancelled_ids = set()
+
+    def is_cancelled(job_id: int) -> bool:
+        try:
+            while True:
+                cancelled_ids.add(cancels.get_nowait())
+        except queue.Empty:
+            pass
+        return job_id in cancelled_ids
+
+    events.put(("ready", None, None))
+    while True:
+        job = jobs.get()
+        if job is _STOP:
+            break
+        job_id, paths = job
+        try:
+            summary = _run_job(captioner, paths, lambda: is_cancelled(job_id),
+                               lambda progress: events.put(("progress", job_id, progress)))
+            events.put(("done", job_id, summary))
+        except Exception as e:
+            logger.error(f"Scan job {job_id} failed: {e}")
+            events.put(("failed", job_id, str(e)))
+
+
+class ScanWorker:
+    """
+    Runs ingestion jobs away from the FastAPI event loop. In "process" mode BLIP lives in a
+    separate worker process with its own DB engine, so captioning never competes with request
+    handling for the GIL; "thread" mode keeps the previous in-process behaviour on a single
+    dedicated thread. Jobs run one at a time and report progress through callbacks.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, mode: str = SCAN_WORKER_MODE):
+        self.mode = mode
+        self._job_ids = itertools.count(1)
+        self._futures: Dict[int, Future] = {}
+        self._callbacks: Dict[int, Callable[[Dict], None]] = {}
+        self._lock = threading.Lock()
+        self._process = None
+        self._jobs = None
+        self._events = None
+        self._listener = None
+        self._thread_jobs = None
+        self._thread = None
+        # cancellation is per job, so a job submitted after a cancel is not stopped by it
+        self._cancels = None
+        self._cancelled_ids = set()
+        # spawn: the child must not inherit CUDA state or the parent's DB connections
+        self._context = multiprocessing.get_context("spawn") if mode == "process" else None
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return bool(self._futures)
+
+    def submit(self, paths: List[str], on_progress: Optional[Callable[[Dict], None]] = None) -> Future:
+        """Queue an ingestion job; the future resolves to the pipeline summary"""
+        self._ensure_started()
+        job_id = next(self._job_ids)
+        future = Future()
+        with self._lock:
+            self._futures[job_id] = future
+            if on_progress is not None:
+                self._callbacks[job_id] = on_progress
+        if self.mode == "process":
+            self._jobs.put((job_id, list(paths)))
+        else:
+            self._thread_jobs.put((job_id, list(paths)))
+        return future
+
+    def cancel(self, future: Future) -> None:
+        """Stop the job behind a submit() future at its next check; jobs submitted later are not affected"""
+        with self._lock:
+            job_id = next((job_id for job_id, pending in self._futures.items() if pending is future), None)
+            if job_id is None:
+                return
+            self._cancelled_ids.add(job_id)
+            if self._cancels is not None:
+                self._cancels.put(job_id)
+
+    def _is_cancelled(self, job_id: int) -> bool:
+        with self._lock:
+            return job_id in self._cancelled_ids
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            self.cancel(future)
+        if self._process is not None:
+            self._jobs.put(_STOP)
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+            self._events.put(("stopped", None, None))
+            self._listener.join(timeout)
+        if self._thread is not None:
+            self._thread_jobs.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+        self._fail_pending("scan worker stopped")
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self.mode == "process":
+                if self._process is not None and self._process.is_alive():
+                    return
+                if self._process is not None:
+                    logger.warning("Scan worker process died, starting a new one")
+                self._jobs = self._context.Queue()
+                self._events = self._context.Queue()
+                self._cancels = self._context.Queue()
+                self._process = self._context.Process(target=_worker_main, args=(self._jobs, self._events, self._cancels),
+                                                      name="scan-worker", daemon=True)
+                self._process.start()
+                if self._listener is None or not self._listener.is_alive():
+                    self._listener = threading.Thread(target=self._listen, name="scan-worker-events", daemon=True)
+                    self._listener.start()
+            elif self._thread is None or not self._thread.is_alive():
+                self._thread_jobs = queue.Queue()
+                self._thread = threading.Thread(target=self._serve_threaded, name="scan-worker", daemon=True)
+                self._thread.start()
+
+    def _serve_threaded(self) -> None:
+        from services.blip_captioner import Blip2Captioner
+        while True:
+            job = self._thread_jobs.get()
+            if job is _STOP:
+                break
+            job_id, paths = job
+            try:
+                summary = _run_job(Blip2Captioner.get_instance(), paths, lambda: self._is_cancelled(job_id),
+                                   lambda progress: self._handle("progress", job_id, progress))
+                self._handle("done", job_id, summary)
+            except Exception as e:
+                logger.error(f"Scan job {job_id} failed: {e}")
+                self._handle("failed", job_id, str(e))
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                kind, job_id, payload = self._events.get(timeout=1.0)
+            except queue.Empty:
+                if self._process is None:
+                    break
+                if not self._process.is_alive():
+                    self._fail_pending("scan worker process exited")
+                continue
+            except (EOFError, OSError):
+                break
+            if kind == "stopped":
+                break
+            if kind == "ready":
+                logger.info("Scan worker process is ready")
+                continue
+            self._handle(kind, job_id, payload)
+
+    def _handle(self, kind: str, job_id: int, payload) -> None:
+        with self._lock:
+            callback = self._callbacks.get(job_id)
+            future = None if kind == "progress" else self._futures.pop(job_id, None)
+            if future is not None:
+                self._callbacks.pop(job_id, None)
+                self._cancelled_ids.discard(job_id)
+        if callback is not None and kind == "progress":
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.warning(f"Scan progress callback failed: {e}")
+        if future is None:
+            return
+        if kind == "done":
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _fail_pending(self, reason: str) -> None:
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._callbacks.clear()
+            self._cancelled_ids.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
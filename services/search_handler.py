@@ -1,51 +1,81 @@
-from sqlalchemy import text
 from sqlalchemy.orm import Session
-from typing import List, Dict
-from services.text_encoder import encode_text, TextEncoder
-from db.models import SearchHistory
-from config import SCORE_THRESHOLD, MAX_RESULTS, ROUND_DECIMALS,MAXSIZE,TTL
-from services.custom_search_handler import get_matched_words
-from cachetools import TTLCache
+from typing import List, Dict, Optional
+from services.text_encoder import encode_query
+from services.search_history_buffer import record_search
+from db.vector_index import vector_search
+from services.vector_mirror import mirror_for
+from services.hybrid_search import hybrid_search
+from db.coco_image_access import coco_images_ready
+from config import (SCORE_THRESHOLD, MAX_RESULTS, ROUND_DECIMALS, SEARCH_MODE, COCO_SEARCH_TABLE,
+                    MULTI_VECTOR_OVERFETCH)
+from services.custom_search_handler import get_matched_words_batch
+from services.result_cache import get_result_cache
 import time
-search_cache = TTLCache(maxsize=MAXSIZE, ttl=TTL)
-def search_similar_images_service(query: str, db: Session) -> List[Dict]:
-    cache_key = query.strip().lower()
-    if cache_key in search_cache:
-        return search_cache[cache_key]
+_fused_ready = {}
+
+
+def _coco_table(db: Session) -> str:
+    """coco_images once compaction has filled it (checked again after every COCO ingestion), else images"""
+    if COCO_SEARCH_TABLE != "coco_images":
+        return COCO_SEARCH_TABLE
+    version = get_result_cache().version("coco")
+    # read once: another request thread may clear the dict between a check and a lookup
+    ready = _fused_ready.get(version)
+    if ready is None:
+        ready = coco_images_ready(db)
+        _fused_ready.clear()
+        _fused_ready[version] = ready
+    return "coco_images" if ready else "images"
+
+
+def _best_per_image(rows, limit: int) -> List:
+    # rows come closest first, so the first row of an image is its best caption
+    best = {}
+    for row in rows:
+        best.setdefault(row.image_path, row)
+    return list(best.values())[:limit]
+
+
+def search_similar_images_service(query: str, db: Session, ef_search: Optional[int] = None,
+                                  probes: Optional[int] = None, mode: Optional[str] = None) -> List[Dict]:
+    mode = mode or SEARCH_MODE
+    cache_key = (query.strip().lower(), ef_search, probes, mode)
+    # read before the query: an ingestion that commits meanwhile must leave this result stale
+    cache_version = get_result_cache().version("coco")
+    cached = get_result_cache().get("coco", cache_key)
+    if cached is not None:
+        return [dict(result) for result in cached]
     start_time = time.time()
-    query_embedding = encode_text(query)
+    query_embedding = encode_query(query)
     if query_embedding is None:
         return []
-    db.add(SearchHistory(query=query))
-    db.commit()
+    record_search(query)
     query_vector_str = str(query_embedding.tolist())
-    result = db.execute(
-        text("""
-            SELECT image_path, caption,
-                   (embedding <=> CAST(:query_vec AS vector)) AS distance
-            FROM images
-            WHERE embedding IS NOT NULL
-              AND (embedding <=> CAST(:query_vec AS vector)) <= :threshold
-            ORDER BY embedding <=> CAST(:query_vec AS vector)
-            LIMIT :limit
-        """),
-        {
-            "query_vec": query_vector_str,
-            "threshold": float(SCORE_THRESHOLD),
-            "limit": int(MAX_RESULTS)
-        }
-    )
-    model = TextEncoder.get_instance()
+    table = _coco_table(db)
+    # images holds ~5 caption rows per picture: over-fetch and keep each picture once (max-sim)
+    per_path = table == "images"
+    mirror = mirror_for(table)
+    if mode == "hybrid":
+        result = hybrid_search(table, query, query_embedding, MAX_RESULTS, SCORE_THRESHOLD,
+                               ef_search=ef_search, probes=probes)
+    elif mirror is not None:
+        result = mirror.search(query_embedding, MAX_RESULTS * (MULTI_VECTOR_OVERFETCH if per_path else 1),
+                               SCORE_THRESHOLD)
+    else:
+        result = vector_search(db, table, query_vector_str, limit=MAX_RESULTS, threshold=SCORE_THRESHOLD,
+                               ef_search=ef_search, probes=probes, per_path=per_path)
+    rows = _best_per_image(result, MAX_RESULTS)
+    matched_per_row = get_matched_words_batch(query, [row.caption for row in rows])
     final_results = []
-    for row in result:
+    for row, matched_words in zip(rows, matched_per_row):
         final_results.append({
             "filename": row.image_path,
             "caption": row.caption,
             "score": round(float(row.distance), ROUND_DECIMALS),
             "path": f"http://localhost:8001/coco_images/{row.image_path}",
-            "matched_words": get_matched_words(query, row.caption, model)
+            "matched_words": matched_words
         })
 
-    search_cache[cache_key] = final_results
+    get_result_cache().put("coco", cache_key, final_results, cache_version)
     print(f"Search completed in {time.time() - start_time:.2f} seconds. Found {len(final_results)} results.")
-    return final_results
+    return [dict(result) for result in final_results]
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import insert
+from db.setup import SessionLocal
+from db.models import SearchHistory
+from config import HISTORY_FLUSH_BATCH_SIZE, HISTORY_FLUSH_INTERVAL, HISTORY_BUFFER_MAX_PENDING
+logger = logging.getLogger(__name__)
+
+
+class SearchHistoryBuffer:
+    """
+    Write-behind buffer for search_history: searches only append to memory, and a background
+    thread writes the rows with one multi-row INSERT once HISTORY_FLUSH_BATCH_SIZE rows are
+    waiting or HISTORY_FLUSH_INTERVAL seconds have passed. stop() drains what is left.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, batch_size: int = HISTORY_FLUSH_BATCH_SIZE, interval: float = HISTORY_FLUSH_INTERVAL,
+                 max_pending: int = HISTORY_BUFFER_MAX_PENDING):
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        # if the database is unreachable for long, the oldest entries go first
+        self._pending = deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def add(self, query: str, results=None) -> None:
+        if not query or not query.strip():
+            return
+        row = {"query": query, "results": results, "timestamp": datetime.utcnow()}
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        self._ensure_started()
+
+    def flush(self) -> int:
+        """Write everything that is waiting now; returns the number of rows written"""
+        with self._flush_lock:
+            with self._condition:
+                rows = list(self._pending)
+                self._pending.clear()
+            if not rows:
+                return 0
+            db = SessionLocal()
+            try:
+                db.execute(insert(SearchHistory), rows)
+                db.commit()
+                self.written += len(rows)
+                return len(rows)
+            except Exception as e:
+                db.rollback()
+                self.failed_flushes += 1
+                logger.error(f"Could not write {len(rows)} search history rows: {e}")
+                with self._condition:
+                    # keep them for the next attempt, ahead of anything that arrived meanwhile;
+                    # past max_pending the oldest go (and are counted), as in add()
+                    retained = rows + list(self._pending)
+                    self.dropped += max(0, len(retained) - self._pending.maxlen)
+                    self._pending.clear()
+                    self._pending.extend(retained)
+                return 0
+            finally:
+                db.close()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._condition:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "dropped": self.dropped,
+                "failed_flushes": self.failed_flushes}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="search-history-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            deadline = time.monotonic() + self.interval
+            with self._condition:
+                while not self._stopping and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                break
+
+
+def record_search(query: str, results=None) -> None:
+    SearchHistoryBuffer.get_instance().add(query, results)
@@ -0,0 +1,281 @@
+import re
+import time
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from db.setup import SessionLocal
+from services.result_cache import get_result_cache
+from config import (SUGGEST_LIMIT, SUGGEST_REFRESH_SECONDS, SUGGEST_DELTA_MAX, SUGGEST_HISTORY_WEIGHT,
+                    SUGGEST_PREFIX_CACHE_SIZE)
+logger = logging.getLogger(__name__)
+# (table, text column, weight of one row); new rows are picked up by id, so every source needs one
+SOURCES = (("images", "caption", 1), ("user_images", "caption", 1), ("search_history", "query", SUGGEST_HISTORY_WEIGHT))
+FETCH_SIZE = 10000
+_TOKEN = re.compile(r"\w+")
+
+
+def normalize_suggestion(value: Optional[str]) -> str:
+    return " ".join(value.lower().split()) if value else ""
+
+
+def _tokens(key: str) -> List[str]:
+    return _TOKEN.findall(key)
+
+
+class _Snapshot:
+    """
+    Immutable, rank-ordered view of the suggestions: entry ids are ranks (most frequent first),
+    every token has a sorted posting array of entry ids (CSR), and tokens are sorted so all
+    tokens starting with a prefix are one contiguous range found with bisect.
+    """
+
+    def __init__(self, counts: Dict[str, int], display: Dict[str, str]):
+        self.keys = sorted(counts, key=lambda key: (-counts[key], len(key), key))
+        postings: Dict[str, List[int]] = {}
+        for entry, key in enumerate(self.keys):
+            for token in set(_tokens(key)):
+                postings.setdefault(token, []).append(entry)
+        self.tokens = sorted(postings)
+        self.token_ids = {token: i for i, token in enumerate(self.tokens)}
+        lengths = np.fromiter((len(postings[token]) for token in self.tokens), dtype=np.int64, count=len(self.tokens))
+        self.offsets = np.zeros(len(self.tokens) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.postings = np.fromiter((entry for token in self.tokens for entry in postings[token]),
+                                    dtype=np.int32, count=int(self.offsets[-1]))
+        self._prefix_top: "OrderedDict[Tuple[str, int], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # one-letter prefixes cover the most tokens and are typed first, so they are ready up front
+        for letter in sorted({token[0] for token in self.tokens}):
+            self.prefix_top(letter, SUGGEST_LIMIT)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def posting(self, token: str) -> np.ndarray:
+        i = self.token_ids.get(token)
+        if i is None:
+            return self.postings[:0]
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def prefix_top(self, prefix: str, limit: int) -> np.ndarray:
+        """The best limit entries having a token that starts with prefix (cached per prefix)"""
+        with self._lock:
+            cached = self._prefix_top.get((prefix, limit))
+            if cached is not None:
+                self._prefix_top.move_to_end((prefix, limit))
+                return cached
+        lo = bisect.bisect_left(self.tokens, prefix)
+        hi = bisect.bisect_left(self.tokens, prefix + "\uffff")
+        # postings are rank ordered, so the head of each list is all that can make the top
+        heads = [self.postings[self.offsets[i]:min(self.offsets[i + 1], self.offsets[i] + limit)] for i in range(lo, hi)]
+        top = np.unique(np.concatenate(heads))[:limit] if heads else self.postings[:0]
+        with self._lock:
+            self._prefix_top[(prefix, limit)] = top
+            while len(self._prefix_top) > SUGGEST_PREFIX_CACHE_SIZE:
+                self._prefix_top.popitem(last=False)
+        return top
+
+
+class SuggestionIndex:
+    """
+    In-memory autocomplete over distinct captions (COCO and user images) and past search
+    queries, ranked by how often each occurs. A typed text matches a suggestion when its
+    complete words are words of the suggestion and its last, partial word starts one.
+    New rows are pulled incrementally by id; they land in a small delta that is scanned
+    directly until it is folded into a rebuilt snapshot in the background.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._display: Dict[str, str] = {}
+        self._snapshot: Optional[_Snapshot] = None
+        self._delta: Dict[str, None] = {}
+        self._last_ids: Dict[str, int] = {}
+        self._last_refresh = 0.0
+        self._versions = None
+        self._refreshing = threading.Lock()
+        self._rebuilding = threading.Lock()
+        self.stats_counters = {"queries": 0, "refreshes": 0, "rebuilds": 0, "build_seconds": 0.0}
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def build(self, db) -> None:
+        """Load every source from scratch (startup); later calls of refresh() only read new rows"""
+        started = time.perf_counter()
+        counts: Dict[str, int] = {}
+        display: Dict[str, str] = {}
+        last_ids: Dict[str, int] = {}
+        for table, column, weight in SOURCES:
+            last_ids[table] = db.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar()
+            result = db.execute(text(f"""
+                SELECT {column} AS value, COUNT(*) AS occurrences FROM {table}
+                WHERE id <= :last_id AND {column} IS NOT NULL
+                GROUP BY {column}
+            """).execution_options(yield_per=FETCH_SIZE), {"last_id": last_ids[table]})
+            self._count_into(counts, display, ((row.value, row.occurrences * weight) for row in result))
+        snapshot = _Snapshot(counts, display)
+        with self._lock:
+            self._counts, self._display, self._last_ids = counts, display, last_ids
+            self._snapshot, self._delta = snapshot, {}
+            self._last_refresh = time.monotonic()
+        self.stats_counters["build_seconds"] = round(time.perf_counter() - started, 2)
+        logger.info(f"Suggestion index: {len(snapshot)} suggestions, {len(snapshot.tokens)} words, "
+                    f"built in {self.stats_counters['build_seconds']}s")
+
+    def refresh(self, db) -> int:
+        """Take in rows added since the last build/refresh; returns how many were read"""
+        if not self.ready:
+            return 0
+        read = 0
+        for table, column, weight in SOURCES:
+            last_id = self._last_ids.get(table, 0)
+            rows = db.execute(text(f"""
+                SELECT id, {column} AS value FROM {table}
+                WHERE id > :last_id AND {column} IS NOT NULL
+                ORDER BY id
+            """), {"last_id": last_id}).fetchall()
+            if not rows:
+                continue
+            self.add((row.value for row in rows), weight)
+            self._last_ids[table] = rows[-1].id
+            read += len(rows)
+        self._last_refresh = time.monotonic()
+        self.stats_counters["refreshes"] += 1
+        return read
+
+    def add(self, values: Iterable[str], weight: int = 1) -> None:
+        with self._lock:
+            added = self._count_into(self._counts, self._display, ((value, weight) for value in values))
+            for key in added:
+                self._delta[key] = None
+        if len(self._delta) > SUGGEST_DELTA_MAX:
+            self._rebuild_in_background()
+
+    def suggest(self, prefix: str, limit: int = SUGGEST_LIMIT) -> Optional[List[str]]:
+        """Best suggestions for what was typed so far, or None while the index is not built yet"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        self.stats_counters["queries"] += 1
+        self._maybe_refresh()
+        key = normalize_suggestion(prefix)
+        words = _tokens(key)
+        if not words:
+            return []
+        # a trailing space (or punctuation) means the last word is complete as well
+        partial = None if prefix[-1:].isspace() or not _TOKEN.match(key[-1]) else words.pop()
+        matchers = [re.compile(rf"(?<!\w){re.escape(word)}(?!\w)") for word in words]
+        if partial is not None:
+            matchers.append(re.compile(rf"(?<!\w){re.escape(partial)}"))
+
+        candidates = [snapshot.keys[entry] for entry in self._static_matches(snapshot, words, partial, matchers, limit)]
+        with self._lock:
+            delta = list(self._delta)
+            counts = self._counts
+            candidates += [candidate for candidate in delta if all(m.search(candidate) for m in matchers)]
+            ranked = sorted(dict.fromkeys(candidates), key=lambda candidate: (-counts.get(candidate, 0), len(candidate)))
+            return [self._display[candidate] for candidate in ranked[:limit]]
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            "ready": snapshot is not None,
+            "suggestions": len(self._counts),
+            "words": len(snapshot.tokens) if snapshot else 0,
+            "delta": len(self._delta),
+            "last_ids": dict(self._last_ids),
+            **self.stats_counters,
+        }
+
+    @staticmethod
+    def _static_matches(snapshot: _Snapshot, words: List[str], partial: Optional[str], matchers, limit: int):
+        if not words:
+            return snapshot.prefix_top(partial, limit).tolist()
+        # walk the shortest posting list in rank order and stop at limit: early termination
+        driver = min((snapshot.posting(word) for word in words), key=len)
+        found = []
+        for entry in driver.tolist():
+            if all(m.search(snapshot.keys[entry]) for m in matchers):
+                found.append(entry)
+                if len(found) == limit:
+                    break
+        return found
+
+    @staticmethod
+    def _count_into(counts: Dict[str, int], display: Dict[str, str], values) -> List[str]:
+        added = []
+        for value, weight in values:
+            key = normalize_suggestion(value)
+            if not key:
+                continue
+            if key not in counts:
+                counts[key] = 0
+                display[key] = " ".join(value.split())
+                added.append(key)
+            counts[key] += int(weight)
+        return added
+
+    def _ingest_versions(self) -> tuple:
+        # ingestion bumps these (also from the scan worker process), so new captions show up right away
+        cache = get_result_cache()
+        return cache.version("coco"), cache.version("user")
+
+    def _maybe_refresh(self) -> None:
+        versions = self._ingest_versions()
+        if versions == self._versions and time.monotonic() - self._last_refresh < SUGGEST_REFRESH_SECONDS:
+            return
+        if not self._refreshing.acquire(blocking=False):
+            return
+        self._last_refresh = time.monotonic()
+        self._versions = versions
+        threading.Thread(target=self._refresh_in_background, name="suggestion-refresh", daemon=True).start()
+
+    def _refresh_in_background(self) -> None:
+        db = SessionLocal()
+        try:
+            self.refresh(db)
+        except Exception as e:
+            logger.warning(f"Suggestion index refresh failed: {e}")
+        finally:
+            db.close()
+            self._refreshing.release()
+
+    def _rebuild_in_background(self) -> None:
+        if not self._rebuilding.acquire(blocking=False):
+            return
+        threading.Thread(target=self._rebuild, name="suggestion-rebuild", daemon=True).start()
+
+    def _rebuild(self) -> None:
+        """Fold the delta (and the new frequencies) into a fresh snapshot, from memory only"""
+        try:
+            with self._lock:
+                counts, display = dict(self._counts), dict(self._display)
+                folded = set(self._delta)
+            snapshot = _Snapshot(counts, display)
+            with self._lock:
+                self._snapshot = snapshot
+                # keys added while the snapshot was being built stay in the delta
+                self._delta = {key: None for key in self._delta if key not in folded}
+            self.stats_counters["rebuilds"] += 1
+        except Exception as e:
+            logger.warning(f"Suggestion index rebuild failed: {e}")
+        finally:
+            self._rebuilding.release()
+
+
+def get_suggestion_index() -> SuggestionIndex:
+    return SuggestionIndex.get_instance()
@@ -1,5 +1,11 @@
 from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import threading
+import numpy as np
 import os
+from sqlalchemy import text as sql_text
+from config import ENCODE_BATCH_SIZE, ENCODE_PARALLEL_MIN_TEXTS, QUERY_EMBEDDING_CACHE_SIZE, QUERY_WARMUP_COUNT
 
 class TextEncoder:
     _instance = None
@@ -17,3 +23,100 @@ def encode_text(text: str):
         normalize_embeddings=True
     ).astype("float32")
     return embedding
+def encode_texts(texts: List[str], batch_size: int = ENCODE_BATCH_SIZE, processes: Optional[int] = None) -> np.ndarray:
+    """
+    Encode many strings at once. Identical strings are encoded once, and the unique ones are
+    sorted by length so every batch pads to a similar length. processes > 1 spreads very large
+    loads over that many CPU worker processes. Returns a contiguous float32 matrix, one
+    normalized row per input string, in input order.
+    """
+    model = TextEncoder.get_instance()
+    dimension = model.get_sentence_embedding_dimension()
+    if not texts:
+        return np.zeros((0, dimension), dtype=np.float32)
+    row_of = {}
+    positions = np.fromiter((row_of.setdefault(text, len(row_of)) for text in texts), dtype=np.int64, count=len(texts))
+    unique = list(row_of)
+    order = sorted(range(len(unique)), key=lambda index: len(unique[index]))
+    by_length = [unique[index] for index in order]
+    batch_size = max(1, int(batch_size))
+    if processes and processes > 1 and len(by_length) >= ENCODE_PARALLEL_MIN_TEXTS:
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * int(processes))
+        try:
+            encoded = model.encode_multi_process(by_length, pool, batch_size=batch_size, normalize_embeddings=True)
+        finally:
+            model.stop_multi_process_pool(pool)
+    else:
+        encoded = np.empty((len(by_length), dimension), dtype=np.float32)
+        for start in range(0, len(by_length), batch_size):
+            encoded[start:start + batch_size] = model.encode(
+                by_length[start:start + batch_size],
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+    unique_rows = np.empty((len(unique), dimension), dtype=np.float32)
+    unique_rows[order] = encoded
+    return np.ascontiguousarray(unique_rows[positions])
+def normalize_query(query: str) -> str:
+    # the MiniLM tokenizer is uncased, so case and spacing never change the embedding
+    return " ".join(query.lower().split())
+class QueryEmbeddingCache:
+    """LRU of query embeddings keyed by the normalized query text"""
+    def __init__(self, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+    def get(self, query: str):
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            self.misses += 1
+        embedding = encode_text(key)
+        self.put(key, embedding)
+        return embedding
+    def put(self, key: str, embedding) -> None:
+        embedding = np.array(embedding, dtype=np.float32)
+        # shared between requests, so nobody may modify it in place
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    def warm(self, db, limit: int = QUERY_WARMUP_COUNT) -> int:
+        """Pre-encode the most frequent queries from search_history in one batch"""
+        rows = db.execute(sql_text("""
+            SELECT LOWER(TRIM(query)) AS query, COUNT(*) AS uses
+            FROM search_history
+            WHERE TRIM(query) != ''
+            GROUP BY LOWER(TRIM(query))
+            ORDER BY uses DESC
+            LIMIT :limit
+        """), {"limit": int(limit)})
+        queries = list(dict.fromkeys(normalize_query(row.query) for row in rows))
+        queries = [query for query in queries if query][:self.max_entries]
+        if not queries:
+            return 0
+        # least frequent first, so the most frequent ones end up as the most recently used
+        for query, embedding in reversed(list(zip(queries, encode_texts(queries)))):
+            self.put(query, embedding)
+        self.warmed = len(queries)
+        return self.warmed
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                    "warmed": self.warmed}
+query_embedding_cache = QueryEmbeddingCache()
+def encode_query(query: str):
+    """encode_text for search queries, served from the query embedding cache"""
+    return query_embedding_cache.get(query)
@@ -0,0 +1,194 @@
+import os
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+from PIL import Image, ImageOps
+from db.caption_cache_access import compute_content_hash
+from config import (THUMBNAIL_SIZES, THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_WORKERS,
+                    THUMBNAIL_QUALITY)
+logger = logging.getLogger(__name__)
+CONTENT_HASH_MEMO_SIZE = 4096
+
+
+class ThumbnailService:
+    """
+    Fixed-size JPEG thumbnails in an on-disk cache addressed by the content hash of the source,
+    so a copied or moved photo reuses its thumbnails. JPEG sources are decoded in draft mode
+    (the decoder scales by 1/2..1/8 while reading), generation runs on a small thread pool, and
+    the least recently used files are removed once the cache exceeds THUMBNAIL_CACHE_MAX_BYTES.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, cache_dir: str = THUMBNAIL_CACHE_DIR, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+                 workers: int = THUMBNAIL_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="thumbnail")
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        # cache file -> size, least recently used first; filled from disk on first use
+        self._files: Optional["OrderedDict[str, int]"] = None
+        self._bytes = 0
+        # (path, size, mtime_ns) -> content hash, so a source is read once per version, not per request
+        self._hashes: "OrderedDict[tuple, str]" = OrderedDict()
+        self.stats_counters = {"hits": 0, "generated": 0, "evicted": 0, "errors": 0}
+
+    @staticmethod
+    def size_of(size_name: str) -> int:
+        if size_name not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unknown thumbnail size: {size_name} (use one of {', '.join(THUMBNAIL_SIZES)})")
+        return THUMBNAIL_SIZES[size_name]
+
+    def cache_key(self, source_path: str, size_name: str) -> str:
+        return f"{self._content_hash(source_path)}_{self.size_of(size_name)}"
+
+    def etag(self, source_path: str, size_name: str) -> str:
+        """Validator from the source's stat only: a conditional request never reads the image"""
+        stat = os.stat(source_path)
+        return f"{self.size_of(size_name)}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+    def _content_hash(self, source_path: str) -> str:
+        stat = os.stat(source_path)
+        memo_key = (source_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            content_hash = self._hashes.get(memo_key)
+            if content_hash is not None:
+                self._hashes.move_to_end(memo_key)
+                return content_hash
+        content_hash = compute_content_hash(source_path)
+        with self._lock:
+            self._hashes[memo_key] = content_hash
+            while len(self._hashes) > CONTENT_HASH_MEMO_SIZE:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+    def thumbnail(self, source_path: str, size_name: str) -> str:
+        """Path of the cached thumbnail, generated first when missing (blocking)"""
+        key = self.cache_key(source_path, size_name)
+        target = os.path.join(self.cache_dir, key[:2], f"{key}.jpg")
+        self._ensure_index()
+        if os.path.exists(target):
+            self._touch(target)
+            self.stats_counters["hits"] += 1
+            return target
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            # the same thumbnail is being generated for another request
+            return future.result()
+        try:
+            self._generate(source_path, self.size_of(size_name), target)
+            future.set_result(target)
+            return target
+        except Exception as e:
+            self.stats_counters["errors"] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def get(self, source_path: str, size_name: str) -> str:
+        """thumbnail() on the pool, so decoding never blocks the event loop"""
+        return await asyncio.wrap_future(self._executor.submit(self.thumbnail, source_path, size_name))
+
+    def prefetch(self, paths: Iterable[str], sizes: Iterable[str] = ("small", "medium")) -> None:
+        """Queue thumbnails of freshly ingested images; failures only count as errors"""
+        for path in paths:
+            for size_name in sizes:
+                self._executor.submit(self._prefetch_one, path, size_name)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            files = len(self._files) if self._files is not None else None
+            return {"files": files, "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "inflight": len(self._inflight), **self.stats_counters}
+
+    def _prefetch_one(self, path: str, size_name: str) -> None:
+        try:
+            self.thumbnail(path, size_name)
+        except Exception as e:
+            logger.debug(f"Thumbnail prefetch failed for {path}: {e}")
+
+    def _generate(self, source_path: str, size: int, target: str) -> None:
+        with Image.open(source_path) as image:
+            # JPEG only: decode straight at the smallest 1/2^n scale that is still >= size
+            image.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # a unique name: the API and the scan worker process may write the same thumbnail
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(target), suffix=".tmp", delete=False) as tmp:
+                try:
+                    image.save(tmp, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+                except Exception:
+                    tmp.close()
+                    os.remove(tmp.name)
+                    raise
+        os.replace(tmp.name, target)
+        self.stats_counters["generated"] += 1
+        self._add(target, os.path.getsize(target))
+
+    def _ensure_index(self) -> None:
+        if self._files is not None:
+            return
+        with self._lock:
+            if self._files is not None:
+                return
+            found = []
+            if os.path.isdir(self.cache_dir):
+                for shard in os.scandir(self.cache_dir):
+                    if not shard.is_dir():
+                        continue
+                    for entry in os.scandir(shard.path):
+                        if entry.name.endswith(".jpg"):
+                            stat = entry.stat()
+                            found.append((stat.st_mtime, entry.path, stat.st_size))
+            found.sort()
+            self._files = OrderedDict((path, size) for _, path, size in found)
+            self._bytes = sum(size for _, _, size in found)
+
+    def _touch(self, path: str) -> None:
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+        try:
+            # the mtime is the recency the index is rebuilt from after a restart
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _add(self, path: str, size: int) -> None:
+        evict = []
+        with self._lock:
+            self._bytes += size - self._files.pop(path, 0)
+            self._files[path] = size
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                old_path, old_size = self._files.popitem(last=False)
+                self._bytes -= old_size
+                evict.append(old_path)
+        for old_path in evict:
+            try:
+                os.remove(old_path)
+                self.stats_counters["evicted"] += 1
+            except OSError:
+                pass
+
+
+def get_thumbnail_service() -> ThumbnailService:
+    return ThumbnailService.get_instance()
@@ -0,0 +1,319 @@
+import os
+import json
+import logging
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from config import VECTOR_MIRROR_DIR, VECTOR_MIRROR_COMPACT_EVERY, VECTOR_INDEXED_TABLES, SEARCH_BACKEND
+logger = logging.getLogger(__name__)
+EMBEDDING_DIM = 384
+LOAD_FETCH_SIZE = 5000
+_log_lock = threading.Lock()
+# same attribute names as the SQL result rows, so callers handle both backends alike
+MirrorHit = namedtuple("MirrorHit", ["image_path", "caption", "distance"])
+# tables keyed by path: an add for a known path replaces its row
+ONE_ROW_PER_PATH = ("user_images", "coco_images")
+
+
+def _file(table: str, suffix: str) -> str:
+    return os.path.join(VECTOR_MIRROR_DIR, f"{table}.{suffix}")
+
+
+def _append(table: str, records: List[Dict]) -> None:
+    """
+    Append change records to the table's delta log. Ingestion may run in another process
+    (see ScanWorker), so the log file - not memory - is how mirrors learn about new rows.
+    Only written with SEARCH_BACKEND="memory", since without a loaded mirror nothing would
+    ever compact the log. Callers append after their transaction has committed.
+    """
+    if SEARCH_BACKEND != "memory" or not records or table not in VECTOR_INDEXED_TABLES:
+        return
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    try:
+        with _log_lock:
+            os.makedirs(VECTOR_MIRROR_DIR, exist_ok=True)
+            with open(_file(table, "delta.jsonl"), "a", encoding="utf-8") as f:
+                f.write(lines)
+    except OSError as e:
+        # the mirror reconciles against Postgres on its next load, so a lost record is not fatal
+        logger.warning(f"Could not append to the {table} vector delta log: {e}")
+
+
+def record_added(table: str, rows: Iterable[Tuple[int, str, str, object]]) -> None:
+    """rows: (id, image_path, caption, embedding) of freshly inserted rows"""
+    _append(table, [{"op": "add", "id": int(row_id), "path": path, "caption": caption,
+                     "embedding": [float(value) for value in embedding]}
+                    for row_id, path, caption, embedding in rows])
+
+
+def record_removed(table: str, paths: Iterable[str]) -> None:
+    _append(table, [{"op": "remove", "path": path} for path in paths])
+
+
+def record_moved(table: str, moves: Iterable[Tuple[str, str]]) -> None:
+    _append(table, [{"op": "move", "path": old_path, "to": new_path} for old_path, new_path in moves])
+
+
+class VectorMirror:
+    """
+    In-memory copy of one table's embeddings as a contiguous, L2-normalised float32 matrix,
+    so a search is a single matrix-vector product. Postgres stays the source of truth: the
+    mirror starts from a memory-mapped snapshot, replays the delta log written by the
+    ingestion hooks, and falls back to reloading from the table when the counts disagree.
+    """
+    def __init__(self, table: str):
+        self.table = table
+        self.ready = False
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._ids: List[int] = []
+        self._paths: List[str] = []
+        self._captions: List[str] = []
+        self._rows_by_path: Dict[str, List[int]] = {}
+        self._pending: List[np.ndarray] = []
+        self._delta_offset = 0
+        self._delta_records = 0
+        self._snapshot_mtime = None
+        self._prefix_masks: Dict[str, np.ndarray] = {}
+
+    @property
+    def size(self) -> int:
+        return int(self._alive.sum())
+
+    def load(self, db) -> None:
+        with self._lock:
+            if not self._load_snapshot():
+                self._load_from_db(db)
+            self._catch_up()
+            if not self._matches_db(db):
+                logger.info(f"Vector mirror {self.table} is out of date, reloading from the database")
+                self._reset()
+                self._load_from_db(db)
+            self.save_snapshot()
+            self.ready = True
+            logger.info(f"Vector mirror {self.table}: {self.size} vectors")
+
+    def search(self, query_embedding, limit: int, threshold: float,
+               path_prefix: Optional[str] = None) -> List[MirrorHit]:
+        """Nearest rows by cosine distance, closest first, within threshold"""
+        with self._lock:
+            self._catch_up()
+            if not self._paths:
+                return []
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1.0)
+            distances = 1.0 - self._matrix @ query
+            mask = self._alive if path_prefix is None else self._alive & self._prefix_mask(path_prefix)
+            distances = np.where(mask & (distances <= threshold), distances, np.inf)
+            limit = min(int(limit), len(distances))
+            nearest = np.argpartition(distances, limit - 1)[:limit]
+            nearest = nearest[np.argsort(distances[nearest])]
+            return [MirrorHit(self._paths[row], self._captions[row], float(distances[row]))
+                    for row in nearest if np.isfinite(distances[row])]
+
+    def save_snapshot(self) -> None:
+        """Write matrix + metadata and start a fresh delta log (compaction)"""
+        with self._lock:
+            self._flush_pending()
+            keep = np.flatnonzero(self._alive)
+            os.makedirs(VECTOR_MIRROR_DIR, exist_ok=True)
+            delta_path = _file(self.table, "delta.jsonl")
+            compacting_path = _file(self.table, "delta.compacting")
+            # rotate first, then take in what was appended in the meantime, so no record is lost
+            if os.path.exists(delta_path):
+                os.replace(delta_path, compacting_path)
+                self._replay(compacting_path, self._delta_offset)
+                self._flush_pending()
+                keep = np.flatnonzero(self._alive)
+            # drop our own memory map of the old snapshot before replacing it (required on Windows)
+            self._matrix = np.ascontiguousarray(self._matrix[keep])
+            meta = {"ids": [self._ids[row] for row in keep], "paths": [self._paths[row] for row in keep],
+                    "captions": [self._captions[row] for row in keep]}
+            with open(_file(self.table, "npy.tmp"), "wb") as f:
+                np.save(f, self._matrix)
+            with open(_file(self.table, "meta.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(_file(self.table, "npy.tmp"), _file(self.table, "npy"))
+            os.replace(_file(self.table, "meta.json.tmp"), _file(self.table, "meta.json"))
+            if os.path.exists(compacting_path):
+                os.remove(compacting_path)
+            self._load_snapshot()
+            self._delta_records = 0
+
+    def _reset(self) -> None:
+        self._set_rows(np.zeros((0, EMBEDDING_DIM), dtype=np.float32), [], [], [])
+        self._pending = []
+
+    def _set_rows(self, matrix, ids, paths, captions) -> None:
+        self._matrix = matrix
+        self._alive = np.ones(len(ids), dtype=bool)
+        self._ids = list(ids)
+        self._paths = list(paths)
+        self._captions = list(captions)
+        self._rows_by_path = {}
+        for row, path in enumerate(self._paths):
+            self._rows_by_path.setdefault(path, []).append(row)
+        self._prefix_masks = {}
+
+    def _load_snapshot(self) -> bool:
+        try:
+            with open(_file(self.table, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            matrix = np.load(_file(self.table, "npy"), mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.info(f"No usable vector snapshot for {self.table} ({e})")
+            return False
+        if matrix.shape != (len(meta["ids"]), EMBEDDING_DIM):
+            return False
+        self._set_rows(matrix, meta["ids"], meta["paths"], meta["captions"])
+        self._pending = []
+        self._delta_offset = 0
+        self._snapshot_mtime = os.path.getmtime(_file(self.table, "meta.json"))
+        return True
+
+    def _load_from_db(self, db) -> None:
+        # records logged before this read are already in the table
+        try:
+            self._delta_offset = os.path.getsize(_file(self.table, "delta.jsonl"))
+        except OSError:
+            self._delta_offset = 0
+        ids, paths, captions, chunks = [], [], [], []
+        result = db.execute(text(f"SELECT id, image_path, caption, embedding FROM {self.table} ORDER BY id")
+                            .execution_options(yield_per=LOAD_FETCH_SIZE))
+        for row in result:
+            ids.append(row.id)
+            paths.append(row.image_path)
+            captions.append(row.caption)
+            chunks.append(self._parse_embedding(row.embedding))
+        matrix = self._normalize(np.vstack(chunks)) if chunks else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self._set_rows(matrix, ids, paths, captions)
+
+    def _matches_db(self, db) -> bool:
+        self._flush_pending()
+        count, max_id = db.execute(text(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {self.table}")).one()
+        alive_ids = [self._ids[row] for row in np.flatnonzero(self._alive)]
+        return count == len(alive_ids) and max_id == (max(alive_ids) if alive_ids else 0)
+
+    def _catch_up(self) -> None:
+        """Replay whatever was appended to the delta log since the last look; two stat() calls when nothing changed"""
+        try:
+            snapshot_mtime = os.path.getmtime(_file(self.table, "meta.json"))
+        except OSError:
+            snapshot_mtime = None
+        if snapshot_mtime is not None and snapshot_mtime != self._snapshot_mtime:
+            # another process compacted the log; its snapshot already holds everything before the rotation
+            self._load_snapshot()
+        delta_path = _file(self.table, "delta.jsonl")
+        try:
+            size = os.path.getsize(delta_path)
+        except OSError:
+            return
+        if size > self._delta_offset:
+            self._delta_offset = self._replay(delta_path, self._delta_offset)
+            self._flush_pending()
+            if self._delta_records >= VECTOR_MIRROR_COMPACT_EVERY:
+                self.save_snapshot()
+
+    def _replay(self, path: str, offset: int) -> int:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a record that is still being written
+                offset += len(line)
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Skipping bad vector delta record for {self.table}: {e}")
+        return offset
+
+    def _apply(self, record: Dict) -> None:
+        self._delta_records += 1
+        op = record["op"]
+        if op == "add":
+            if self.table in ONE_ROW_PER_PATH:
+                self._remove_path(record["path"])
+            row = len(self._ids)
+            self._ids.append(record["id"])
+            self._paths.append(record["path"])
+            self._captions.append(record["caption"])
+            self._rows_by_path.setdefault(record["path"], []).append(row)
+            self._pending.append(np.asarray(record["embedding"], dtype=np.float32))
+        elif op == "remove":
+            self._remove_path(record["path"])
+        elif op == "move":
+            rows = self._rows_by_path.pop(record["path"], [])
+            if rows:
+                self._remove_path(record["to"])
+            for row in rows:
+                self._paths[row] = record["to"]
+            if rows:
+                self._rows_by_path[record["to"]] = rows
+        self._prefix_masks = {}
+
+    def _remove_path(self, path: str) -> None:
+        for row in self._rows_by_path.pop(path, []):
+            if row < len(self._alive):
+                self._alive[row] = False
+            else:
+                self._pending[row - len(self._alive)] = None
+
+    def _flush_pending(self) -> None:
+        if not self._pending:
+            return
+        keep = [vector is not None for vector in self._pending]
+        rows = np.vstack([vector if vector is not None else np.zeros(EMBEDDING_DIM, dtype=np.float32)
+                          for vector in self._pending])
+        self._matrix = np.vstack([self._matrix, self._normalize(rows)])
+        self._alive = np.concatenate([self._alive, np.asarray(keep, dtype=bool)])
+        self._pending = []
+
+    def _prefix_mask(self, prefix: str) -> np.ndarray:
+        prefix = prefix.replace("\\", "/").lower()
+        mask = self._prefix_masks.get(prefix)
+        if mask is None or len(mask) != len(self._paths):
+            mask = np.fromiter((path.replace("\\", "/").lower().startswith(prefix) for path in self._paths),
+                               dtype=bool, count=len(self._paths))
+            self._prefix_masks[prefix] = mask
+        return mask
+
+    @staticmethod
+    def _parse_embedding(value) -> np.ndarray:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return np.asarray(value, dtype=np.float32)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+_mirrors: Dict[str, VectorMirror] = {}
+
+
+def get_mirror(table: str) -> VectorMirror:
+    if table not in _mirrors:
+        _mirrors[table] = VectorMirror(table)
+    return _mirrors[table]
+
+
+def load_mirrors(db) -> None:
+    for table in VECTOR_INDEXED_TABLES:
+        try:
+            get_mirror(table).load(db)
+        except Exception as e:
+            logger.error(f"Could not load the {table} vector mirror, searches fall back to Postgres: {e}")
+
+
+def mirror_for(table: str) -> Optional[VectorMirror]:
+    """The loaded mirror of a table when the in-memory backend is selected, otherwise None"""
+    if SEARCH_BACKEND != "memory":
+        return None
+    mirror = _mirrors.get(table)
+    return mirror if mirror is not None and mirror.ready else None
@@ -0,0 +1,180 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from sqlalchemy import text
+from services.text_encoder import encode_texts
+from config import WORD_VOCABULARY_FILE, QUERY_WORD_CACHE_SIZE, TOP_K, SCORE_THRESHOLD
+logger = logging.getLogger(__name__)
+CAPTION_FETCH_SIZE = 5000
+
+
+def tokenize(text_value: Optional[str]) -> List[str]:
+    """Same tokenization the matched-words feature always used: lower-cased, whitespace split"""
+    if not text_value:
+        return []
+    return [word.strip() for word in text_value.lower().split() if word.strip()]
+
+
+class WordVocabulary:
+    """
+    Embeddings of every caption token, as one normalized float32 matrix plus a token -> row
+    index, so matched words for a whole result page are a single matrix multiply. Tokens
+    that are not known yet are encoded in one batch the first time they show up. The table
+    is persisted to WORD_VOCABULARY_FILE; ingestion in the worker process extends the same
+    file, and every process merges in what the others added when the file changes.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path: str = WORD_VOCABULARY_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._index: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._pending: List[np.ndarray] = []
+        self._dirty = False
+        self._file_mtime = None
+        self._query_words: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._load_file()
+
+    @property
+    def size(self) -> int:
+        return len(self._index)
+
+    def add_tokens(self, tokens: Iterable[str]) -> None:
+        """Encode (in one batch) whichever of the tokens are not in the table yet"""
+        with self._lock:
+            missing = list(dict.fromkeys(token for token in tokens if token and token not in self._index))
+        if not missing:
+            return
+        # the model call runs outside the lock, so concurrent searches are not queued behind it
+        embeddings = np.asarray(encode_texts(missing), dtype=np.float32)
+        with self._lock:
+            fresh = [row for row, token in enumerate(missing) if token not in self._index]
+            if fresh:
+                self._append([missing[row] for row in fresh], embeddings[fresh])
+                self._dirty = True
+
+    def add_captions(self, captions: Iterable[str]) -> None:
+        self.add_tokens(token for caption in captions for token in tokenize(caption))
+
+    def build(self, db, tables=("images", "user_images")) -> None:
+        """Cover every caption token of the given tables; only unknown tokens are encoded"""
+        tokens = set()
+        for table in tables:
+            result = db.execute(text(f"SELECT caption FROM {table}").execution_options(yield_per=CAPTION_FETCH_SIZE))
+            for row in result:
+                tokens.update(tokenize(row.caption))
+        self.add_tokens(sorted(tokens))
+        self.save()
+        logger.info(f"Word vocabulary: {self.size} tokens")
+
+    def save(self) -> None:
+        with self._lock:
+            self._merge_file()
+            if not self._dirty:
+                return
+            self._flush()
+            tokens = sorted(self._index, key=self._index.get)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path + ".tmp", "wb") as f:
+                np.savez(f, tokens=np.array(tokens, dtype=str), matrix=self._matrix)
+            os.replace(self.path + ".tmp", self.path)
+            self._file_mtime = os.path.getmtime(self.path)
+            self._dirty = False
+
+    def matched_words(self, query: str, captions: List[str], top_k: int = TOP_K,
+                      threshold: float = SCORE_THRESHOLD) -> List[List[str]]:
+        """
+        For every caption, the query words whose best cosine similarity to any word of that
+        caption reaches threshold, best first, at most top_k.
+        """
+        query_words = tokenize(query)
+        caption_tokens = [tokenize(caption) for caption in captions]
+        if not query_words or not any(caption_tokens):
+            return [[] for _ in captions]
+        with self._lock:
+            self._merge_file()
+        self.add_tokens(token for tokens in caption_tokens for token in tokens)
+        query_matrix = self._query_matrix(query_words)
+        with self._lock:
+            self._flush()
+            columns = sorted({self._index[token] for tokens in caption_tokens for token in tokens})
+            similarities = query_matrix @ self._matrix[columns].T
+            column_of = {row: column for column, row in enumerate(columns)}
+            matched = []
+            for tokens in caption_tokens:
+                if not tokens:
+                    matched.append([])
+                    continue
+                best = similarities[:, [column_of[self._index[token]] for token in tokens]].max(axis=1)
+                order = np.argsort(-best, kind="stable")
+                matched.append([query_words[i] for i in order if best[i] >= threshold][:top_k])
+            return matched
+
+    def _query_matrix(self, query_words: List[str]) -> np.ndarray:
+        with self._lock:
+            cached = {word: self._query_words[word] for word in query_words if word in self._query_words}
+        missing = [word for word in dict.fromkeys(query_words) if word not in cached]
+        if missing:
+            cached.update(zip(missing, encode_texts(missing)))
+        with self._lock:
+            for word in dict.fromkeys(query_words):
+                self._query_words[word] = cached[word]
+                self._query_words.move_to_end(word)
+            while len(self._query_words) > QUERY_WORD_CACHE_SIZE:
+                self._query_words.popitem(last=False)
+        return np.vstack([cached[word] for word in query_words])
+
+    def _append(self, tokens: List[str], matrix: np.ndarray) -> None:
+        for token in tokens:
+            self._index[token] = len(self._index)
+        self._pending.append(np.asarray(matrix, dtype=np.float32))
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        parts = ([self._matrix] if self._matrix is not None else []) + self._pending
+        self._matrix = np.ascontiguousarray(np.vstack(parts))
+        self._pending = []
+
+    def _load_file(self) -> None:
+        with self._lock:
+            self._merge_file()
+
+    def _merge_file(self) -> None:
+        """Take in tokens another process saved since we last looked (one stat() when nothing changed)"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            # tokens are a fixed-width unicode array, so nothing is unpickled from disk
+            with np.load(self.path, allow_pickle=False) as data:
+                tokens = [str(token) for token in data["tokens"]]
+                matrix = data["matrix"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read word vocabulary {self.path}: {e}")
+            return
+        self._file_mtime = mtime
+        new_rows = [row for row, token in enumerate(tokens) if token not in self._index]
+        if new_rows:
+            self._append([tokens[row] for row in new_rows], matrix[new_rows])
+        # whatever we hold that the file lacks still has to be written
+        self._dirty = self._dirty or len(self._index) > len(tokens)
+
+
+def get_vocabulary() -> WordVocabulary:
+    return WordVocabulary.get_instance()